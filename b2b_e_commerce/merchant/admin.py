@@ -10,4 +10,9 @@ admin.site.register(ShopConnection)
 admin.site.register(Cart)
 admin.site.register(CartItem)
 admin.site.register(Order)
-admin.site.register(OrderItem)
\ No newline at end of file
+admin.site.register(OrderItem)
+admin.site.register(SupplierNotification)
+admin.site.register(Job)
+admin.site.register(DailyProductSales)
+admin.site.register(DailyBuyerSales)
+admin.site.register(ShopCandidate)
\ No newline at end of file
@@ -0,0 +1,17 @@
+from django.urls import path
+from . import async_views
+
+# Mounted at async/b2b; the paths match the sync read endpoints under b2b.
+urlpatterns = [
+    path('/login', async_views.login, name='async-signin'),
+    path('/shops', async_views.shops, name='async-shops'),
+    path('/shops/my', async_views.my_shops, name='async-my-shops'),
+    path('/<slug:shop_slug>', async_views.shop_detail, name='async-my-shop'),
+    path('/<slug:shop_slug>/sent-request', async_views.sent_requests, name='async-sent-request'),
+    path('/<slug:shop_slug>/received-requests', async_views.received_requests, name='async-received-requests'),
+    path('/<slug:shop_slug>/my-products', async_views.my_products, name='async-my-products'),
+    path('/<slug:shop_slug>/connected-shops', async_views.connected_shops, name='async-connected-shops'),
+    path('/<slug:shop_slug>/buy-products', async_views.buy_products, name='async-buy-products'),
+    path('/<slug:shop_slug>/cart', async_views.cart, name='async-cart'),
+    path('/<slug:shop_slug>/order', async_views.orders, name='async-order'),
+]
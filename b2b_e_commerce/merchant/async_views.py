@@ -0,0 +1,212 @@
+import asyncio
+import json
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from django.http import HttpResponseNotAllowed, JsonResponse
+from rest_framework.exceptions import APIException, NotAuthenticated, NotFound, ParseError, PermissionDenied
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import replace_query_param
+
+from .authentication import MerchantJWTAuthentication, MerchantRefreshToken
+from .models import *
+from .pagination import KeysetPagination, decode_cursor, encode_cursor, position, seek
+from .serializers import *
+
+# Async versions of the read endpoints, served under async/b2b. They are
+# plain Django coroutine views rather than DRF APIViews so that under ASGI a
+# request only holds the event loop while it waits on the database. The
+# response bodies are produced by the same serializers as the sync views.
+
+authentication = MerchantJWTAuthentication()
+
+# Password hashing is deliberately slow, so it runs on a small dedicated pool
+# instead of the event loop or the shared sync_to_async thread.
+password_hasher = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'ASYNC_LOGIN_WORKERS', 4),
+    thread_name_prefix='password-hasher',
+)
+
+
+def api_response(data, status=200):
+    return JsonResponse(data, status=status, encoder=JSONEncoder, safe=False)
+
+
+def async_api_view(methods=('GET',), authenticated=True):
+    def decorator(func):
+        @wraps(func)
+        async def view(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            try:
+                if authenticated:
+                    result = await authentication.aauthenticate(request)
+                    if result is None:
+                        raise NotAuthenticated()
+                    request.user = result[0]
+                if 'shop_slug' in kwargs:
+                    kwargs['shop'] = await aget_owned_shop(request, kwargs.pop('shop_slug'))
+                return await func(request, *args, **kwargs)
+            except APIException as exc:
+                detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+                return api_response(detail, status=exc.status_code)
+        # Token authenticated, like the DRF views.
+        view.csrf_exempt = True
+        return view
+    return decorator
+
+
+async def aget_owned_shop(request, shop_slug):
+    # Mirrors IsMerchantShop plus get_request_shop.
+    shop_slugs = getattr(request.user, 'shop_slugs', None)
+    if shop_slugs is not None and shop_slug not in shop_slugs:
+        raise PermissionDenied()
+    shop = await Shop.objects.select_related('merchant', 'category').filter(slug=shop_slug).afirst()
+    if shop is None or shop.merchant_id != request.user.pk:
+        raise PermissionDenied()
+    return shop
+
+
+async def aprefetch(instances, lookup):
+    # prefetch_related() can't run under async iteration in Django 4.2, so
+    # reverse foreign keys such as 'cartitem_set__product' are fetched here
+    # with one query and stored where prefetch_related would have put them.
+    if not instances:
+        return
+    accessor, _, select = lookup.partition('__')
+    relation = getattr(type(instances[0]), accessor).rel
+    children = relation.related_model.objects.filter(**{f'{relation.field.name}__in': [obj.pk for obj in instances]})
+    if select:
+        children = children.select_related(select)
+
+    by_parent = defaultdict(list)
+    async for child in children:
+        by_parent[getattr(child, relation.field.attname)].append(child)
+    for instance in instances:
+        queryset = getattr(instance, accessor).all()
+        queryset._result_cache = by_parent[instance.pk]
+        queryset._prefetch_done = True
+        instance._prefetched_objects_cache = {**getattr(instance, '_prefetched_objects_cache', {}), accessor: queryset}
+
+
+async def afetch(queryset, serializer_class):
+    queryset = queryset.select_related(*serializer_class.select_related_fields)
+    instances = [instance async for instance in queryset]
+    for lookup in serializer_class.prefetch_related_fields:
+        await aprefetch(instances, lookup)
+    return instances
+
+
+async def apaginate(request, queryset, serializer_class):
+    # The same (created_at, id) keyset and cursors as KeysetPagination,
+    # forward only, without DRF's request machinery.
+    pagination = KeysetPagination
+    try:
+        page_size = min(int(request.GET[pagination.page_size_query_param]), pagination.max_page_size)
+    except (KeyError, ValueError):
+        page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+    page_size = max(page_size, 1)
+
+    queryset = queryset.order_by(*pagination.ordering)
+    cursor = request.GET.get('cursor')
+    if cursor:
+        values, reverse = decode_cursor(cursor, queryset.model, pagination.ordering)
+        if reverse:
+            raise NotFound('Invalid cursor')
+        queryset = queryset.filter(seek(pagination.ordering, values))
+
+    instances = await afetch(queryset[:page_size + 1], serializer_class)
+    next_url = None
+    if len(instances) > page_size:
+        instances = instances[:page_size]
+        next_url = replace_query_param(request.build_absolute_uri(), 'cursor', encode_cursor(position(instances[-1], pagination.ordering)))
+    return api_response({'next': next_url, 'results': serializer_class(instances, many=True).data})
+
+
+@async_api_view(methods=('POST',), authenticated=False)
+async def login(request):
+    try:
+        payload = json.loads(request.body or b'{}')
+    except ValueError:
+        raise ParseError()
+    serializer = UserLoginSerializer(data=payload)
+    if not serializer.is_valid():
+        return api_response(serializer.errors, status=400)
+    email = serializer.validated_data['email']
+    password = serializer.validated_data['password']
+
+    loop = asyncio.get_running_loop()
+    user = await Merchant.objects.filter(email=email).afirst()
+    if user is None:
+        # Hash anyway so unknown emails take as long as wrong passwords.
+        await loop.run_in_executor(password_hasher, make_password, password)
+    elif await loop.run_in_executor(password_hasher, check_password, password, user.password) and user.is_active:
+        shop_slugs = [slug async for slug in Shop.objects.filter(merchant=user).values_list('slug', flat=True)]
+        refresh = MerchantRefreshToken.for_user(user, shop_slugs=shop_slugs)
+        return api_response({
+            'uid': user.uid,
+            'email': user.email,
+            'tokens': {
+                'access_token': str(refresh.access_token),
+                'refresh_token': str(refresh),
+            }
+        })
+    return api_response({'error': 'Invalid credentials'}, status=401)
+
+
+@async_api_view()
+async def shops(request):
+    return await apaginate(request, Shop.objects.all(), ShopSerializer)
+
+
+@async_api_view()
+async def my_shops(request):
+    return await apaginate(request, Shop.objects.filter(merchant_id=request.user.pk), ShopSerializer)
+
+
+@async_api_view()
+async def shop_detail(request, shop):
+    return api_response(MyShopDetailSerializer(shop).data)
+
+
+@async_api_view()
+async def sent_requests(request, shop):
+    return await apaginate(request, ShopConnection.objects.filter(sender_shop=shop), ConnectionRequestSerializer)
+
+
+@async_api_view()
+async def received_requests(request, shop):
+    return await apaginate(request, ShopConnection.objects.filter(receiver_shop=shop), ConnectionResponseSerializer)
+
+
+@async_api_view()
+async def my_products(request, shop):
+    return await apaginate(request, Product.objects.filter(shop=shop), ProductSerializer)
+
+
+@async_api_view()
+async def connected_shops(request, shop):
+    queryset = Shop.objects.filter(pk__in=ShopNeighbor.objects.neighbor_ids(shop))
+    return await apaginate(request, queryset, ShopSerializer)
+
+
+@async_api_view()
+async def buy_products(request, shop):
+    queryset = Product.objects.filter(shop_id__in=ShopNeighbor.objects.neighbor_ids(shop))
+    return await apaginate(request, queryset, ProductSerializer)
+
+
+@async_api_view()
+async def cart(request, shop):
+    carts = await afetch(Cart.objects.filter(shop=shop, user_id=request.user.pk, order=None), CartSerializer)
+    if not carts:
+        return api_response(['No cart for you'], status=400)
+    return api_response(CartSerializer(carts[0]).data)
+
+
+@async_api_view()
+async def orders(request, shop):
+    return await apaginate(request, Order.objects.filter(shop=shop), OrderSerializer)
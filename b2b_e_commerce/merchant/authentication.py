@@ -0,0 +1,123 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import Merchant, Shop
+
+SHOPS_CLAIM = 'shops'
+VERSION_CLAIM = 'ver'
+
+
+def token_version_key(merchant_id):
+    return f'merchant:{merchant_id}:token-version'
+
+
+# The cached version can be behind when another process bumped it and the
+# cache isn't shared, so a token that doesn't match is checked against the
+# database before it is turned away. Tokens revoked elsewhere may still pass
+# for up to MERCHANT_TOKEN_VERSION_TTL seconds unless CACHES is shared.
+
+def current_token_version(merchant_id, token_version=None):
+    key = token_version_key(merchant_id)
+    version = cache.get(key)
+    if version is None or version != token_version:
+        version = Merchant.objects.filter(pk=merchant_id).values_list('token_version', flat=True).first()
+        cache.set(key, version, settings.MERCHANT_TOKEN_VERSION_TTL)
+    return version
+
+
+async def acurrent_token_version(merchant_id, token_version=None):
+    key = token_version_key(merchant_id)
+    version = await cache.aget(key)
+    if version is None or version != token_version:
+        version = await Merchant.objects.filter(pk=merchant_id).values_list('token_version', flat=True).afirst()
+        await cache.aset(key, version, settings.MERCHANT_TOKEN_VERSION_TTL)
+    return version
+
+
+def bump_token_version(merchant_id, **updates):
+    # Tokens minted before the bump no longer pass the version check, so
+    # their shop claims can't outlive a change in ownership.
+    Merchant.objects.filter(pk=merchant_id).update(token_version=F('token_version') + 1, **updates)
+    cache.delete(token_version_key(merchant_id))
+
+
+class MerchantRefreshToken(RefreshToken):
+    @classmethod
+    def for_user(cls, user, shop_slugs=None):
+        # Async callers look the slugs up themselves and pass them in.
+        if shop_slugs is None:
+            shop_slugs = Shop.objects.filter(merchant=user).values_list('slug', flat=True)
+        token = super().for_user(user)
+        token[SHOPS_CLAIM] = list(shop_slugs)
+        token[VERSION_CLAIM] = user.token_version
+        token['is_staff'] = user.is_staff
+        token['is_superuser'] = user.is_superuser
+        return token
+
+
+class MerchantTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = MerchantRefreshToken
+
+
+class MerchantTokenUser(TokenUser):
+    @cached_property
+    def shop_slugs(self):
+        return frozenset(self.token.get(SHOPS_CLAIM, ()))
+
+
+class MerchantJWTAuthentication(JWTAuthentication):
+    # With MERCHANT_STATELESS_AUTH on, tokens carrying shop claims are turned
+    # into a MerchantTokenUser without loading the Merchant row; the only
+    # lookup left is the token version, which is served from the cache.
+    stateless = JWTStatelessUserAuthentication()
+
+    def get_user(self, validated_token):
+        if not settings.MERCHANT_STATELESS_AUTH or SHOPS_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+
+        user = self.stateless.get_user(validated_token)
+        version = validated_token.get(VERSION_CLAIM)
+        if version != current_token_version(user.pk, version):
+            raise AuthenticationFailed(_('Token is no longer valid, log in again.'), code='token_stale')
+        return user
+
+    async def aauthenticate(self, request):
+        # The same checks as authenticate(), for plain async Django views.
+        # Token decoding is CPU only; the user lookup goes through the async ORM.
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        if settings.MERCHANT_STATELESS_AUTH and SHOPS_CLAIM in validated_token:
+            user = self.stateless.get_user(validated_token)
+            version = validated_token.get(VERSION_CLAIM)
+            if version != await acurrent_token_version(user.pk, version):
+                raise AuthenticationFailed(_('Token is no longer valid, log in again.'), code='token_stale')
+            return user
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+        try:
+            user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return user
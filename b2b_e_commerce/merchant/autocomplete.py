@@ -0,0 +1,120 @@
+import heapq
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db.models import Count
+
+from .models import Category, Shop
+
+
+def index_keys(*values):
+    # Each value is indexed whole and from every word start, so "gre" finds
+    # "Organic Green Tea".
+    keys = set()
+    for value in values:
+        value = value.lower()
+        keys.add(value)
+        keys.update(value[match.start():] for match in re.finditer(r'\b\w', value))
+    return keys
+
+
+def entry(kind, uid, name, slug, popularity):
+    # (result, index keys, (whole-value keys, popularity, name for ranking))
+    result = {'type': kind, 'uid': uid, 'name': name, 'slug': slug}
+    return result, index_keys(name, slug), ({name.lower(), slug.lower()}, popularity, name.lower())
+
+
+class PrefixIndex:
+    # An in-process sorted array of (key, kind, pk) tuples searched with
+    # bisect. It is built lazily on first use, updated in place by the
+    # post_save/post_delete handlers in merchant.signals once their
+    # transaction commits, and rebuilt from the database once it is older
+    # than AUTOCOMPLETE_MAX_AGE seconds so writes made by other processes
+    # show up too.
+    #
+    # Matches are ranked: names and slugs that start with the prefix come
+    # before word matches inside them, then more popular entries (shops with
+    # more connections, categories with more shops), then shorter names.
+
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._keys = []
+        self._entries = {}
+        self._built_at = None
+
+    @property
+    def is_built(self):
+        return self._built_at is not None
+
+    def _max_age(self):
+        if self.max_age is not None:
+            return self.max_age
+        return getattr(settings, 'AUTOCOMPLETE_MAX_AGE', 300)
+
+    def rebuild(self):
+        entries = {}
+        shops = Shop.objects.annotate(popularity=Count('neighbor_links')).values_list('pk', 'uid', 'name', 'slug', 'popularity')
+        for pk, uid, name, slug, popularity in shops.iterator():
+            entries['shop', pk] = entry('shop', uid, name, slug, popularity)
+        categories = Category.objects.annotate(popularity=Count('shop')).values_list('pk', 'uid', 'title', 'slug', 'popularity')
+        for pk, uid, title, slug, popularity in categories.iterator():
+            entries['category', pk] = entry('category', uid, title, slug, popularity)
+        keys = sorted((key, kind, pk) for (kind, pk), (_, entry_keys, _) in entries.items() for key in entry_keys)
+        with self._lock:
+            self._entries, self._keys = entries, keys
+            self._built_at = time.monotonic()
+
+    def put(self, kind, pk, uid, name, slug):
+        with self._lock:
+            if not self.is_built:
+                return
+            # Popularity is only counted on rebuild; a renamed entry keeps its own.
+            previous = self._entries.get((kind, pk))
+            self._discard(kind, pk)
+            self._entries[kind, pk] = entry(kind, uid, name, slug, previous[2][1] if previous else 0)
+            for key in self._entries[kind, pk][1]:
+                insort(self._keys, (key, kind, pk))
+
+    def remove(self, kind, pk):
+        with self._lock:
+            if self.is_built:
+                self._discard(kind, pk)
+
+    def _discard(self, kind, pk):
+        entry = self._entries.pop((kind, pk), None)
+        if entry is None:
+            return
+        for key in entry[1]:
+            position = bisect_left(self._keys, (key, kind, pk))
+            if position < len(self._keys) and self._keys[position] == (key, kind, pk):
+                del self._keys[position]
+
+    def search(self, prefix, limit=10):
+        prefix = prefix.lower().strip()
+        if not prefix:
+            return []
+        if not self.is_built or time.monotonic() - self._built_at > self._max_age():
+            self.rebuild()
+
+        # Every match is scored, so a short prefix costs a scan of its whole
+        # key range; only the best `limit` are kept.
+        best = {}
+        with self._lock:
+            position = bisect_left(self._keys, (prefix,))
+            while position < len(self._keys):
+                key, kind, pk = self._keys[position]
+                if not key.startswith(prefix):
+                    break
+                result, _, (whole, popularity, name) = self._entries[kind, pk]
+                rank = (key not in whole, -popularity, len(name), name, kind, pk)
+                if (kind, pk) not in best or rank < best[kind, pk][0]:
+                    best[kind, pk] = (rank, result)
+                position += 1
+        return [result for _, result in heapq.nsmallest(limit, best.values(), key=lambda match: match[0])]
+
+
+index = PrefixIndex()
@@ -0,0 +1,479 @@
+import asyncio
+import itertools
+import os
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, connection
+from django.test.utils import (
+    CaptureQueriesContext,
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+from django.test import AsyncClient, Client
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from .authentication import MerchantRefreshToken
+from . import jobs, seeding
+from .carts import get_or_create_cart, set_cart_lines
+from .compiled import compile_serializer
+from .models import *
+from .renderers import ORJSONRenderer
+from .serializers import ProductSerializer
+
+SCENARIOS = {}
+
+
+def scenario(name, on_disk=False, note=None):
+    # on_disk scenarios write from several threads at once, which SQLite's
+    # shared in-memory test database answers with "table is locked" instead
+    # of waiting, so they get a file-backed test database. A note is printed
+    # ahead of the results.
+    def register(func):
+        func.on_disk = on_disk
+        func.note = note
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+@contextmanager
+def test_database(verbosity=0, on_disk=False):
+    # Benchmarks write a lot of rows, so they always run against a throwaway
+    # test database instead of the configured one.
+    test_settings = connection.settings_dict['TEST']
+    old_name = test_settings.get('NAME')
+    if on_disk and connection.vendor == 'sqlite':
+        test_settings['NAME'] = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+    setup_test_environment()
+    old_config = setup_databases(verbosity, interactive=False, aliases={'default'}, serialized_aliases=set())
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity)
+        teardown_test_environment()
+        test_settings['NAME'] = old_name
+
+
+def summarize(samples):
+    samples_ms = sorted(sample * 1000 for sample in samples)
+    if len(samples_ms) > 1:
+        percentiles = statistics.quantiles(samples_ms, n=100, method='inclusive')
+        p50, p95, p99 = percentiles[49], percentiles[94], percentiles[98]
+    else:
+        p50 = p95 = p99 = samples_ms[0]
+    return {
+        'samples': len(samples_ms),
+        'mean_ms': round(statistics.fmean(samples_ms), 3),
+        'p50_ms': round(p50, 3),
+        'p95_ms': round(p95, 3),
+        'p99_ms': round(p99, 3),
+    }
+
+
+def create_bench_merchant(email='bench@example.com'):
+    return Merchant.objects.create_user(email=email, name='Bench', dob=date(1990, 1, 1), password='bench-password')
+
+
+def create_bench_shop(merchant, category, name):
+    return Shop.objects.create(name=name, merchant=merchant, category=category, address='-', description='-')
+
+
+@scenario('checkout')
+def checkout(sizes=(1, 10, 100, 500), repeat=5, **options):
+    merchant = create_bench_merchant()
+    category = Category.objects.create(title='Bench')
+    buyer = create_bench_shop(merchant, category, 'Bench buyer')
+    supplier = create_bench_shop(merchant, category, 'Bench supplier')
+    ShopNeighbor.objects.connect(buyer, supplier)
+    products = Product.objects.bulk_create(
+        [
+            Product(title=f'Product {i}', slug=f'product-{i}', price=Decimal('1.00'), shop=supplier, quantity=10**6)
+            for i in range(max(sizes))
+        ]
+    )
+
+    client = APIClient()
+    client.force_authenticate(merchant)
+    url = f'/b2b/{buyer.slug}/confirm-order'
+    payload = {'delivery_address': 'Bench street 1', 'payment_method': PaymentOption.CASH_ON_DELIVERY}
+
+    results = []
+    for size in sizes:
+        samples, job_samples = [], []
+        for _ in range(repeat):
+            cart = Cart.objects.create(shop=buyer, user=merchant, total_price=size)
+            CartItem.objects.bulk_create(
+                [
+                    CartItem(user=merchant, shop=buyer, cart=cart, product=product, quantity=1, net_price=product.price)
+                    for product in products[:size]
+                ]
+            )
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = client.post(url, payload, format='json')
+                samples.append(time.perf_counter() - started)
+            if response.status_code != 201:
+                raise RuntimeError(f'Checkout failed with {response.status_code}: {response.content!r}')
+            # The order lines are written by the job checkout queued.
+            started = time.perf_counter()
+            jobs.work()
+            job_samples.append(time.perf_counter() - started)
+        results.append({'scenario': 'checkout', 'cart_size': size, 'queries': len(queries), **summarize(samples),
+                        'job_p50_ms': summarize(job_samples)['p50_ms']})
+    return results
+
+
+def run_wsgi_requests(path, headers, concurrency, total):
+    # Each worker thread plays one WSGI server thread.
+    def fetch(_):
+        started = time.perf_counter()
+        response = Client(headers=headers).get(path)
+        if response.status_code != 200:
+            raise RuntimeError(f'{path} failed with {response.status_code}: {response.content!r}')
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(fetch, range(total)))
+
+
+def run_asgi_requests(path, headers, concurrency, total):
+    async def run():
+        slots = asyncio.Semaphore(concurrency)
+
+        async def fetch():
+            async with slots:
+                started = time.perf_counter()
+                response = await AsyncClient().get(path, headers=headers)
+                if response.status_code != 200:
+                    raise RuntimeError(f'{path} failed with {response.status_code}: {response.content!r}')
+                return time.perf_counter() - started
+
+        return await asyncio.gather(*(fetch() for _ in range(total)))
+
+    return asyncio.run(run())
+
+
+@scenario('asgi', note=(
+    'In-process figures: the test clients call the WSGI and ASGI handlers directly, with no server in between. '
+    'Every async ORM call shares the one sync_to_async thread, so these compare the two views, not deployments; '
+    'measure behind uvicorn or daphne for production numbers.'
+))
+def asgi(sizes=(1, 10, 100, 500), repeat=5, **options):
+    # Sizes are concurrency levels; each level sends size * repeat requests
+    # for buy-products, through the sync view on the WSGI handler and through
+    # the async view on the ASGI handler. Both run inside this process.
+    merchant = create_bench_merchant()
+    category = Category.objects.create(title='Bench')
+    buyer = create_bench_shop(merchant, category, 'Bench buyer')
+    supplier = create_bench_shop(merchant, category, 'Bench supplier')
+    ShopNeighbor.objects.connect(buyer, supplier)
+    Product.objects.bulk_create(
+        [
+            Product(title=f'Product {i}', slug=f'product-{i}', price=Decimal('1.00'), shop=supplier, quantity=100)
+            for i in range(200)
+        ]
+    )
+    headers = {'Authorization': f'Bearer {MerchantRefreshToken.for_user(merchant).access_token}'}
+    modes = (
+        ('wsgi', run_wsgi_requests, f'/b2b/{buyer.slug}/buy-products'),
+        ('asgi', run_asgi_requests, f'/async/b2b/{buyer.slug}/buy-products'),
+    )
+
+    results = []
+    for concurrency in sizes:
+        total = concurrency * repeat
+        for mode, run, path in modes:
+            started = time.perf_counter()
+            samples = run(path, headers, concurrency, total)
+            elapsed = time.perf_counter() - started
+            results.append({
+                'scenario': 'asgi',
+                'mode': mode,
+                'server': 'in-process',
+                'concurrency': concurrency,
+                'throughput_rps': round(total / elapsed, 1),
+                **summarize(samples),
+            })
+    return results
+
+
+@scenario('serializers')
+def serializer_rendering(sizes=(1, 10, 100, 500), repeat=5, **options):
+    # Sizes are product rows. Each sample fetches and renders them with
+    # ProductSerializer + JSONRenderer and with the compiled serializer +
+    # ORJSONRenderer; both sides include the query.
+    merchant = create_bench_merchant()
+    category = Category.objects.create(title='Bench')
+    shop = create_bench_shop(merchant, category, 'Bench supplier')
+    Product.objects.bulk_create(
+        [
+            Product(title=f'Product {i}', slug=f'product-{i}', price=Decimal('1.00'), shop=shop, quantity=100)
+            for i in range(max(sizes))
+        ]
+    )
+    products = Product.objects.order_by('id')
+    compiled = compile_serializer(ProductSerializer)
+
+    def drf(size):
+        page = ProductSerializer.setup_eager_loading(products)[:size]
+        return JSONRenderer().render(ProductSerializer(page, many=True).data)
+
+    def fast(size):
+        return ORJSONRenderer().render(compiled.many(compiled.values(products[:size])))
+
+    results = []
+    for size in sizes:
+        for mode, render in (('drf', drf), ('compiled', fast)):
+            samples = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                render(size)
+                samples.append(time.perf_counter() - started)
+            results.append({'scenario': 'serializers', 'mode': mode, 'rows': size, **summarize(samples)})
+    return results
+
+
+def seed_dataset(merchants=20, categories=4, shops_per_category=10, connections_per_shop=1,
+                 products_per_shop=50, seed=0):
+    # A small run of the seed_data generator: one shared password hash, staff
+    # merchants (for /merchants) and stock deep enough that buying never runs
+    # out. Shops in a category form a ring, see seeding.SeedPlan.neighbors.
+    plan = seeding.SeedPlan(
+        seed=seed,
+        merchants=merchants,
+        categories=categories,
+        shops_per_category=shops_per_category,
+        connections_per_shop=connections_per_shop,
+        products_per_shop=products_per_shop,
+        carts=0,
+        cart_size=0,
+        orders_per_shop=0,
+        order_size=0,
+        password_hash=make_password('bench-password'),
+        created_at=timezone.now(),
+        first_ids=seeding.first_ids(),
+        staff=True,
+        stock=10**6,
+    )
+    seeding.seed_catalog(plan)
+    seeding.seed_products(plan, 0, plan.shops)
+    seeding.finish()
+    return list(Shop.objects.filter(pk__gte=plan.id(Shop, 0)).order_by('pk'))
+
+
+@dataclass
+class BenchClient:
+    merchant: Merchant
+    shop: Shop
+    supplier: Shop
+    products: list
+    headers: dict
+
+
+def bench_clients(shops, count, products=50):
+    # Each concurrent client acts as the owner of a shop that has at least
+    # one connection, buying from one of its neighbors.
+    connected = ShopNeighbor.objects.select_related('shop__merchant', 'neighbor').order_by('shop_id', 'neighbor_id')
+    firsts = {}
+    for link in connected:
+        firsts.setdefault(link.shop_id, link)
+    if not firsts:
+        raise RuntimeError('The seeded dataset has no connected shops; raise --connections-per-shop.')
+    links = list(firsts.values())
+    clients = []
+    for i in range(count):
+        link = links[i % len(links)]
+        token = MerchantRefreshToken.for_user(link.shop.merchant).access_token
+        clients.append(BenchClient(
+            merchant=link.shop.merchant,
+            shop=link.shop,
+            supplier=link.neighbor,
+            products=list(Product.objects.filter(shop=link.neighbor).only('id', 'uid', 'price', 'stock_shards')[:products]),
+            headers={'HTTP_AUTHORIZATION': f'Bearer {token}'},
+        ))
+    return clients
+
+
+def fill_cart(client, size):
+    cart = get_or_create_cart(client.shop, client.merchant)
+    set_cart_lines(cart, [(product, 1) for product in client.products[:size]])
+    return cart
+
+
+def pending_request(client):
+    # A fresh pending request from the supplier to the client's shop; it
+    # replaces whatever row that direction had.
+    ShopConnection.objects.filter(sender_shop=client.supplier, receiver_shop=client.shop).delete()
+    return ShopConnection.objects.create(sender_shop=client.supplier, receiver_shop=client.shop, status='pending')
+
+
+def import_file(client, i, rows=50):
+    batch = next(sequence)
+    lines = ['title,price,quantity'] + [f'Imported {batch}-{n},1.00,10' for n in range(rows)]
+    return SimpleUploadedFile('products.csv', '\n'.join(lines).encode(), content_type='text/csv')
+
+
+def send_request(client, i, cart_size):
+    ShopConnection.objects.filter(sender_shop=client.shop, receiver_shop=client.supplier).delete()
+    return f'/b2b/{client.shop.slug}/sent-request', {'receiver_shop_id': client.supplier.pk}
+
+
+def view_cart(client, i, cart_size):
+    fill_cart(client, cart_size)
+    return f'/b2b/{client.shop.slug}/cart', None
+
+
+def remove_from_cart(client, i, cart_size):
+    fill_cart(client, cart_size)
+    return f'/b2b/{client.shop.slug}/cart', {'uid': str(client.products[0].uid)}
+
+
+def place_order(client, i, cart_size):
+    fill_cart(client, cart_size)
+    return f'/b2b/{client.shop.slug}/confirm-order', {
+        'delivery_address': 'Bench street 1', 'payment_method': PaymentOption.CASH_ON_DELIVERY}
+
+
+def replay_order(client, i, cart_size):
+    # A client retrying an order it already placed: the first call (untimed)
+    # stores the response, the measured ones are replays.
+    key = f'bench-order-{client.shop.pk}'
+    path, data = place_order(client, i, cart_size)
+    if not IdempotencyKey.objects.filter(user=client.merchant, key=key).exists():
+        APIClient().post(path, data, format='json', HTTP_IDEMPOTENCY_KEY=key, **client.headers)
+    return path, data, {'HTTP_IDEMPOTENCY_KEY': key}
+
+
+# Unique suffixes for rows the write endpoints create.
+sequence = itertools.count()
+
+# (name, method, build). build(client, i, cart_size) does any untimed setup
+# and returns the path and the request body for the i-th request.
+ENDPOINTS = [
+    ('merchants', 'get', lambda c, i, n: ('/b2b/merchants', None)),
+    ('signup', 'post', lambda c, i, n: ('/b2b/signup', {
+        'email': f'signup-{next(sequence)}@example.com', 'name': 'Signup',
+        'dob': '1990-01-01', 'password1': 'bench-password', 'password2': 'bench-password'})),
+    ('login', 'post', lambda c, i, n: ('/b2b/login', {'email': c.merchant.email, 'password': 'bench-password'})),
+    ('category-list', 'get', lambda c, i, n: ('/b2b/categories', None)),
+    ('category-create', 'post', lambda c, i, n: ('/b2b/create-category', {'title': f'Category {next(sequence)}'})),
+    ('shops', 'get', lambda c, i, n: ('/b2b/shops', None)),
+    ('my-shops', 'get', lambda c, i, n: ('/b2b/shops/my', None)),
+    ('my-shops-create', 'post', lambda c, i, n: ('/b2b/shops/my', {
+        'name': f'Created shop {next(sequence)}', 'address': '-', 'description': '-', 'category_id': c.shop.category_id})),
+    ('shop-autocomplete', 'get', lambda c, i, n: ('/b2b/shops/autocomplete?q=bench', None)),
+    ('my-shop', 'get', lambda c, i, n: (f'/b2b/{c.shop.slug}', None)),
+    ('my-shop-activate', 'post', lambda c, i, n: (f'/b2b/{c.shop.slug}', {})),
+    ('sent-request', 'get', lambda c, i, n: (f'/b2b/{c.shop.slug}/sent-request', None)),
+    ('sent-request-create', 'post', send_request),
+    ('received-requests', 'get', lambda c, i, n: (f'/b2b/{c.shop.slug}/received-requests', None)),
+    ('received-request', 'get', lambda c, i, n: (
+        f'/b2b/{c.shop.slug}/received-requests/{pending_request(c).uid}', None)),
+    ('received-request-approve', 'patch', lambda c, i, n: (
+        f'/b2b/{c.shop.slug}/received-requests/{pending_request(c).uid}', {'status': 'approved'})),
+    ('my-products', 'get', lambda c, i, n: (f'/b2b/{c.shop.slug}/my-products', None)),
+    ('my-products-create', 'post', lambda c, i, n: (
+        f'/b2b/{c.shop.slug}/my-products', {'title': f'Created product {next(sequence)}', 'price': '1.00', 'quantity': 10})),
+    ('product-import', 'multipart', lambda c, i, n: (
+        f'/b2b/{c.shop.slug}/my-products/import', {'file': import_file(c, i)})),
+    ('same-category', 'get', lambda c, i, n: (f'/b2b/{c.shop.slug}/same-category', None)),
+    ('discover', 'get', lambda c, i, n: (f'/b2b/{c.shop.slug}/discover', None)),
+    ('connected-shops', 'get', lambda c, i, n: (f'/b2b/{c.shop.slug}/connected-shops', None)),
+    ('buy-products', 'get', lambda c, i, n: (f'/b2b/{c.shop.slug}/buy-products', None)),
+    ('buy-products-add', 'post', lambda c, i, n: (
+        f'/b2b/{c.shop.slug}/buy-products', {'uid': str(c.products[i % len(c.products)].uid), 'quantity': 1})),
+    ('buy-products-batch', 'post', lambda c, i, n: (
+        f'/b2b/{c.shop.slug}/buy-products', {'items': [{'uid': str(p.uid), 'quantity': 2} for p in c.products[:n]]})),
+    ('product-search', 'get', lambda c, i, n: (f'/b2b/{c.shop.slug}/search?q=bench', None)),
+    ('cart', 'get', view_cart),
+    ('cart-remove', 'delete', remove_from_cart),
+    ('order-create', 'post', place_order),
+    ('order-create-replay', 'post', replay_order),
+    ('order', 'get', lambda c, i, n: (f'/b2b/{c.shop.slug}/order', None)),
+    ('analytics', 'get', lambda c, i, n: (f'/b2b/{c.shop.slug}/analytics', None)),
+]
+
+
+def build_request(build, bench_client, i, cart_size, attempts=10):
+    # Setup is untimed and serialized across threads; on SQLite it can still
+    # collide with an in-flight request's write, so it is retried.
+    for attempt in range(attempts):
+        try:
+            with setup_lock:
+                return build(bench_client, i, cart_size)
+        except OperationalError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.01 * (attempt + 1))
+
+
+setup_lock = threading.Lock()
+
+
+def drive_endpoint(clients, method, build, concurrency, total, cart_size):
+    def call(i):
+        bench_client = clients[i % len(clients)]
+        # Builders may return extra headers after the path and data.
+        path, data, *extra = build_request(build, bench_client, i, cart_size)
+        headers = {**bench_client.headers, **(extra[0] if extra else {})}
+        # Server errors come back as 500s and count as errors instead of
+        # aborting the run.
+        api = APIClient(raise_request_exception=False)
+        if method == 'multipart':
+            send, kwargs = api.post, {'data': data, 'format': 'multipart'}
+        else:
+            send, kwargs = getattr(api, method), ({'data': data, 'format': 'json'} if data is not None else {})
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = send(path, **kwargs, **headers)
+            elapsed = time.perf_counter() - started
+        return elapsed, len(queries), response.status_code < 400
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(call, range(total)))
+    wall = time.perf_counter() - started
+    return outcomes, wall
+
+
+@scenario('endpoints', on_disk=True)
+def endpoints(sizes=(1, 10), repeat=5, merchants=20, categories=4, shops_per_category=10,
+              connections_per_shop=1, products_per_shop=50, cart_size=10, seed=0, only=None, **options):
+    # Sizes are concurrency levels; every route in merchant/urls.py gets
+    # size * repeat requests from `size` threads. Wall time includes the
+    # untimed per-request setup, so throughput is a lower bound.
+    shops = seed_dataset(merchants, categories, shops_per_category, connections_per_shop, products_per_shop, seed)
+    clients = bench_clients(shops, max(sizes))
+
+    results = []
+    for concurrency in sizes:
+        for name, method, build in ENDPOINTS:
+            if only and name not in only:
+                continue
+            total = concurrency * repeat
+            outcomes, wall = drive_endpoint(clients[:concurrency], method, build, concurrency, total, cart_size)
+            results.append({
+                'scenario': 'endpoints',
+                'endpoint': name,
+                'method': 'post' if method == 'multipart' else method,
+                'concurrency': concurrency,
+                'errors': sum(1 for _, _, ok in outcomes if not ok),
+                'queries': round(statistics.fmean(count for _, count, _ in outcomes), 1),
+                'throughput_rps': round(total / wall, 1),
+                **summarize([elapsed for elapsed, _, _ in outcomes]),
+            })
+    return results
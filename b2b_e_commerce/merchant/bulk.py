@@ -0,0 +1,42 @@
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+# Bulk writes that skip model instances: rows are plain sequences written
+# with executemany. Used where bulk_create's per-object work would dominate,
+# such as seed data and the discovery refresh.
+
+
+def insert_rows(model, field_names, rows, batch_size=5000, prepared=False):
+    # prepared rows already hold database values.
+    fields = [model._meta.get_field(name) for name in field_names]
+    quote = connection.ops.quote_name
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(model._meta.db_table),
+        ', '.join(quote(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)),
+    )
+    prepare = [field.get_db_prep_save for field in fields]
+    count, batch = 0, []
+    with connection.cursor() as cursor:
+        for row in rows:
+            batch.append(row if prepared else [prep(value, connection) for prep, value in zip(prepare, row)])
+            if len(batch) >= batch_size:
+                with transaction.atomic():
+                    cursor.executemany(sql, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            with transaction.atomic():
+                cursor.executemany(sql, batch)
+            count += len(batch)
+    return count
+
+
+def reset_sequences(models):
+    # Rows inserted with explicit ids leave the primary key sequences behind
+    # on PostgreSQL; move them past the highest id. SQLite needs nothing.
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
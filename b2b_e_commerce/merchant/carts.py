@@ -0,0 +1,99 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import inventory
+from .models import Cart, CartItem
+
+
+# Cart.total_price and Cart.item_count are kept in step with the cart lines
+# using F() deltas, so changing one line never re-reads the whole cart. Line
+# quantities are reserved from stock through merchant.inventory.
+
+def get_or_create_cart(shop, user):
+    cart, _ = Cart.objects.get_or_create(shop=shop, user_id=user.pk, order=None, defaults={'total_price': 0})
+    return cart
+
+
+def _apply_delta(cart, price_delta, count_delta):
+    Cart.objects.filter(pk=cart.pk).update(
+        total_price=F('total_price') + price_delta,
+        item_count=F('item_count') + count_delta,
+    )
+
+
+def set_cart_lines(cart, lines):
+    # lines is a list of (product, quantity) pairs; later pairs for the same
+    # product win. All existing lines are read in one query, the stock is
+    # reserved in one update where possible, and the lines are written back
+    # with one bulk insert and one bulk update. Returns
+    # {product.pk: 'added' | 'updated' | 'out_of_stock'}; a line that can't
+    # be reserved is left as it was.
+    wanted = {product.pk: (product, quantity) for product, quantity in lines}
+    outcomes = {}
+    with transaction.atomic():
+        existing = {
+            item.product_id: item
+            for item in CartItem.objects.select_for_update().filter(cart=cart, product_id__in=wanted)
+        }
+        reservations = []
+        for product, quantity in wanted.values():
+            item = existing.get(product.pk)
+            held = item.quantity if item is not None and item.reserved_until else 0
+            if quantity < held:
+                inventory.release(product.pk, held - quantity, product.stock_shards)
+            else:
+                reservations.append((product.pk, quantity - held, product.stock_shards))
+        out_of_stock = inventory.reserve_many(reservations)
+
+        now = timezone.now()
+        reserved_until = inventory.reservation_deadline()
+        new_items, changed_items = [], []
+        price_delta = 0
+        for product, quantity in wanted.values():
+            if product.pk in out_of_stock:
+                outcomes[product.pk] = 'out_of_stock'
+                continue
+            net_price = product.price * quantity
+            item = existing.get(product.pk)
+            if item is None:
+                new_items.append(CartItem(
+                    cart=cart,
+                    shop_id=cart.shop_id,
+                    user_id=cart.user_id,
+                    product=product,
+                    quantity=quantity,
+                    net_price=net_price,
+                    reserved_until=reserved_until,
+                ))
+                price_delta += net_price
+                outcomes[product.pk] = 'added'
+            else:
+                price_delta += net_price - item.net_price
+                item.quantity = quantity
+                item.net_price = net_price
+                item.updated_at = now
+                item.reserved_until = reserved_until
+                changed_items.append(item)
+                outcomes[product.pk] = 'updated'
+
+        CartItem.objects.bulk_create(new_items)
+        CartItem.objects.bulk_update(changed_items, ['quantity', 'net_price', 'updated_at', 'reserved_until'])
+        _apply_delta(cart, price_delta, len(new_items))
+    return outcomes
+
+
+def set_cart_line(cart, product, quantity):
+    return set_cart_lines(cart, [(product, quantity)])[product.pk]
+
+
+def remove_cart_line(cart, product):
+    with transaction.atomic():
+        item = CartItem.objects.select_for_update().filter(cart=cart, product=product).first()
+        if item is None:
+            return False
+        item.delete()
+        if item.reserved_until:
+            inventory.release(product.pk, item.quantity, product.stock_shards)
+        _apply_delta(cart, -item.net_price, -1)
+    return True
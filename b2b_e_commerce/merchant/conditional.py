@@ -0,0 +1,40 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+
+def collection_validators(request, queryset, fields):
+    # One aggregate query over the listed rows: the newest updated_at across
+    # `fields` (the rows themselves plus any related rows they render) and the
+    # row count, so deletes change the validators too. The full path is part
+    # of the ETag because each cursor, page size and filter is its own page.
+    aggregates = {f'last_{index}': Max(field) for index, field in enumerate(fields)}
+    summary = queryset.order_by().aggregate(count=Count('pk'), **aggregates)
+    timestamps = [summary[key] for key in aggregates if summary[key] is not None]
+    last_modified = max(timestamps) if timestamps else None
+
+    fingerprint = f'{summary["count"]}|{last_modified.isoformat() if last_modified else ""}|{request.get_full_path()}'
+    return {
+        'etag': quote_etag(hashlib.sha1(fingerprint.encode()).hexdigest()),
+        'last_modified': int(last_modified.timestamp()) if last_modified else None,
+    }
+
+
+def conditional_response(request, etag, last_modified):
+    # Returns a 304 when the client's If-None-Match / If-Modified-Since still
+    # match, otherwise None.
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # Every merchant sees a different collection behind the same URL.
+    patch_vary_headers(response, ['Authorization'])
+    return response
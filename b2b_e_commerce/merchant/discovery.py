@@ -0,0 +1,130 @@
+import math
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .models import Order, Product, Shop, ShopCandidate, ShopConnection, ShopNeighbor
+from .bulk import insert_rows
+
+# Discovery suggests shops of the same category to connect to. Ranking needs
+# every shop's product count, last activity and the mutual connections
+# (shops both are connected to, from ShopNeighbor), which is too much work for
+# a request; refresh() computes it per category and keeps each shop's best
+# DISCOVERY_CANDIDATES in ShopCandidate. The discovery view reads those rows
+# and drops shops connected or requested since the last refresh; a new shop
+# gets its rows from a refresh_category job queued when it is created.
+
+PRODUCT_WEIGHT = 1.0
+MUTUAL_WEIGHT = 2.0
+ACTIVITY_WEIGHT = 3.0
+# Days after which the activity bonus has halved.
+ACTIVITY_HALF_LIFE = 14
+
+FIELDS = ['shop', 'candidate', 'score', 'product_count', 'mutual_connections', 'last_active_at', 'refreshed_at']
+
+
+def shop_stats(category_id):
+    """{shop id: [product count, last activity]} for the shops of a category."""
+    stats = {
+        shop_id: [0, updated_at]
+        for shop_id, updated_at in Shop.objects.filter(category_id=category_id).values_list('pk', 'updated_at')
+    }
+    products = (
+        Product.objects.filter(shop__category_id=category_id).order_by().values('shop_id')
+        .annotate(count=Count('pk'), last=Max('updated_at')).values_list('shop_id', 'count', 'last')
+    )
+    orders = (
+        Order.objects.filter(shop__category_id=category_id).order_by().values('shop_id')
+        .annotate(last=Max('created_at')).values_list('shop_id', 'last')
+    )
+    for shop_id, count, last in products:
+        stats[shop_id][0] = count
+        stats[shop_id][1] = max(stats[shop_id][1], last)
+    for shop_id, last in orders:
+        stats[shop_id][1] = max(stats[shop_id][1], last)
+    return stats
+
+
+def base_score(product_count, last_active_at, now):
+    idle_days = max((now - last_active_at).total_seconds(), 0) / 86400
+    return PRODUCT_WEIGHT * math.log1p(product_count) + ACTIVITY_WEIGHT * 0.5 ** (idle_days / ACTIVITY_HALF_LIFE)
+
+
+def rank(shop_ids, category_id, stats, by_base, limit, now):
+    """ShopCandidate rows (in FIELDS order, database values) for shop_ids."""
+    # Connected and requested shops, in either direction.
+    excluded = defaultdict(set)
+    for shop_id, other_id in ShopConnection.objects.filter(sender_shop_id__in=shop_ids).values_list('sender_shop_id', 'receiver_shop_id'):
+        excluded[shop_id].add(other_id)
+    for other_id, shop_id in ShopConnection.objects.filter(receiver_shop_id__in=shop_ids).values_list('sender_shop_id', 'receiver_shop_id'):
+        excluded[shop_id].add(other_id)
+
+    # Two hops through ShopNeighbor: shop -> neighbor -> candidate.
+    neighbors = defaultdict(list)
+    for shop_id, neighbor_id in ShopNeighbor.objects.filter(shop_id__in=shop_ids).values_list('shop_id', 'neighbor_id'):
+        neighbors[shop_id].append(neighbor_id)
+    second_hop = defaultdict(list)
+    middle = {neighbor_id for ids in neighbors.values() for neighbor_id in ids}
+    for neighbor_id, candidate_id in (
+        ShopNeighbor.objects.filter(shop_id__in=middle, neighbor__category_id=category_id).values_list('shop_id', 'neighbor_id')
+    ):
+        second_hop[neighbor_id].append(candidate_id)
+
+    rows = []
+    for shop_id in shop_ids:
+        skip = excluded[shop_id] | {shop_id}
+        mutual = Counter(candidate_id for neighbor_id in neighbors[shop_id] for candidate_id in second_hop[neighbor_id])
+        # Without mutual connections the base score decides, so only the
+        # first limit eligible shops by base score can make the cut.
+        pool = set(mutual) - skip
+        extra = 0
+        for candidate_id in by_base:
+            if extra >= limit:
+                break
+            if candidate_id not in skip and candidate_id not in pool:
+                pool.add(candidate_id)
+                extra += 1
+        ranked = sorted(
+            ((stats[candidate_id][2] + MUTUAL_WEIGHT * mutual[candidate_id], candidate_id) for candidate_id in pool),
+            reverse=True,
+        )[:limit]
+        rows += [
+            (shop_id, candidate_id, score, stats[candidate_id][0], mutual[candidate_id], stats[candidate_id][3], now)
+            for score, candidate_id in ranked
+        ]
+    return rows
+
+
+def refresh_category(category_id, shop_ids=None, limit=None, batch_size=500):
+    """Recompute the candidates of a category's shops (or just shop_ids)."""
+    limit = limit or settings.DISCOVERY_CANDIDATES
+    now = timezone.now()
+    stats = shop_stats(category_id)
+    # Rows are written with executemany like seed data; a category can hold
+    # hundreds of thousands of them and model instances would dominate the
+    # refresh. Timestamps are converted once per shop instead of per row.
+    adapt = connection.ops.adapt_datetimefield_value
+    # stats values become [product count, last activity, base score,
+    # last activity as stored].
+    for values in stats.values():
+        values += [base_score(values[0], values[1], now), adapt(values[1])]
+    by_base = sorted(stats, key=lambda shop_id: (-stats[shop_id][2], -shop_id))
+    shop_ids = [shop_id for shop_id in (stats if shop_ids is None else shop_ids) if shop_id in stats]
+
+    stored = 0
+    for start in range(0, len(shop_ids), batch_size):
+        batch = shop_ids[start:start + batch_size]
+        rows = rank(batch, category_id, stats, by_base, limit, adapt(now))
+        with transaction.atomic():
+            ShopCandidate.objects.filter(shop_id__in=batch).delete()
+            stored += insert_rows(ShopCandidate, FIELDS, rows, prepared=True)
+    return stored
+
+
+def refresh(category_ids=None, limit=None):
+    if category_ids is None:
+        category_ids = Shop.objects.order_by().values_list('category_id', flat=True).distinct()
+    return sum(refresh_category(category_id, limit=limit) for category_id in category_ids)
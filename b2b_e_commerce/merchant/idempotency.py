@@ -0,0 +1,131 @@
+import hashlib
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, RawPostDataException
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from .models import IdempotencyKey
+from .renderers import dumps
+
+# Clients that retry a POST send the same Idempotency-Key header. The first
+# request claims the key, runs, and stores its rendered response; retries get
+# that response back without the view running again. Keys are per merchant
+# and expire after IDEMPOTENCY_KEY_TTL seconds. While the first request runs
+# it holds the key for IDEMPOTENCY_LOCK_SECONDS; if it dies without storing a
+# response, a retry takes the key over once that lease has run out.
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+class KeyInUse(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A request with this Idempotency-Key is still being processed.'
+    default_code = 'idempotency_key_in_use'
+
+
+class KeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'This Idempotency-Key was already used for a different request.'
+    default_code = 'idempotency_key_reused'
+
+
+def fingerprint(request):
+    digest = hashlib.sha256(f'{request.method} {request.get_full_path()}'.encode())
+    # Uploads are identified by method and path only; reading a large
+    # multipart body here would load it into memory.
+    if not request.content_type.startswith('multipart/'):
+        try:
+            digest.update(request.body)
+        except RawPostDataException:
+            pass
+    return digest.hexdigest()
+
+
+def claim(user_id, key, request_hash):
+    now = timezone.now()
+    lease = now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS)
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.create(
+                    user_id=user_id,
+                    key=key,
+                    fingerprint=request_hash,
+                    locked_until=lease,
+                    expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+                )
+            return None
+        except IntegrityError:
+            existing = IdempotencyKey.objects.filter(user_id=user_id, key=key).first()
+            if existing is None or existing.expires_at <= now:
+                # Expired (or just released): take it over.
+                IdempotencyKey.objects.filter(user_id=user_id, key=key, expires_at__lte=now).delete()
+                continue
+            if existing.status_code is None:
+                if existing.locked_until is not None and existing.locked_until > now:
+                    raise KeyInUse()
+                if existing.fingerprint != request_hash:
+                    raise KeyReused()
+                # The request holding the key died: take over its lease, unless
+                # a concurrent retry got there first.
+                if IdempotencyKey.objects.filter(
+                    pk=existing.pk, status_code=None, locked_until=existing.locked_until
+                ).update(locked_until=lease):
+                    return None
+                raise KeyInUse()
+            if existing.fingerprint != request_hash:
+                raise KeyReused()
+            return existing
+    raise KeyInUse()
+
+
+def replay(record):
+    response = HttpResponse(bytes(record.content), status=record.status_code, content_type='application/json')
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(handler):
+    @wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or not request.user.is_authenticated:
+            return handler(view, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            raise ValidationError(f'{HEADER} must be at most {MAX_KEY_LENGTH} characters.')
+
+        user_id = request.user.pk
+        record = claim(user_id, key, fingerprint(request))
+        if record is not None:
+            return replay(record)
+
+        claimed = IdempotencyKey.objects.filter(user_id=user_id, key=key)
+        try:
+            response = handler(view, request, *args, **kwargs)
+        except BaseException:
+            # A view that raised has rolled its work back, so a retry has to
+            # run it again.
+            claimed.delete()
+            raise
+        if response.status_code >= 500 or getattr(response, 'data', None) is None:
+            claimed.delete()
+        else:
+            claimed.update(status_code=response.status_code, content=dumps(response.data), locked_until=None)
+        return response
+
+    return wrapper
+
+
+def purge_expired(batch_size=1000):
+    purged = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return purged
+        purged += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
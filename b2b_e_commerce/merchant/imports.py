@@ -0,0 +1,86 @@
+import codecs
+import csv
+import json
+
+from autoslug.utils import crop_slug
+from django.db import DatabaseError, transaction
+from rest_framework.exceptions import ValidationError
+
+from .models import Product
+from .serializers import ProductSerializer
+
+IMPORT_TYPES = ('csv', 'jsonl')
+
+
+def guess_import_type(filename):
+    if filename and filename.lower().endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return 'csv'
+
+
+def iter_rows(stream, import_type):
+    # stream is any iterable of byte lines (an open file, an UploadedFile);
+    # rows are decoded one at a time so the file is never held in memory.
+    lines = codecs.iterdecode(stream, 'utf-8-sig')
+    if import_type == 'csv':
+        for row in csv.DictReader(lines):
+            yield row
+    else:
+        for line in lines:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield None
+
+
+def product_slug(title):
+    field = Product._meta.get_field('slug')
+    return field.slugify(crop_slug(field, field.slugify(title)))
+
+
+def import_products(shop, rows, chunk_size=1000, max_errors=100, progress=None):
+    # Each chunk commits on its own: rows that fail validation are reported
+    # and skipped, and a chunk the database rejects is reported row by row
+    # while the chunks before it stay imported.
+    report = {'created': 0, 'failed': 0, 'errors': []}
+    batch = []
+
+    def fail(number, errors):
+        report['failed'] += 1
+        if len(report['errors']) < max_errors:
+            report['errors'].append({'row': number, 'errors': errors})
+
+    def flush():
+        try:
+            with transaction.atomic():
+                Product.objects.bulk_create([product for _, product in batch])
+        except DatabaseError:
+            for number, _ in batch:
+                fail(number, ['The row could not be saved.'])
+        else:
+            report['created'] += len(batch)
+        batch.clear()
+        if progress:
+            progress(report)
+
+    # One serializer validates every row; building a fresh one per row would
+    # deep-copy its field tree each time.
+    validator = ProductSerializer()
+    for number, row in enumerate(rows, start=1):
+        try:
+            if not isinstance(row, dict):
+                raise ValidationError(['Malformed row.'])
+            data = validator.run_validation(row)
+        except ValidationError as exc:
+            fail(number, exc.detail)
+            continue
+
+        batch.append((number, Product(shop=shop, slug=product_slug(data['title']), **data)))
+        if len(batch) >= chunk_size:
+            flush()
+
+    if batch:
+        flush()
+    return report
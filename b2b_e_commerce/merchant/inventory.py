@@ -0,0 +1,189 @@
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, OuterRef, PositiveBigIntegerField, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import CartItem, Product, ProductStockShard
+
+# Product.quantity is the stock that is still for sale: putting a product in a
+# cart reserves units by decrementing it, removing the line or letting the
+# reservation expire gives them back. Every decrement is a single conditional
+# UPDATE (quantity >= n), so concurrent buyers can never take the same unit
+# and no read-modify-write is involved.
+#
+# Very hot products can spread their stock over Product.stock_shards rows of
+# ProductStockShard; each reservation then updates one random shard instead of
+# queueing on the product row. Product.quantity of a sharded product is only
+# a display figure, refreshed by sync_sharded_stock().
+
+
+class StockChanged(Exception):
+    pass
+
+
+def reservation_deadline():
+    return timezone.now() + timedelta(seconds=settings.CART_RESERVATION_SECONDS)
+
+
+def reserve(product_id, quantity, shards=0):
+    """Take quantity units of stock; returns False when there aren't enough.
+
+    shards is the product's stock_shards as the caller loaded it. If the
+    product switched modes since, the conditional update misses and the
+    current mode is read back once.
+    """
+    if quantity <= 0:
+        return True
+    for attempt in range(2):
+        if shards:
+            if _reserve_from_shards(product_id, quantity, shards):
+                return True
+        elif Product.objects.filter(pk=product_id, stock_shards=0, quantity__gte=quantity).update(
+            quantity=F('quantity') - quantity, updated_at=timezone.now()
+        ):
+            return True
+        current = Product.objects.filter(pk=product_id).values_list('stock_shards', flat=True).first()
+        if current is None or current == shards:
+            return False
+        shards = current
+    return False
+
+
+def reserve_many(lines):
+    """Reserve (product_id, quantity, shards) lines, one per product.
+
+    Returns the ids of the products that didn't have enough stock. Unsharded
+    products are tried in a single UPDATE first; only if one of them falls
+    short is every line reserved on its own.
+    """
+    done = set()
+    plain = {product_id: quantity for product_id, quantity, shards in lines if quantity > 0 and not shards}
+    if len(plain) > 1:
+        wanted = Case(*[When(pk=product_id, then=Value(quantity)) for product_id, quantity in plain.items()],
+                      output_field=PositiveBigIntegerField())
+        try:
+            with transaction.atomic():
+                updated = Product.objects.filter(pk__in=plain, stock_shards=0, quantity__gte=wanted).update(
+                    quantity=F('quantity') - wanted, updated_at=timezone.now()
+                )
+                if updated != len(plain):
+                    raise StockChanged
+            done = set(plain)
+        except StockChanged:
+            pass
+    return {
+        product_id for product_id, quantity, shards in lines
+        if product_id not in done and not reserve(product_id, quantity, shards)
+    }
+
+
+def release(product_id, quantity, shards=0):
+    """Give quantity units of stock back."""
+    if quantity <= 0:
+        return
+    for attempt in range(2):
+        if shards:
+            updated = ProductStockShard.objects.filter(product_id=product_id, shard=random.randrange(shards)).update(
+                quantity=F('quantity') + quantity
+            )
+        else:
+            updated = Product.objects.filter(pk=product_id, stock_shards=0).update(
+                quantity=F('quantity') + quantity, updated_at=timezone.now()
+            )
+        if updated:
+            return
+        shards = Product.objects.filter(pk=product_id).values_list('stock_shards', flat=True).first()
+        if shards is None:
+            return
+
+
+def _reserve_from_shards(product_id, quantity, shards):
+    start = random.randrange(shards)
+    for offset in range(shards):
+        if ProductStockShard.objects.filter(
+            product_id=product_id, shard=(start + offset) % shards, quantity__gte=quantity
+        ).update(quantity=F('quantity') - quantity):
+            return True
+
+    # No single shard holds enough; take from several at once. Each step is
+    # still conditional, and a shard that changed underneath rolls all of
+    # them back.
+    try:
+        with transaction.atomic():
+            rows = list(
+                ProductStockShard.objects.select_for_update()
+                .filter(product_id=product_id, quantity__gt=0)
+                .order_by('shard')
+                .values_list('pk', 'quantity')
+            )
+            if sum(available for _, available in rows) < quantity:
+                return False
+            remaining = quantity
+            for pk, available in rows:
+                take = min(available, remaining)
+                if not ProductStockShard.objects.filter(pk=pk, quantity__gte=take).update(quantity=F('quantity') - take):
+                    raise StockChanged
+                remaining -= take
+                if not remaining:
+                    break
+    except StockChanged:
+        return False
+    return True
+
+
+def set_stock_shards(product_id, shards):
+    """Move a product's stock into shards rows, or back onto the product with 0."""
+    with transaction.atomic():
+        product = Product.objects.select_for_update().get(pk=product_id)
+        # Flipping the mode first locks the row on every backend; reservations
+        # that loaded the old mode miss their conditional update and retry.
+        if not Product.objects.filter(pk=product_id, stock_shards=product.stock_shards).update(stock_shards=shards):
+            raise StockChanged
+        if product.stock_shards:
+            existing = ProductStockShard.objects.select_for_update().filter(product_id=product_id)
+            total = sum(existing.values_list('quantity', flat=True))
+            existing.delete()
+        else:
+            total = Product.objects.values_list('quantity', flat=True).get(pk=product_id)
+
+        share, extra = divmod(total, shards) if shards else (0, 0)
+        ProductStockShard.objects.bulk_create(
+            [ProductStockShard(product_id=product_id, shard=shard, quantity=share + (shard < extra)) for shard in range(shards)]
+        )
+        Product.objects.filter(pk=product_id).update(quantity=total, updated_at=timezone.now())
+    return total
+
+
+def sync_sharded_stock():
+    shards = ProductStockShard.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    return Product.objects.filter(stock_shards__gt=0).update(
+        quantity=Coalesce(Subquery(shards.annotate(total=Sum('quantity')).values('total')), Value(0)),
+        updated_at=timezone.now(),
+    )
+
+
+def release_expired(now=None, batch_size=500):
+    # Abandoned carts keep their lines, but the units go back on sale. A
+    # line whose reservation was released reserves again at checkout.
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            items = list(
+                CartItem.objects.select_for_update()
+                .filter(reserved_until__lt=now)
+                .values_list('pk', 'product_id', 'quantity', 'product__stock_shards')[:batch_size]
+            )
+            if not items:
+                return released
+            CartItem.objects.filter(pk__in=[pk for pk, _, _, _ in items]).update(reserved_until=None)
+            totals = {}
+            for _, product_id, quantity, shards in items:
+                totals[product_id, shards] = totals.get((product_id, shards), 0) + quantity
+            for (product_id, shards), quantity in totals.items():
+                release(product_id, quantity, shards)
+        released += len(items)
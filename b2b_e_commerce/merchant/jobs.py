@@ -0,0 +1,83 @@
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+# A job queue kept in the database, so no broker is needed. Workers (the
+# run_jobs command) claim a batch with one conditional UPDATE that stamps a
+# lock token and hides the jobs until their visibility timeout runs out; a
+# worker that dies simply lets its jobs reappear. Finished jobs are deleted,
+# failed ones retry with exponential backoff until max_attempts and then stay
+# behind with failed_at set. Handlers must be safe to run twice.
+
+
+def enqueue(name, payload, max_attempts=None):
+    job = Job.objects.create(
+        name=name,
+        payload=payload,
+        max_attempts=max_attempts or settings.JOBS_MAX_ATTEMPTS,
+    )
+    if settings.JOBS_EAGER:
+        # No worker in development and tests: run the job once the enqueuing
+        # transaction has committed.
+        transaction.on_commit(lambda: run_claimed(claim_ids([job.pk])))
+    return job
+
+
+def runnable(now):
+    return Job.objects.filter(failed_at__isnull=True, run_after__lte=now).filter(
+        Q(locked_until__isnull=True) | Q(locked_until__lte=now)
+    )
+
+
+def claim_ids(ids, visibility_timeout=None):
+    now = timezone.now()
+    token = uuid.uuid4()
+    runnable(now).filter(pk__in=ids).update(
+        lock_token=token,
+        locked_until=now + timedelta(seconds=visibility_timeout or settings.JOBS_VISIBILITY_TIMEOUT),
+        attempts=F('attempts') + 1,
+    )
+    # Jobs another worker claimed first are simply not returned.
+    return list(Job.objects.filter(lock_token=token).order_by('pk'))
+
+
+def claim(batch_size, visibility_timeout=None):
+    ids = list(runnable(timezone.now()).order_by('run_after').values_list('pk', flat=True)[:batch_size])
+    return claim_ids(ids, visibility_timeout) if ids else []
+
+
+def run_claimed(jobs):
+    done = 0
+    for job in jobs:
+        owned = Job.objects.filter(pk=job.pk, lock_token=job.lock_token)
+        try:
+            import_string(job.name)(**job.payload)
+        except Exception:
+            error = traceback.format_exc()
+            if job.attempts >= job.max_attempts:
+                owned.update(failed_at=timezone.now(), locked_until=None, last_error=error)
+            else:
+                owned.update(
+                    run_after=timezone.now() + timedelta(seconds=2 ** job.attempts),
+                    locked_until=None,
+                    last_error=error,
+                )
+        else:
+            # A worker whose claim timed out finds the job taken over.
+            if owned.delete()[0]:
+                done += 1
+    return done
+
+
+def work(batch_size=50, visibility_timeout=None):
+    # Processes one batch; returns (claimed, succeeded).
+    jobs = claim(batch_size, visibility_timeout)
+    return len(jobs), run_claimed(jobs)
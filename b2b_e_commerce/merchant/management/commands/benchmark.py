@@ -0,0 +1,70 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from merchant import benchmarks
+
+# Result keys that are measurements; every other key identifies the result
+# when comparing against a baseline file.
+METRICS = ('samples', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'queries', 'errors')
+
+
+class Command(BaseCommand):
+    help = 'Run a performance benchmark scenario against a throwaway test database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=sorted(benchmarks.SCENARIOS))
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100, 500],
+                            help='Workload sizes to measure (cart lines for checkout, concurrency for asgi '
+                                 'and endpoints, rows for serializers).')
+        parser.add_argument('--repeat', type=int, default=5, help='Samples taken per size.')
+        parser.add_argument('--output', help='Also write the results as JSON to this file.')
+        parser.add_argument('--compare', help='A previous --output file to print changes against.')
+
+        dataset = parser.add_argument_group('endpoints dataset')
+        dataset.add_argument('--merchants', type=int, default=20)
+        dataset.add_argument('--categories', type=int, default=4)
+        dataset.add_argument('--shops-per-category', type=int, default=10)
+        dataset.add_argument('--connections-per-shop', type=int, default=1,
+                             help='Approved connections each shop opens; every shop ends up with twice as many neighbors.')
+        dataset.add_argument('--products-per-shop', type=int, default=50)
+        dataset.add_argument('--cart-size', type=int, default=10, help='Lines in carts and batch adds.')
+        dataset.add_argument('--seed', type=int, default=0)
+        dataset.add_argument('--only', nargs='+', help='Only drive these endpoints.')
+
+    def handle(self, *args, **options):
+        run = benchmarks.SCENARIOS[options.pop('scenario')]
+        output = options.pop('output')
+        compare = options.pop('compare')
+        with benchmarks.test_database(verbosity=options['verbosity'], on_disk=run.on_disk):
+            results = run(**options)
+
+        if run.note:
+            self.stdout.write(self.style.WARNING(run.note))
+        for result in results:
+            self.stdout.write('  '.join(f'{key}={value}' for key, value in result.items()))
+        if output:
+            with open(output, 'w') as fh:
+                json.dump(results, fh, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Results written to {output}'))
+        if compare:
+            with open(compare) as fh:
+                self.write_comparison(json.load(fh), results)
+
+    def write_comparison(self, baseline, results):
+        def identity(result):
+            return tuple((key, value) for key, value in result.items() if key not in METRICS)
+
+        previous = {identity(result): result for result in baseline}
+        self.stdout.write('')
+        for result in results:
+            before = previous.get(identity(result))
+            if before is None:
+                continue
+            changes = []
+            for metric in ('p50_ms', 'p95_ms', 'throughput_rps', 'queries'):
+                if before.get(metric) and metric in result:
+                    change = (result[metric] - before[metric]) / before[metric] * 100
+                    changes.append(f'{metric}={before[metric]}->{result[metric]} ({change:+.1f}%)')
+            label = '  '.join(f'{key}={value}' for key, value in identity(result))
+            self.stdout.write(f'{label}  ' + '  '.join(changes))
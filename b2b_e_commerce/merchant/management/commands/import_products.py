@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from merchant.imports import IMPORT_TYPES, guess_import_type, import_products, iter_rows
+from merchant.models import Shop
+
+
+class Command(BaseCommand):
+    help = 'Stream a CSV or JSONL product catalog into a shop.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('shop_slug')
+        parser.add_argument('path')
+        parser.add_argument('--type', choices=IMPORT_TYPES, help='Defaults to the file extension.')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            shop = Shop.objects.get(slug=options['shop_slug'])
+        except Shop.DoesNotExist:
+            raise CommandError(f"Shop {options['shop_slug']!r} does not exist.")
+
+        def progress(report):
+            self.stdout.write(f"created={report['created']} failed={report['failed']}")
+
+        import_type = options['type'] or guess_import_type(options['path'])
+        with open(options['path'], 'rb') as fh:
+            report = import_products(
+                shop, iter_rows(fh, import_type), chunk_size=options['chunk_size'], progress=progress,
+            )
+
+        for error in report['errors']:
+            self.stderr.write(f"row {error['row']}: {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report['created']} products, {report['failed']} rows failed."
+        ))
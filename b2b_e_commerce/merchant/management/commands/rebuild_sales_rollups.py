@@ -0,0 +1,17 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from merchant.sales import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily sales rollups behind shop analytics from the confirmed orders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, default=None, help='First day to rebuild (YYYY-MM-DD); default: all.')
+        parser.add_argument('--end', type=date.fromisoformat, default=None, help='Last day to rebuild (YYYY-MM-DD); default: all.')
+
+    def handle(self, *args, **options):
+        products, buyers = rebuild(options['start'], options['end'])
+        self.stdout.write(self.style.SUCCESS(f'{products} product and {buyers} buyer rollup rows.'))
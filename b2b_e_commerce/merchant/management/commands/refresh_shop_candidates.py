@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from merchant.discovery import refresh
+
+
+class Command(BaseCommand):
+    help = 'Recompute the ranked discovery candidates of every shop.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--category', type=int, action='append', dest='categories',
+                            help='Only refresh this category id; repeat for several.')
+        parser.add_argument('--limit', type=int, default=None, help='Candidates kept per shop (default: DISCOVERY_CANDIDATES).')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rows = refresh(options['categories'], options['limit'])
+        self.stdout.write(self.style.SUCCESS(f'Stored {rows} candidates in {time.perf_counter() - started:.1f}s.'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from merchant.inventory import release_expired, sync_sharded_stock
+
+
+class Command(BaseCommand):
+    help = 'Put the stock of expired cart reservations back on sale and refresh sharded stock totals.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        released = release_expired(batch_size=options['batch_size'])
+        synced = sync_sharded_stock()
+        self.stdout.write(self.style.SUCCESS(
+            f'Released {released} cart lines, refreshed {synced} sharded products.'
+        ))
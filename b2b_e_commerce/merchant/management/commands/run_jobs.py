@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from merchant.jobs import work
+
+
+class Command(BaseCommand):
+    help = 'Process queued background jobs such as order fulfillment.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--visibility-timeout', type=int, default=None,
+                            help='Seconds a claimed job stays hidden from other workers (default: JOBS_VISIBILITY_TIMEOUT).')
+        parser.add_argument('--idle-sleep', type=float, default=1.0, help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--once', action='store_true', help='Stop as soon as the queue is empty.')
+
+    def handle(self, *args, **options):
+        processed = failed = 0
+        try:
+            while True:
+                claimed, succeeded = work(options['batch_size'], options['visibility_timeout'])
+                processed += succeeded
+                failed += claimed - succeeded
+                if not claimed:
+                    if options['once']:
+                        break
+                    time.sleep(options['idle_sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} jobs, {failed} attempts failed.'))
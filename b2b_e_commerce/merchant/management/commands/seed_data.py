@@ -0,0 +1,101 @@
+import multiprocessing
+import os
+import time
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.utils import timezone
+
+from merchant import discovery, sales, seeding
+from merchant.search import run_search_sql
+
+
+class Command(BaseCommand):
+    help = 'Generate synthetic merchants, shops, connections, products, carts and orders for load tests.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--merchants', type=int, default=1000)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--shops-per-category', type=int, default=50)
+        parser.add_argument('--connections-per-shop', type=int, default=5,
+                            help='Approved connections each shop opens; every shop ends up with twice as many neighbors.')
+        parser.add_argument('--products-per-shop', type=int, default=1000)
+        parser.add_argument('--carts', type=int, default=100, help='Shops that get an open cart.')
+        parser.add_argument('--cart-size', type=int, default=10)
+        parser.add_argument('--orders-per-shop', type=int, default=2)
+        parser.add_argument('--order-size', type=int, default=5)
+        parser.add_argument('--password', default='password', help='Password shared by every generated merchant.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--days', type=int, default=90, help='Spread the rows over this many days before now.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--shops-per-task', type=int, default=20)
+
+    def handle(self, *args, **options):
+        if 2 * options['connections_per_shop'] >= options['shops_per_category']:
+            raise CommandError('--connections-per-shop must be less than half of --shops-per-category.')
+
+        plan = seeding.SeedPlan(
+            seed=options['seed'],
+            merchants=options['merchants'],
+            categories=options['categories'],
+            shops_per_category=options['shops_per_category'],
+            connections_per_shop=options['connections_per_shop'],
+            products_per_shop=options['products_per_shop'],
+            carts=options['carts'],
+            cart_size=options['cart_size'],
+            orders_per_shop=options['orders_per_shop'],
+            order_size=options['order_size'],
+            # One real hash shared by everyone: logins work, and nobody pays
+            # for a PBKDF2 run per merchant.
+            password_hash=make_password(options['password']),
+            created_at=timezone.now(),
+            first_ids=seeding.first_ids(),
+            days=options['days'],
+        )
+        started = time.perf_counter()
+
+        links = seeding.seed_catalog(plan)
+        self.report(started, f'{plan.merchants} merchants, {plan.shops} shops, {links} connections')
+
+        # The search triggers would index every product row as it lands; the
+        # index is rebuilt once at the end instead.
+        run_search_sql(connection, 'uninstall')
+        try:
+            for step, label in (('products', 'products'), ('orders', 'orders')):
+                done = self.run_step(plan, step, options['workers'], options['shops_per_task'])
+                self.report(started, f'{done} {label}')
+        finally:
+            run_search_sql(connection, 'install')
+            run_search_sql(connection, 'rebuild')
+        self.report(started, 'search index rebuilt')
+        seeding.finish()
+        # Seeded orders bypass the order jobs that maintain the rollups.
+        sales.rebuild(start=timezone.localdate(plan.created_at - timedelta(days=plan.days)),
+                      end=timezone.localdate(plan.created_at))
+        self.report(started, 'sales rollups rebuilt')
+        candidates = discovery.refresh()
+        self.report(started, f'{candidates} discovery candidates')
+
+    def run_step(self, plan, step, workers, shops_per_task):
+        tasks = [
+            (step, plan, start, min(start + shops_per_task, plan.shops))
+            for start in range(0, plan.shops, shops_per_task)
+        ]
+        if workers <= 1:
+            return sum(seeding.run_task(task)[2] for task in tasks)
+
+        # Connections must not be shared with the forked workers.
+        connections.close_all()
+        context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+        done = 0
+        with context.Pool(workers, initializer=seeding.init_worker) as pool:
+            for _, shops, rows in pool.imap_unordered(seeding.run_task, tasks):
+                done += rows
+                self.stdout.write(f'  {step}: {done} rows', ending='\r')
+        self.stdout.write('')
+        return done
+
+    def report(self, started, message):
+        self.stdout.write(self.style.SUCCESS(f'[{time.perf_counter() - started:7.1f}s] {message}'))
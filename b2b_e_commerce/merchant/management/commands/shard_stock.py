@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from merchant.inventory import set_stock_shards
+from merchant.models import Product
+
+
+class Command(BaseCommand):
+    help = "Spread a hot product's stock over several counter rows, or merge it back with --shards 0."
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_uid')
+        parser.add_argument('--shards', type=int, default=8)
+
+    def handle(self, *args, **options):
+        if options['shards'] < 0:
+            raise CommandError('--shards cannot be negative.')
+        try:
+            product = Product.objects.get(uid=options['product_uid'])
+        except (Product.DoesNotExist, ValueError):
+            raise CommandError(f"Product {options['product_uid']!r} does not exist.")
+
+        total = set_stock_shards(product.pk, options['shards'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{product.title}: {total} in stock across {options['shards'] or 'no'} shards."
+        ))
@@ -0,0 +1,62 @@
+# Generated by Django 4.2.1 on 2026-10-18 09:19
+
+import autoslug.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_active_shops(apps, schema_editor):
+    Merchant = apps.get_model('merchant', 'Merchant')
+    Shop = apps.get_model('merchant', 'Shop')
+    for shop in Shop.objects.filter(active=True).order_by('updated_at'):
+        Merchant.objects.filter(pk=shop.merchant_id).update(active_shop=shop)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merchant', '0005_cart_total_price_order_total_price_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='merchant',
+            name='active_shop',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='merchant.shop'),
+        ),
+        migrations.RunPython(copy_active_shops, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='shop',
+            name='active',
+        ),
+        migrations.AlterField(
+            model_name='cartitem',
+            name='net_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='slug',
+            field=autoslug.fields.AutoSlugField(editable=False, populate_from='title', unique=True),
+        ),
+        migrations.AlterField(
+            model_name='merchant',
+            name='dob',
+            field=models.DateField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='title',
+            field=models.CharField(max_length=250),
+        ),
+        migrations.AlterField(
+            model_name='shop',
+            name='slug',
+            field=autoslug.fields.AutoSlugField(editable=False, populate_from='name', unique=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.1 on 2026-10-18 09:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_neighbors(apps, schema_editor):
+    ShopConnection = apps.get_model('merchant', 'ShopConnection')
+    ShopNeighbor = apps.get_model('merchant', 'ShopNeighbor')
+    links = set()
+    for sender_id, receiver_id in ShopConnection.objects.filter(status='approved').values_list('sender_shop_id', 'receiver_shop_id'):
+        links.add((sender_id, receiver_id))
+        links.add((receiver_id, sender_id))
+    ShopNeighbor.objects.bulk_create(
+        [ShopNeighbor(shop_id=shop_id, neighbor_id=neighbor_id) for shop_id, neighbor_id in links],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merchant', '0006_merchant_active_shop'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbor_of', to='merchant.shop')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbor_links', to='merchant.shop')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='shopneighbor',
+            constraint=models.UniqueConstraint(fields=('shop', 'neighbor'), name='unique_shop_neighbor'),
+        ),
+        migrations.RunPython(backfill_neighbors, migrations.RunPython.noop),
+    ]
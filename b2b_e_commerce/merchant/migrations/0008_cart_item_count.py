@@ -0,0 +1,31 @@
+# Generated by Django 4.2.1 on 2026-10-18 09:22
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def recompute_cart_totals(apps, schema_editor):
+    Cart = apps.get_model('merchant', 'Cart')
+    CartItem = apps.get_model('merchant', 'CartItem')
+    lines = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+    Cart.objects.update(
+        total_price=Coalesce(Subquery(lines.annotate(total=Sum('net_price')).values('total')), Value(0), output_field=models.DecimalField(max_digits=8, decimal_places=2)),
+        item_count=Coalesce(Subquery(lines.annotate(count=Count('pk')).values('count')), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merchant', '0007_shopneighbor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(recompute_cart_totals, migrations.RunPython.noop),
+    ]
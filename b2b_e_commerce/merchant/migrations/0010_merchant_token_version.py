@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-18 09:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merchant', '0009_product_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='merchant',
+            name='token_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 4.2.1 on 2026-10-18 09:42
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def delete_ids(model, ids, batch_size=500):
+    ids = list(ids)
+    for start in range(0, len(ids), batch_size):
+        model.objects.filter(id__in=ids[start:start + batch_size]).delete()
+
+
+def remove_duplicates(apps, schema_editor):
+    # Rows the new unique constraints would reject. A duplicate connection
+    # keeps its approved row (or else the oldest), duplicate carts are merged
+    # into the oldest one, and duplicate cart lines keep the latest line.
+    ShopConnection = apps.get_model('merchant', 'ShopConnection')
+    Cart = apps.get_model('merchant', 'Cart')
+    CartItem = apps.get_model('merchant', 'CartItem')
+
+    keep, duplicates = {}, []
+    for row in ShopConnection.objects.order_by('id').values('id', 'sender_shop_id', 'receiver_shop_id', 'status').iterator():
+        pair = (row['sender_shop_id'], row['receiver_shop_id'])
+        kept = keep.get(pair)
+        if kept is None:
+            keep[pair] = row
+        elif row['status'] == 'approved' and kept['status'] != 'approved':
+            keep[pair] = row
+            duplicates.append(kept['id'])
+        else:
+            duplicates.append(row['id'])
+    delete_ids(ShopConnection, duplicates)
+
+    survivors, merged = {}, False
+    for cart_id, shop_id, user_id in Cart.objects.order_by('id').values_list('id', 'shop_id', 'user_id').iterator():
+        survivor = survivors.setdefault((shop_id, user_id), cart_id)
+        if survivor != cart_id:
+            CartItem.objects.filter(cart_id=cart_id).update(cart_id=survivor)
+            Cart.objects.filter(id=cart_id).delete()
+            merged = True
+
+    latest, duplicates = {}, []
+    for item_id, cart_id, product_id in CartItem.objects.order_by('updated_at', 'id').values_list('id', 'cart_id', 'product_id').iterator():
+        previous = latest.get((cart_id, product_id))
+        if previous is not None:
+            duplicates.append(previous)
+        latest[cart_id, product_id] = item_id
+    delete_ids(CartItem, duplicates)
+
+    if merged or duplicates:
+        lines = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+        Cart.objects.update(
+            total_price=Coalesce(Subquery(lines.annotate(total=Sum('net_price')).values('total')), Value(0), output_field=models.DecimalField(max_digits=8, decimal_places=2)),
+            item_count=Coalesce(Subquery(lines.annotate(count=Count('pk')).values('count')), Value(0)),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merchant', '0010_merchant_token_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['shop', 'created_at'], name='order_shop_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['shop', 'created_at'], name='product_shop_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shop',
+            index=models.Index(fields=['category', 'created_at'], name='shop_category_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shopconnection',
+            index=models.Index(fields=['sender_shop', 'status'], name='shopconn_sender_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shopconnection',
+            index=models.Index(fields=['receiver_shop', 'status'], name='shopconn_receiver_status_idx'),
+        ),
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(fields=('shop', 'user'), name='unique_cart_per_shop_user'),
+        ),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='unique_cart_product'),
+        ),
+        migrations.AddConstraint(
+            model_name='shopconnection',
+            constraint=models.UniqueConstraint(fields=('sender_shop', 'receiver_shop'), name='unique_shop_connection'),
+        ),
+    ]
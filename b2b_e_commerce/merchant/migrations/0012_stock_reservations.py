@@ -0,0 +1,66 @@
+# Generated by Django 4.2.1 on 2026-10-18 09:47
+
+from importlib import import_module
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+run_search_sql = import_module('merchant.migrations.0009_product_search').run_search_sql
+
+
+# Adding stock_shards makes SQLite rebuild merchant_product, which fails
+# while other tables' search triggers still point at it. The search index is
+# taken down around the rebuild.
+
+def uninstall_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        run_search_sql(schema_editor.connection, 'uninstall')
+
+
+def install_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        run_search_sql(schema_editor.connection, 'install')
+        run_search_sql(schema_editor.connection, 'rebuild')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merchant', '0011_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductStockShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('quantity', models.PositiveBigIntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='cartitem',
+            name='reserved_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(uninstall_search_index, install_search_index),
+        migrations.AddField(
+            model_name='product',
+            name='stock_shards',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.RunPython(install_search_index, uninstall_search_index),
+        migrations.AddIndex(
+            model_name='cartitem',
+            index=models.Index(fields=['reserved_until'], name='cartitem_reserved_until_idx'),
+        ),
+        migrations.AddField(
+            model_name='productstockshard',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_shard_set', to='merchant.product'),
+        ),
+        migrations.AddConstraint(
+            model_name='productstockshard',
+            constraint=models.UniqueConstraint(fields=('product', 'shard'), name='unique_product_stock_shard'),
+        ),
+    ]
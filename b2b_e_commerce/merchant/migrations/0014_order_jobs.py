@@ -0,0 +1,94 @@
+# Generated by Django 4.2.1 on 2026-10-18 09:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+
+
+def confirm_existing_orders(apps, schema_editor):
+    # Orders placed before the queue existed were completed at checkout.
+    apps.get_model('merchant', 'Order').objects.update(status='CONFIRMED')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merchant', '0013_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('payload', models.JSONField(default=dict)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('max_attempts', models.PositiveSmallIntegerField(default=5)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('lock_token', models.UUIDField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('failed_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SupplierNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uid', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('item_count', models.PositiveIntegerField()),
+                ('total_price', models.DecimalField(decimal_places=2, max_digits=10)),
+            ],
+        ),
+        migrations.RemoveConstraint(
+            model_name='cart',
+            name='unique_cart_per_shop_user',
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='order',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='cart', to='merchant.order'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('CONFIRMED', 'Confirmed'), ('FAILED', 'Failed')], default='PENDING', max_length=20),
+        ),
+        migrations.RunPython(confirm_existing_orders, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='order',
+            name='status_detail',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(condition=models.Q(('order__isnull', True)), fields=('shop', 'user'), name='unique_open_cart'),
+        ),
+        migrations.AddField(
+            model_name='suppliernotification',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='supplier_notifications', to='merchant.order'),
+        ),
+        migrations.AddField(
+            model_name='suppliernotification',
+            name='shop',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='supplier_notifications', to='merchant.shop'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(condition=models.Q(('failed_at__isnull', True)), fields=['run_after'], name='job_runnable_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['lock_token'], name='job_lock_token_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='suppliernotification',
+            index=models.Index(fields=['shop', 'created_at'], name='notification_shop_created_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.1 on 2026-10-18 10:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merchant', '0015_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopCandidate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('product_count', models.PositiveIntegerField()),
+                ('mutual_connections', models.PositiveIntegerField()),
+                ('last_active_at', models.DateTimeField(blank=True, null=True)),
+                ('refreshed_at', models.DateTimeField()),
+                ('candidate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='candidate_for', to='merchant.shop')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='candidates', to='merchant.shop')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['shop', '-score', '-id'], name='shopcandidate_rank_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shopcandidate',
+            constraint=models.UniqueConstraint(fields=('shop', 'candidate'), name='unique_shop_candidate'),
+        ),
+    ]
@@ -7,7 +7,8 @@ from django.contrib.auth.models import (
 )
 from django.contrib.auth.models import AbstractUser
 import uuid
-from .status import ProductStatus, ConnectionStatus, PaymentOption
+from .status import ProductStatus, ConnectionStatus, PaymentOption, OrderStatus
+from django.utils import timezone
 # from django.utils.text import slugify
 from autoslug.fields import AutoSlugField
 
@@ -52,8 +53,14 @@ class Merchant(AbstractBaseUser, PermissionsMixin,BaseModel):
     name = models.CharField(max_length=100)
     dob = models.DateField(blank=True)
 
-    # is_active = models.BooleanField(default=True)
+    is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    # The shop the merchant is currently working in. Kept on the merchant so
+    # switching shops writes one row instead of flagging every Shop.
+    active_shop = models.ForeignKey('Shop', null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    # Bumped whenever the shops a merchant owns change, so stateless tokens
+    # that carry the old shop list stop being accepted.
+    token_version = models.PositiveIntegerField(default=0)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['name', 'dob']
@@ -83,36 +90,137 @@ class Shop(BaseModel):
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     address = models.CharField(max_length=500)
     description = models.TextField()
-    active = models.BooleanField(default=False) #should be changed
     connected_shops = models.ManyToManyField("self", through='ShopConnection', blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', 'created_at'], name='shop_category_created_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
+    @property
+    def active(self):
+        return self.merchant.active_shop_id == self.pk
+
 
 class ShopConnection(BaseModel):
     sender_shop = models.ForeignKey(Shop, related_name='sent_connections', on_delete=models.CASCADE)
     receiver_shop = models.ForeignKey(Shop, related_name='received_connections', on_delete=models.CASCADE)
     status = models.CharField(max_length=20, choices=ConnectionStatus.choices, default=ConnectionStatus.PENDING)
 
+    class Meta:
+        # One row per direction: a repeated request or approval updates the
+        # existing row instead of adding another.
+        constraints = [
+            models.UniqueConstraint(fields=['sender_shop', 'receiver_shop'], name='unique_shop_connection'),
+        ]
+        indexes = [
+            models.Index(fields=['sender_shop', 'status'], name='shopconn_sender_status_idx'),
+            models.Index(fields=['receiver_shop', 'status'], name='shopconn_receiver_status_idx'),
+        ]
+
     def __str__(self):
         return f"Connection between {self.sender_shop} and {self.receiver_shop}"
 
 
+class ShopNeighborManager(models.Manager):
+    def connect(self, shop, neighbor):
+        self.bulk_create(
+            [self.model(shop=shop, neighbor=neighbor), self.model(shop=neighbor, neighbor=shop)],
+            ignore_conflicts=True,
+        )
+
+    def disconnect(self, shop, neighbor):
+        self.filter(
+            models.Q(shop=shop, neighbor=neighbor) | models.Q(shop=neighbor, neighbor=shop)
+        ).delete()
+
+    def neighbor_ids(self, shop):
+        return self.filter(shop=shop).values('neighbor_id')
+
+
+class ShopNeighbor(models.Model):
+    # Approved connections denormalized into one row per direction, so
+    # "shops connected to X" is a single lookup on the (shop, neighbor) index
+    # instead of a status filter over ShopConnection.
+    shop = models.ForeignKey(Shop, related_name='neighbor_links', on_delete=models.CASCADE)
+    neighbor = models.ForeignKey(Shop, related_name='neighbor_of', on_delete=models.CASCADE)
+
+    objects = ShopNeighborManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['shop', 'neighbor'], name='unique_shop_neighbor'),
+        ]
+
+
+
+class ShopCandidate(models.Model):
+    # Precomputed discovery results: shops in the same category that shop is
+    # not connected to yet, ranked by merchant.discovery.refresh().
+    shop = models.ForeignKey(Shop, related_name='candidates', on_delete=models.CASCADE)
+    candidate = models.ForeignKey(Shop, related_name='candidate_for', on_delete=models.CASCADE)
+    score = models.FloatField()
+    product_count = models.PositiveIntegerField()
+    mutual_connections = models.PositiveIntegerField()
+    last_active_at = models.DateTimeField(null=True, blank=True)
+    refreshed_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['shop', 'candidate'], name='unique_shop_candidate'),
+        ]
+        indexes = [
+            models.Index(fields=['shop', '-score', '-id'], name='shopcandidate_rank_idx'),
+        ]
+
 class Product(BaseModel):
     title = models.CharField(max_length=250)
     price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     shop = models.ForeignKey(Shop, on_delete=models.CASCADE)
     quantity = models.PositiveBigIntegerField()
     slug =  AutoSlugField(populate_from='title')
+    # Non-zero for hot products whose stock lives in ProductStockShard rows,
+    # see merchant.inventory.
+    stock_shards = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        # Product lists filter on the shop and page on (created_at, id).
+        indexes = [
+            models.Index(fields=['shop', 'created_at'], name='product_shop_created_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
 
+class ProductStockShard(models.Model):
+    product = models.ForeignKey(Product, related_name='stock_shard_set', on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField()
+    quantity = models.PositiveBigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'shard'], name='unique_product_stock_shard'),
+        ]
+
+
 class Cart(BaseModel):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     shop = models.ForeignKey(Shop, on_delete=models.CASCADE)
+    # Maintained incrementally by merchant.carts as lines change.
     total_price = models.DecimalField(max_digits=8, decimal_places=2)
+    item_count = models.PositiveIntegerField(default=0)
+    # Set at checkout: the cart then belongs to the order until
+    # merchant.orders turns its lines into order lines.
+    order = models.OneToOneField('Order', null=True, blank=True, on_delete=models.CASCADE, related_name='cart')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['shop', 'user'], condition=models.Q(order__isnull=True), name='unique_open_cart'),
+        ]
 
 
 class CartItem(BaseModel):
@@ -122,6 +230,18 @@ class CartItem(BaseModel):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
     net_price = models.DecimalField(max_digits=10, decimal_places=2,default=0)
+    # Set while the line's quantity is held back from Product.quantity.
+    reserved_until = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        # shop and user always match the cart's, so (cart, product) is the
+        # whole key.
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='unique_cart_product'),
+        ]
+        indexes = [
+            models.Index(fields=['reserved_until'], name='cartitem_reserved_until_idx'),
+        ]
 
 
 
@@ -132,6 +252,14 @@ class Order(BaseModel):
     delivery_address = models.CharField(max_length=150)
     total_price = models.DecimalField(max_digits=8, decimal_places=2)
     payment_method = models.CharField(max_length=20,choices=PaymentOption.choices)
+    # Checkout only records the order; the job queue fills in its lines.
+    status = models.CharField(max_length=20, choices=OrderStatus.choices, default=OrderStatus.PENDING)
+    status_detail = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['shop', 'created_at'], name='order_shop_created_idx'),
+        ]
 
 class OrderItem(BaseModel):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -139,4 +267,90 @@ class OrderItem(BaseModel):
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
-    net_price = models.DecimalField(max_digits=8, decimal_places=2)
\ No newline at end of file
+    net_price = models.DecimalField(max_digits=8, decimal_places=2)
+
+
+class IdempotencyKey(models.Model):
+    # The stored outcome of a request sent with an Idempotency-Key header,
+    # see merchant.idempotency. status_code stays empty while the first
+    # request is still running, which it holds the key for until locked_until.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    content = models.BinaryField(null=True)
+    locked_until = models.DateTimeField(null=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_expires_idx'),
+        ]
+
+
+class SupplierNotification(BaseModel):
+    # One per supplier shop of a processed order.
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='supplier_notifications')
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='supplier_notifications')
+    item_count = models.PositiveIntegerField()
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['shop', 'created_at'], name='notification_shop_created_idx'),
+        ]
+
+
+
+class DailyProductSales(models.Model):
+    # Sales rollups for supplier analytics, kept up to date as orders are
+    # processed (see merchant.sales). shop is the supplier; analytics for a
+    # date range read these instead of Order/OrderItem.
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='daily_product_sales')
+    day = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    quantity = models.PositiveBigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['shop', 'day', 'product'], name='unique_daily_product_sales'),
+        ]
+
+
+class DailyBuyerSales(models.Model):
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='daily_buyer_sales')
+    day = models.DateField()
+    buyer = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='daily_purchases')
+    orders = models.PositiveIntegerField(default=0)
+    quantity = models.PositiveBigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['shop', 'day', 'buyer'], name='unique_daily_buyer_sales'),
+        ]
+
+class Job(models.Model):
+    # A unit of background work for the run_jobs command, see merchant.jobs.
+    # name is the dotted path of the handler, which gets payload.
+    name = models.CharField(max_length=200)
+    payload = models.JSONField(default=dict)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    # A claimed job is invisible to other workers until locked_until.
+    locked_until = models.DateTimeField(null=True, blank=True)
+    lock_token = models.UUIDField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    failed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['run_after'], condition=models.Q(failed_at__isnull=True), name='job_runnable_idx'),
+            models.Index(fields=['lock_token'], name='job_lock_token_idx'),
+        ]
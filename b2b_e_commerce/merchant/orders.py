@@ -0,0 +1,77 @@
+from collections import defaultdict
+
+from django.db import transaction
+
+from . import inventory, sales
+from .models import Cart, CartItem, Order, OrderItem, SupplierNotification
+from .status import OrderStatus
+
+# Checkout only records a PENDING order and hands it its cart; everything that
+# grows with the cart happens here, in a job run by the run_jobs worker:
+# stock, order lines, supplier notifications and the sales rollups.
+
+
+def process_order(order_id):
+    with transaction.atomic():
+        order = Order.objects.select_for_update().filter(pk=order_id, status=OrderStatus.PENDING).first()
+        if order is None:
+            # Already processed: a retried job has nothing left to do.
+            return
+        cart = Cart.objects.filter(order=order).first()
+        # The lines are locked so release_expired can't hand a reservation
+        # back to stock while this job still counts on it.
+        lines = list(
+            CartItem.objects.select_for_update(of=('self',)).filter(cart=cart)
+            .values_list('product_id', 'quantity', 'net_price', 'reserved_until', 'product__shop_id', 'product__stock_shards')
+        ) if cart is not None else []
+
+        # Reserved lines already hold their stock; lines whose reservation
+        # expired have to get it again.
+        missing = inventory.reserve_many([
+            (product_id, quantity, shards)
+            for product_id, quantity, _, reserved_until, _, shards in lines
+            if reserved_until is None
+        ])
+        if missing or not lines:
+            for product_id, quantity, _, reserved_until, _, shards in lines:
+                if reserved_until is not None or product_id not in missing:
+                    inventory.release(product_id, quantity, shards)
+            order.status = OrderStatus.FAILED
+            order.status_detail = 'Some products in the cart were out of stock.' if lines else 'The cart was empty.'
+            order.save(update_fields=['status', 'status_detail', 'updated_at'])
+            Cart.objects.filter(order=order).delete()
+            return
+
+        OrderItem.objects.bulk_create(
+            [
+                OrderItem(
+                    user_id=order.user_id,
+                    shop_id=order.shop_id,
+                    order=order,
+                    product_id=product_id,
+                    quantity=quantity,
+                    net_price=net_price,
+                )
+                for product_id, quantity, net_price, _, _, _ in lines
+            ],
+            batch_size=500,
+        )
+        suppliers = defaultdict(lambda: [0, 0])
+        for _, _, net_price, _, supplier_id, _ in lines:
+            suppliers[supplier_id][0] += 1
+            suppliers[supplier_id][1] += net_price
+        SupplierNotification.objects.bulk_create(
+            [
+                SupplierNotification(order=order, shop_id=supplier_id, item_count=item_count, total_price=total_price)
+                for supplier_id, (item_count, total_price) in suppliers.items()
+            ],
+            batch_size=500,
+        )
+        sales.record_order(order, [
+            (product_id, supplier_id, quantity, net_price)
+            for product_id, quantity, net_price, _, supplier_id, _ in lines
+        ])
+        order.total_price = sum(net_price for _, _, net_price, _, _, _ in lines)
+        order.status = OrderStatus.CONFIRMED
+        order.save(update_fields=['total_price', 'status', 'updated_at'])
+        cart.delete()
@@ -0,0 +1,148 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.views import APIView
+
+from .conditional import collection_validators, conditional_response, set_validators
+from .compiled import compile_serializer
+from .streaming import stream_response, stream_rows_response, wants_stream
+
+
+def position(row, ordering):
+    """The values of the ordering fields for a model instance or .values() row."""
+    fields = [field.lstrip('-') for field in ordering]
+    if isinstance(row, dict):
+        return [row[field] for field in fields]
+    return [getattr(row, field) for field in fields]
+
+
+def seek(ordering, values):
+    """Q for the rows strictly after values in ordering (a tuple comparison)."""
+    condition = Q()
+    for index in reversed(range(len(ordering))):
+        field = ordering[index].lstrip('-')
+        step = Q(**{f'{field}__lt' if ordering[index].startswith('-') else f'{field}__gt': values[index]})
+        if index < len(ordering) - 1:
+            step |= Q(**{field: values[index]}) & condition
+        condition = step
+    return condition
+
+
+def encode_cursor(values, reverse=False):
+    # Full isoformat: DjangoJSONEncoder would cut timestamps to milliseconds.
+    payload = json.dumps({'p': values, 'r': reverse}, default=lambda value: value.isoformat() if hasattr(value, 'isoformat') else str(value),
+                         separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor, model, ordering):
+    """(values, reverse) for a cursor; values are converted by the model fields."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        fields = [model._meta.get_field(field.lstrip('-')) for field in ordering]
+        if len(payload['p']) != len(fields):
+            raise ValueError(cursor)
+        return [field.to_python(value) for field, value in zip(fields, payload['p'])], bool(payload.get('r'))
+    except (ValueError, TypeError, KeyError, ValidationError, UnicodeDecodeError):
+        raise NotFound('Invalid cursor')
+
+
+class KeysetPagination(CursorPagination):
+    # Seeks on the whole (created_at, id) tuple, so deep pages cost the same
+    # as the first one and rows sharing a timestamp are still paged exactly.
+    # DRF's CursorPagination keys on created_at alone and falls back to an
+    # OFFSET (capped at 1000 rows) for ties. The page size comes from
+    # REST_FRAMEWORK['PAGE_SIZE'].
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        cursor = request.query_params.get(self.cursor_query_param)
+        values, reverse = decode_cursor(cursor, queryset.model, self.ordering) if cursor else (None, False)
+
+        # Going back walks the reversed ordering from the cursor.
+        ordering = [field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering] if reverse else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(seek(ordering, values))
+        rows = list(queryset[:self.page_size + 1])
+        more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = bool(rows) and (reverse or more)
+        self.has_previous = bool(rows) and (more if reverse else values is not None)
+        self.next_position = position(rows[-1], self.ordering) if self.has_next else None
+        self.previous_position = position(rows[0], self.ordering) if self.has_previous else None
+        if self.template is not None and (self.has_next or self.has_previous):
+            self.display_page_controls = True
+        return rows
+
+    def link(self, values, reverse):
+        if values is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, encode_cursor(values, reverse))
+
+    def get_next_link(self):
+        return self.link(self.next_position, False)
+
+    def get_previous_link(self):
+        return self.link(self.previous_position, True)
+
+
+class RankedPagination(KeysetPagination):
+    # For lists ranked by a precomputed score, best first.
+    ordering = ('-score', '-id')
+
+
+class ListAPIView(APIView):
+    pagination_class = KeysetPagination
+    # Timestamp fields behind the listed output. Views that set them answer
+    # If-None-Match / If-Modified-Since with a 304 before serializing.
+    last_modified_fields = ()
+    # Render through merchant.compiled instead of the serializer instances.
+    compiled_serializers = False
+
+    def list_response(self, queryset, serializer_class, **kwargs):
+        if self.last_modified_fields:
+            validators = collection_validators(self.request, queryset, self.last_modified_fields)
+            not_modified = conditional_response(self.request._request, **validators)
+            if not_modified is not None:
+                return not_modified
+            return set_validators(self.build_list_response(queryset, serializer_class, **kwargs), **validators)
+        return self.build_list_response(queryset, serializer_class, **kwargs)
+
+    def build_list_response(self, queryset, serializer_class, **kwargs):
+        ordering = self.pagination_class.ordering
+        if self.compiled_serializers and not kwargs:
+            # Rows come straight from .values() and skip DRF's field machinery;
+            # the ordering columns ride along for the cursor.
+            compiled = compile_serializer(serializer_class)
+            rows = compiled.values(queryset, *(field.lstrip('-') for field in ordering))
+            if wants_stream(self.request):
+                return stream_rows_response(rows.order_by(*ordering), compiled.represent)
+            paginator = self.pagination_class()
+            page = paginator.paginate_queryset(rows, self.request, view=self)
+            return paginator.get_paginated_response(compiled.many(page))
+
+        if hasattr(serializer_class, 'setup_eager_loading'):
+            queryset = serializer_class.setup_eager_loading(queryset)
+        if wants_stream(self.request):
+            # ?stream=true returns the whole result as one streamed JSON array
+            # instead of a page.
+            return stream_response(queryset.order_by(*ordering), serializer_class, **kwargs)
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(queryset, self.request, view=self)
+        serializer = serializer_class(page, many=True, **kwargs)
+        return paginator.get_paginated_response(serializer.data)
@@ -1,16 +1,18 @@
 from rest_framework import permissions
-from .models import Shop
+from .resolvers import resolve_shop
 
 
 class IsMerchantShop(permissions.BasePermission):
     def has_permission(self, request, view):
         if not request.user.is_authenticated:
             return False
-        shop_slug = view.kwargs.get('shop_slug')  # Assumes the URL parameter is named 'shop_id'
-        try:
-            shop = Shop.objects.get(slug=shop_slug)
-        except Shop.DoesNotExist:
+        shop_slug = view.kwargs.get('shop_slug')
+        if hasattr(request.user, 'shop_slugs'):
+            # Stateless tokens list the merchant's shops, so ownership is
+            # answered without touching the database.
+            return shop_slug in request.user.shop_slugs
+        shop = resolve_shop(request, shop_slug)
+        if shop is None:
             return False
- # Chreturn eck if the logged-in merchant is associated with the shop
-        merchant = request.user
-        return merchant.is_authenticated and shop.merchant == merchant
+        # Check if the logged-in merchant is associated with the shop
+        return shop.merchant_id == request.user.pk
@@ -0,0 +1,27 @@
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; DRF's encoder is used without it.
+    orjson = None
+
+# Anything orjson can't encode natively (lazy strings, Decimals outside a
+# serializer, ...) goes through DRF's encoder.
+_fallback = JSONEncoder()
+
+
+def dumps(data):
+    if orjson is None:
+        return JSONRenderer().render(data)
+    return orjson.dumps(data, default=_fallback.default)
+
+
+class ORJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            # orjson only indents by two spaces; leave indented output to DRF.
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
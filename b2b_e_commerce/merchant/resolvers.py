@@ -0,0 +1,24 @@
+from django.http import Http404
+from .models import Shop
+
+
+def resolve_shop(request, shop_slug):
+    # The shop is loaded once per request (merchant and category joined) and
+    # kept on the request, so IsMerchantShop and the view share one query.
+    shops = getattr(request, '_resolved_shops', None)
+    if shops is None:
+        shops = request._resolved_shops = {}
+    if shop_slug not in shops:
+        shops[shop_slug] = (
+            Shop.objects.select_related('merchant', 'category')
+            .filter(slug=shop_slug)
+            .first()
+        )
+    return shops[shop_slug]
+
+
+def get_request_shop(request, shop_slug):
+    shop = resolve_shop(request, shop_slug)
+    if shop is None:
+        raise Http404('No Shop matches the given query.')
+    return shop
@@ -0,0 +1,151 @@
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.urls import Resolver404, resolve
+from django.utils.functional import LazyObject
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .authentication import MerchantJWTAuthentication
+
+# Reads go to a replica only while a safe request to a merchant view is being
+# handled and nothing has been written yet. Everything else (writes, reads
+# inside a transaction, management commands, requests from merchants that just
+# wrote) stays on the primary.
+
+PIN_COOKIE = 'db_primary'
+
+
+class RoutingState:
+    def __init__(self, replica_reads):
+        self.replica_reads = replica_reads
+        self.wrote = False
+
+
+routing_state = ContextVar('routing_state', default=None)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = routing_state.get()
+        if state is None or not state.replica_reads or state.wrote:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        state = routing_state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def reads_from_replica(request):
+    if request.method not in ('GET', 'HEAD') or PIN_COOKIE in request.COOKIES:
+        return False
+    if not settings.DATABASE_REPLICAS:
+        return False
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return False
+    return match.func.__module__.startswith('merchant.')
+
+
+def client_id(request):
+    # The merchant a request comes from, known before any view has
+    # authenticated it: the user id claim of a valid bearer token, or the
+    # session's user. Checking the token is CPU only.
+    authentication = MerchantJWTAuthentication()
+    header = authentication.get_header(request)
+    if header is not None:
+        raw_token = authentication.get_raw_token(header)
+        if raw_token is None:
+            return None
+        try:
+            return authentication.get_validated_token(raw_token).get(api_settings.USER_ID_CLAIM)
+        except InvalidToken:
+            return None
+    session = getattr(request, 'session', None)
+    return session.get(SESSION_KEY) if session is not None else None
+
+
+def pin_key(user_id):
+    return f'db-primary:{user_id}'
+
+
+class ReplicaRoutingMiddleware:
+    # Reads that follow a write (e.g. the cart after BuyProducts.post) must
+    # not hit a replica that hasn't caught up yet, so a request that wrote
+    # pins its merchant to the primary for REPLICA_PIN_SECONDS. The pin is
+    # kept in the cache because token clients don't send cookies back, so
+    # replicas need a cache shared between processes (CACHE_URL, enforced in
+    # settings); browsers also get PIN_COOKIE.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        replica_reads = reads_from_replica(request)
+        if replica_reads:
+            user_id = client_id(request)
+            replica_reads = user_id is None or not cache.get(pin_key(user_id))
+        state = RoutingState(replica_reads)
+        token = routing_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            routing_state.reset(token)
+        if state.wrote and settings.DATABASE_REPLICAS:
+            user_id = self.writer_id(request)
+            if user_id is not None:
+                cache.set(pin_key(user_id), True, settings.REPLICA_PIN_SECONDS)
+        return self.pin(state, response)
+
+    async def __acall__(self, request):
+        replica_reads = reads_from_replica(request)
+        if replica_reads:
+            user_id = client_id(request)
+            replica_reads = user_id is None or not await cache.aget(pin_key(user_id))
+        state = RoutingState(replica_reads)
+        token = routing_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            routing_state.reset(token)
+        if state.wrote and settings.DATABASE_REPLICAS:
+            user_id = self.writer_id(request)
+            if user_id is not None:
+                await cache.aset(pin_key(user_id), True, settings.REPLICA_PIN_SECONDS)
+        return self.pin(state, response)
+
+    def writer_id(self, request):
+        # DRF sets request.user once the view has authenticated the request.
+        user = request.__dict__.get('user')
+        if user is not None and not isinstance(user, LazyObject) and user.is_authenticated:
+            return user.pk
+        return client_id(request)
+
+    def pin(self, state, response):
+        if state.wrote:
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+        return response
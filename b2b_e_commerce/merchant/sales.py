@@ -0,0 +1,128 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailyBuyerSales, DailyProductSales, OrderItem
+from .status import OrderStatus
+
+# Supplier analytics come from two rollup tables, one row per supplier, day
+# and product (DailyProductSales) or buying shop (DailyBuyerSales). Each
+# processed order adds to them with an insert-if-missing and a single UPDATE
+# of F() deltas per table, so concurrent workers never lose an increment and
+# a date-range query reads at most days x products rows.
+
+
+def _increment(model, key, day, rows):
+    # rows maps (shop_id, key_id) to {field: delta}.
+    model.objects.bulk_create(
+        [model(shop_id=shop_id, day=day, **{key: key_id}) for shop_id, key_id in rows],
+        ignore_conflicts=True,
+    )
+    fields = next(iter(rows.values()))
+    model.objects.filter(
+        day=day, shop_id__in={shop_id for shop_id, _ in rows}, **{f'{key}__in': {key_id for _, key_id in rows}}
+    ).update(**{
+        field: F(field) + Case(
+            *[When(shop_id=shop_id, then=Value(deltas[field]), **{key: key_id}) for (shop_id, key_id), deltas in rows.items()],
+            default=Value(0),
+            output_field=model._meta.get_field(field),
+        )
+        for field in fields
+    })
+
+
+def record_order(order, lines):
+    """Add a confirmed order to the rollups.
+
+    lines are (product_id, supplier_id, quantity, net_price). Call it in the
+    transaction that confirms the order, so it is counted exactly once.
+    """
+    if not lines:
+        return
+    day = timezone.localdate(order.created_at)
+    products = defaultdict(lambda: {'quantity': 0, 'revenue': 0})
+    buyers = defaultdict(lambda: {'orders': 1, 'quantity': 0, 'revenue': 0})
+    for product_id, supplier_id, quantity, net_price in lines:
+        for totals in (products[supplier_id, product_id], buyers[supplier_id, order.shop_id]):
+            totals['quantity'] += quantity
+            totals['revenue'] += net_price
+    _increment(DailyProductSales, 'product_id', day, products)
+    _increment(DailyBuyerSales, 'buyer_id', day, buyers)
+
+
+def rebuild(start=None, end=None, batch_size=5000):
+    """Recompute the rollups for [start, end] from the confirmed order lines."""
+    items = OrderItem.objects.filter(order__status=OrderStatus.CONFIRMED)
+    rollups = [DailyProductSales.objects.all(), DailyBuyerSales.objects.all()]
+    if start:
+        items = items.filter(order__created_at__date__gte=start)
+        rollups = [rows.filter(day__gte=start) for rows in rollups]
+    if end:
+        items = items.filter(order__created_at__date__lte=end)
+        rollups = [rows.filter(day__lte=end) for rows in rollups]
+    items = items.annotate(day=TruncDate('order__created_at')).order_by()
+
+    with transaction.atomic():
+        for rows in rollups:
+            rows.delete()
+        products = items.values('product__shop_id', 'day', 'product_id').annotate(
+            total_quantity=Sum('quantity'), total_revenue=Sum('net_price')
+        )
+        DailyProductSales.objects.bulk_create(
+            (
+                DailyProductSales(shop_id=row['product__shop_id'], day=row['day'], product_id=row['product_id'],
+                                  quantity=row['total_quantity'], revenue=row['total_revenue'])
+                for row in products.iterator()
+            ),
+            batch_size=batch_size,
+        )
+        buyers = items.values('product__shop_id', 'day', 'shop_id').annotate(
+            total_orders=Count('order_id', distinct=True), total_quantity=Sum('quantity'), total_revenue=Sum('net_price')
+        )
+        DailyBuyerSales.objects.bulk_create(
+            (
+                DailyBuyerSales(shop_id=row['product__shop_id'], day=row['day'], buyer_id=row['shop_id'],
+                                orders=row['total_orders'], quantity=row['total_quantity'], revenue=row['total_revenue'])
+                for row in buyers.iterator()
+            ),
+            batch_size=batch_size,
+        )
+    return DailyProductSales.objects.count(), DailyBuyerSales.objects.count()
+
+
+def shop_analytics(shop, start, end, limit=10):
+    products = DailyProductSales.objects.filter(shop=shop, day__range=(start, end))
+    buyers = DailyBuyerSales.objects.filter(shop=shop, day__range=(start, end))
+    totals = {'orders': Sum('orders'), 'quantity': Sum('quantity'), 'revenue': Sum('revenue')}
+    days = list(buyers.values('day').annotate(**totals).order_by('day'))
+    top_products = list(
+        products.values('product_id', 'product__uid', 'product__title')
+        .annotate(quantity_sold=Sum('quantity'), revenue_total=Sum('revenue'))
+        .order_by('-revenue_total', 'product_id')[:limit]
+    )
+    top_buyers = list(
+        buyers.values('buyer_id', 'buyer__uid', 'buyer__name', 'buyer__slug')
+        .annotate(order_count=Sum('orders'), quantity_sold=Sum('quantity'), revenue_total=Sum('revenue'))
+        .order_by('-revenue_total', 'buyer_id')[:limit]
+    )
+    return {
+        'start': start,
+        'end': end,
+        'orders': sum(row['orders'] for row in days),
+        'quantity': sum(row['quantity'] for row in days),
+        'revenue': sum((row['revenue'] for row in days), 0),
+        'days': days,
+        'top_products': [
+            {'uid': row['product__uid'], 'title': row['product__title'],
+             'quantity': row['quantity_sold'], 'revenue': row['revenue_total']}
+            for row in top_products
+        ],
+        'top_buyers': [
+            {'uid': row['buyer__uid'], 'name': row['buyer__name'], 'slug': row['buyer__slug'],
+             'orders': row['order_count'], 'quantity': row['quantity_sold'], 'revenue': row['revenue_total']}
+            for row in top_buyers
+        ],
+    }
@@ -0,0 +1,233 @@
+import re
+
+from django.db import connection, connections
+
+from .models import Product, ShopNeighbor
+from .serializers import ProductSerializer
+
+# The full-text index covers product titles plus the owning shop's name and
+# category title. SQLite gets an FTS5 table, PostgreSQL a weighted tsvector
+# column with a GIN index. Both are kept in sync by triggers, so bulk_create
+# and queryset updates are indexed too.
+
+SQLITE_INSTALL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS merchant_product_fts USING fts5(
+        title, shop_name, category_title, tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS merchant_product_fts_insert AFTER INSERT ON merchant_product BEGIN
+        INSERT INTO merchant_product_fts (rowid, title, shop_name, category_title)
+        SELECT new.id, new.title, s.name, c.title
+        FROM merchant_shop s JOIN merchant_category c ON c.id = s.category_id
+        WHERE s.id = new.shop_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS merchant_product_fts_update AFTER UPDATE OF title, shop_id ON merchant_product BEGIN
+        DELETE FROM merchant_product_fts WHERE rowid = old.id;
+        INSERT INTO merchant_product_fts (rowid, title, shop_name, category_title)
+        SELECT new.id, new.title, s.name, c.title
+        FROM merchant_shop s JOIN merchant_category c ON c.id = s.category_id
+        WHERE s.id = new.shop_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS merchant_product_fts_delete AFTER DELETE ON merchant_product BEGIN
+        DELETE FROM merchant_product_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS merchant_shop_fts_update AFTER UPDATE OF name, category_id ON merchant_shop BEGIN
+        UPDATE merchant_product_fts
+        SET shop_name = new.name,
+            category_title = (SELECT title FROM merchant_category WHERE id = new.category_id)
+        WHERE rowid IN (SELECT id FROM merchant_product WHERE shop_id = new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS merchant_category_fts_update AFTER UPDATE OF title ON merchant_category BEGIN
+        UPDATE merchant_product_fts
+        SET category_title = new.title
+        WHERE rowid IN (
+            SELECT p.id FROM merchant_product p JOIN merchant_shop s ON s.id = p.shop_id
+            WHERE s.category_id = new.id
+        );
+    END
+    """,
+]
+
+SQLITE_REBUILD = [
+    'DELETE FROM merchant_product_fts',
+    """
+    INSERT INTO merchant_product_fts (rowid, title, shop_name, category_title)
+    SELECT p.id, p.title, s.name, c.title
+    FROM merchant_product p
+    JOIN merchant_shop s ON s.id = p.shop_id
+    JOIN merchant_category c ON c.id = s.category_id
+    """,
+]
+
+SQLITE_UNINSTALL = [
+    'DROP TRIGGER IF EXISTS merchant_category_fts_update',
+    'DROP TRIGGER IF EXISTS merchant_shop_fts_update',
+    'DROP TRIGGER IF EXISTS merchant_product_fts_delete',
+    'DROP TRIGGER IF EXISTS merchant_product_fts_update',
+    'DROP TRIGGER IF EXISTS merchant_product_fts_insert',
+    'DROP TABLE IF EXISTS merchant_product_fts',
+]
+
+POSTGRES_INSTALL = [
+    'ALTER TABLE merchant_product ADD COLUMN IF NOT EXISTS search_vector tsvector',
+    """
+    CREATE OR REPLACE FUNCTION merchant_product_search_document(product_title text, product_shop_id bigint)
+    RETURNS tsvector AS $$
+        SELECT setweight(to_tsvector('simple', coalesce(product_title, '')), 'A')
+            || setweight(to_tsvector('simple', coalesce(s.name, '')), 'B')
+            || setweight(to_tsvector('simple', coalesce(c.title, '')), 'C')
+        FROM merchant_shop s JOIN merchant_category c ON c.id = s.category_id
+        WHERE s.id = product_shop_id
+    $$ LANGUAGE sql STABLE
+    """,
+    """
+    CREATE OR REPLACE FUNCTION merchant_product_search_trigger() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := merchant_product_search_document(NEW.title, NEW.shop_id);
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    'DROP TRIGGER IF EXISTS merchant_product_search_update ON merchant_product',
+    """
+    CREATE TRIGGER merchant_product_search_update
+    BEFORE INSERT OR UPDATE OF title, shop_id ON merchant_product
+    FOR EACH ROW EXECUTE FUNCTION merchant_product_search_trigger()
+    """,
+    """
+    CREATE OR REPLACE FUNCTION merchant_shop_search_trigger() RETURNS trigger AS $$
+    BEGIN
+        UPDATE merchant_product
+        SET search_vector = merchant_product_search_document(title, shop_id)
+        WHERE shop_id = NEW.id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    'DROP TRIGGER IF EXISTS merchant_shop_search_update ON merchant_shop',
+    """
+    CREATE TRIGGER merchant_shop_search_update
+    AFTER UPDATE OF name, category_id ON merchant_shop
+    FOR EACH ROW EXECUTE FUNCTION merchant_shop_search_trigger()
+    """,
+    """
+    CREATE OR REPLACE FUNCTION merchant_category_search_trigger() RETURNS trigger AS $$
+    BEGIN
+        UPDATE merchant_product p
+        SET search_vector = merchant_product_search_document(p.title, p.shop_id)
+        FROM merchant_shop s
+        WHERE s.id = p.shop_id AND s.category_id = NEW.id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    'DROP TRIGGER IF EXISTS merchant_category_search_update ON merchant_category',
+    """
+    CREATE TRIGGER merchant_category_search_update
+    AFTER UPDATE OF title ON merchant_category
+    FOR EACH ROW EXECUTE FUNCTION merchant_category_search_trigger()
+    """,
+    'CREATE INDEX IF NOT EXISTS merchant_product_search_idx ON merchant_product USING gin (search_vector)',
+]
+
+POSTGRES_REBUILD = [
+    'UPDATE merchant_product SET search_vector = merchant_product_search_document(title, shop_id)',
+]
+
+POSTGRES_UNINSTALL = [
+    'DROP TRIGGER IF EXISTS merchant_category_search_update ON merchant_category',
+    'DROP TRIGGER IF EXISTS merchant_shop_search_update ON merchant_shop',
+    'DROP TRIGGER IF EXISTS merchant_product_search_update ON merchant_product',
+    'DROP FUNCTION IF EXISTS merchant_category_search_trigger()',
+    'DROP FUNCTION IF EXISTS merchant_shop_search_trigger()',
+    'DROP FUNCTION IF EXISTS merchant_product_search_trigger()',
+    'DROP FUNCTION IF EXISTS merchant_product_search_document(text, bigint)',
+    'ALTER TABLE merchant_product DROP COLUMN IF EXISTS search_vector',
+]
+
+STATEMENTS = {
+    'sqlite': {'install': SQLITE_INSTALL, 'rebuild': SQLITE_REBUILD, 'uninstall': SQLITE_UNINSTALL},
+    'postgresql': {'install': POSTGRES_INSTALL, 'rebuild': POSTGRES_REBUILD, 'uninstall': POSTGRES_UNINSTALL},
+}
+
+MAX_TERMS = 8
+
+
+def run_search_sql(using_connection, step):
+    # Every statement is idempotent. SQLite drops a table's triggers when a
+    # migration rebuilds that table, so 'install' also runs after every
+    # migrate (see MerchantConfig.ready).
+    statements = STATEMENTS.get(using_connection.vendor, {}).get(step, [])
+    with using_connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def ensure_search_triggers(sender, using, **kwargs):
+    using_connection = connections[using]
+    if using_connection.vendor != 'sqlite':
+        return
+    if 'merchant_product_fts' not in using_connection.introspection.table_names():
+        return
+    with using_connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'merchant_%_fts_%'")
+        installed = cursor.fetchone()[0]
+    if installed < len(SQLITE_INSTALL) - 1:
+        # Rows may have changed while the triggers were missing.
+        run_search_sql(using_connection, 'install')
+        run_search_sql(using_connection, 'rebuild')
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def ranked_product_ids(shop, terms, limit):
+    # Every term is prefix-matched and all terms must match. Title hits rank
+    # above shop-name hits, which rank above category hits.
+    neighbors = "SELECT neighbor_id FROM merchant_shopneighbor WHERE shop_id = %s"
+    if connection.vendor == 'sqlite':
+        sql = f"""
+            SELECT p.id FROM merchant_product_fts f
+            JOIN merchant_product p ON p.id = f.rowid
+            WHERE merchant_product_fts MATCH %s AND p.shop_id IN ({neighbors})
+            ORDER BY bm25(merchant_product_fts, 10.0, 3.0, 1.0)
+            LIMIT %s
+        """
+        params = [' '.join(f'"{term}"*' for term in terms), shop.pk, limit]
+    elif connection.vendor == 'postgresql':
+        sql = f"""
+            SELECT p.id FROM merchant_product p, to_tsquery('simple', %s) query
+            WHERE p.search_vector @@ query AND p.shop_id IN ({neighbors})
+            ORDER BY ts_rank(p.search_vector, query) DESC
+            LIMIT %s
+        """
+        params = [' & '.join(f'{term}:*' for term in terms), shop.pk, limit]
+    else:
+        products = Product.objects.filter(shop_id__in=ShopNeighbor.objects.neighbor_ids(shop))
+        for term in terms:
+            products = products.filter(title__icontains=term)
+        return list(products.values_list('id', flat=True)[:limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_products(shop, query, limit=20):
+    terms = search_terms(query)
+    if not terms:
+        return []
+    ids = ranked_product_ids(shop, terms, limit)
+    products = ProductSerializer.setup_eager_loading(Product.objects).in_bulk(ids)
+    return [products[pk] for pk in ids if pk in products]
@@ -0,0 +1,204 @@
+import random
+import uuid
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import django
+from django.apps import apps
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from django.utils.text import slugify
+
+from .bulk import insert_rows, reset_sequences
+from .models import *
+
+# Synthetic data for load tests. Rows are written as plain tuples with
+# executemany, bypassing model instances: AutoSlugField would otherwise probe
+# the database once per row for a free slug, so slugs and primary keys are
+# computed here instead. Every id is derived from the row's position, which
+# lets worker processes fill disjoint ranges and makes a given --seed produce
+# the same data regardless of the number of workers.
+
+ADJECTIVES = ('organic', 'fresh', 'premium', 'classic', 'spicy', 'smoked', 'frozen', 'roasted', 'wholesale', 'local')
+NOUNS = ('tea', 'coffee', 'rice', 'flour', 'honey', 'lentils', 'olive oil', 'salmon', 'cheese', 'noodles', 'sugar', 'spices')
+
+
+@dataclass(frozen=True)
+class SeedPlan:
+    seed: int
+    merchants: int
+    categories: int
+    shops_per_category: int
+    connections_per_shop: int
+    products_per_shop: int
+    carts: int
+    cart_size: int
+    orders_per_shop: int
+    order_size: int
+    password_hash: str
+    created_at: datetime
+    first_ids: dict
+    # Rows are spread over the days before created_at.
+    days: int = 90
+    staff: bool = False
+    # Stock of every product; random when None.
+    stock: int = None
+
+    @property
+    def shops(self):
+        return self.categories * self.shops_per_category
+
+    def id(self, model, index):
+        return self.first_ids[model._meta.label] + index
+
+    def neighbors(self, shop_index):
+        # Shops in a category form a ring; each connects to the next
+        # connections_per_shop shops, which gives every shop twice as many
+        # neighbors and no duplicate pairs.
+        category, position = divmod(shop_index, self.shops_per_category)
+        start = category * self.shops_per_category
+        return [start + (position + step) % self.shops_per_category for step in range(1, self.connections_per_shop + 1)]
+
+    def product_id(self, shop_index, position):
+        return self.id(Product, shop_index * self.products_per_shop + position)
+
+    def product_price(self, product_id):
+        return Decimal((product_id * 2654435761 + self.seed) % 9900 + 100) / 100
+
+
+SEEDED_MODELS = (Merchant, Category, Shop, ShopConnection, ShopNeighbor, Product, Cart, CartItem, Order, OrderItem)
+
+
+def first_ids():
+    return {model._meta.label: (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1 for model in SEEDED_MODELS}
+
+
+def finish():
+    # Ids were inserted explicitly; later create() calls must not reuse them.
+    reset_sequences(SEEDED_MODELS)
+
+
+BASE_FIELDS = ['id', 'uid', 'created_at', 'updated_at']
+
+
+def base_values(plan, model, index):
+    # uids are derived from the seed and the row's id, so reruns into an
+    # empty database match exactly and a second run into the same one adds
+    # fresh rows. Timestamps are scattered over plan.days: the multiplier is
+    # prime, so no two rows of a model share one and listings page like real
+    # data.
+    uid = uuid.uuid5(uuid.NAMESPACE_OID, f'{plan.seed}-{model._meta.label}-{plan.id(model, index)}')
+    created_at = plan.created_at - timedelta(microseconds=(index * 2654435761) % (plan.days * 86_400_000_000))
+    return [plan.id(model, index), uid, created_at, created_at]
+
+
+def seed_catalog(plan):
+    # Categories, merchants, shops and connections: small enough for one
+    # process. Merchants point at their first shop as the active one; the
+    # foreign key is only checked at commit.
+    with transaction.atomic():
+        insert_rows(Category, BASE_FIELDS + ['title', 'slug'], (
+            base_values(plan, Category, c) + [f'Seed category {plan.id(Category, c)}', f'seed-category-{plan.id(Category, c)}']
+            for c in range(plan.categories)
+        ))
+        insert_rows(Merchant, BASE_FIELDS + ['email', 'name', 'dob', 'password', 'is_superuser', 'is_active', 'is_staff', 'token_version', 'active_shop'], (
+            base_values(plan, Merchant, m) + [
+                f'seed{plan.id(Merchant, m)}@example.com', f'Seed merchant {plan.id(Merchant, m)}', date(1990, 1, 1),
+                plan.password_hash, False, True, plan.staff, 0, plan.id(Shop, m) if m < plan.shops else None,
+            ]
+            for m in range(plan.merchants)
+        ))
+        insert_rows(Shop, BASE_FIELDS + ['name', 'slug', 'merchant', 'category', 'address', 'description'], (
+            base_values(plan, Shop, s) + [
+                f'Seed shop {plan.id(Shop, s)}', f'seed-shop-{plan.id(Shop, s)}', plan.id(Merchant, s % plan.merchants),
+                plan.id(Category, s // plan.shops_per_category), f'{s} Seed street', 'Synthetic shop',
+            ]
+            for s in range(plan.shops)
+        ))
+        pairs = [(s, t) for s in range(plan.shops) for t in plan.neighbors(s)]
+        directed = [pair for s, t in pairs for pair in ((s, t), (t, s))]
+        insert_rows(ShopConnection, BASE_FIELDS + ['sender_shop', 'receiver_shop', 'status'], (
+            base_values(plan, ShopConnection, n) + [plan.id(Shop, s), plan.id(Shop, t), 'approved']
+            for n, (s, t) in enumerate(directed)
+        ))
+        insert_rows(ShopNeighbor, ['id', 'shop', 'neighbor'], (
+            [plan.id(ShopNeighbor, n), plan.id(Shop, s), plan.id(Shop, t)]
+            for n, (s, t) in enumerate(directed)
+        ))
+    return len(directed)
+
+
+def seed_products(plan, start, stop):
+    def rows():
+        for s in range(start, stop):
+            rng = random.Random(f'{plan.seed}-products-{s}')
+            for position in range(plan.products_per_shop):
+                product_id = plan.product_id(s, position)
+                title = f'{rng.choice(ADJECTIVES).title()} {rng.choice(NOUNS)} {product_id}'
+                yield base_values(plan, Product, s * plan.products_per_shop + position) + [
+                    title, slugify(title), plan.product_price(product_id), plan.id(Shop, s), rng.randint(0, 10_000) if plan.stock is None else plan.stock, 0,
+                ]
+
+    return insert_rows(Product, BASE_FIELDS + ['title', 'slug', 'price', 'shop', 'quantity', 'stock_shards'], rows())
+
+
+def seed_orders(plan, start, stop):
+    # Carts for the first plan.carts shops and orders for every shop, all
+    # filled from the shop's neighbors' products.
+    carts, cart_items, orders, order_items = [], [], [], []
+    for s in range(start, stop):
+        rng = random.Random(f'{plan.seed}-orders-{s}')
+        merchant_id, shop_id = plan.id(Merchant, s % plan.merchants), plan.id(Shop, s)
+        suppliers = plan.neighbors(s)
+        if not suppliers:
+            continue
+
+        def pick_lines(size):
+            supplier = rng.choice(suppliers)
+            positions = rng.sample(range(plan.products_per_shop), min(size, plan.products_per_shop))
+            return [(plan.product_id(supplier, p), rng.randint(1, 5)) for p in positions]
+
+        if s < plan.carts:
+            lines = pick_lines(plan.cart_size)
+            total = sum(plan.product_price(pid) * quantity for pid, quantity in lines)
+            carts.append(base_values(plan, Cart, s) + [merchant_id, shop_id, total, len(lines)])
+            for n, (pid, quantity) in enumerate(lines):
+                cart_items.append(base_values(plan, CartItem, s * plan.cart_size + n) + [
+                    merchant_id, shop_id, plan.id(Cart, s), pid, quantity, plan.product_price(pid) * quantity,
+                ])
+        for o in range(plan.orders_per_shop):
+            order_index = s * plan.orders_per_shop + o
+            lines = pick_lines(plan.order_size)
+            total = sum(plan.product_price(pid) * quantity for pid, quantity in lines)
+            orders.append(base_values(plan, Order, order_index) + [
+                merchant_id, shop_id, f'{s} Seed street', total, rng.choice(PaymentOption.values), OrderStatus.CONFIRMED, '',
+            ])
+            for n, (pid, quantity) in enumerate(lines):
+                order_items.append(base_values(plan, OrderItem, order_index * plan.order_size + n) + [
+                    merchant_id, shop_id, plan.id(Order, order_index), pid, quantity, plan.product_price(pid) * quantity,
+                ])
+
+    insert_rows(Cart, BASE_FIELDS + ['user', 'shop', 'total_price', 'item_count'], carts)
+    insert_rows(CartItem, BASE_FIELDS + ['user', 'shop', 'cart', 'product', 'quantity', 'net_price'], cart_items)
+    insert_rows(Order, BASE_FIELDS + ['user', 'shop', 'delivery_address', 'total_price', 'payment_method', 'status', 'status_detail'], orders)
+    insert_rows(OrderItem, BASE_FIELDS + ['user', 'shop', 'order', 'product', 'quantity', 'net_price'], order_items)
+    return len(orders)
+
+
+def init_worker(sqlite_timeout=300):
+    # Worker processes get their own connections. SQLite serializes the
+    # writers, so they wait for the lock instead of failing after 5 seconds.
+    if not apps.ready:
+        django.setup()
+    connections.close_all()
+    if connection.vendor == 'sqlite':
+        connection.settings_dict.setdefault('OPTIONS', {})['timeout'] = sqlite_timeout
+
+
+def run_task(task):
+    step, plan, start, stop = task
+    return step, stop - start, STEPS[step](plan, start, stop)
+
+
+STEPS = {'products': seed_products, 'orders': seed_orders}
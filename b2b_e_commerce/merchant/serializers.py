@@ -1,11 +1,32 @@
+import operator
+from datetime import timedelta
+
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django.utils.translation import gettext as _
 from rest_framework import serializers
 from merchant.models import *
 from django.contrib.auth import get_user_model
 from django.contrib.auth import authenticate
 
-class MerchantSerializer(serializers.Serializer):
+
+class EagerLoadingMixin:
+    # Relations the serializer walks while rendering. List views pass their
+    # queryset through setup_eager_loading so nested output costs a fixed
+    # number of queries instead of one per row.
+    select_related_fields = ()
+    prefetch_related_fields = ()
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        if cls.select_related_fields:
+            queryset = queryset.select_related(*cls.select_related_fields)
+        if cls.prefetch_related_fields:
+            queryset = queryset.prefetch_related(*cls.prefetch_related_fields)
+        return queryset
+
+
+class MerchantSerializer(EagerLoadingMixin, serializers.Serializer):
     uid = serializers.UUIDField(read_only=True)
     email = serializers.EmailField(max_length=50)
     name = serializers.CharField(max_length=50)
@@ -66,7 +87,7 @@ class UserLoginSerializer(serializers.Serializer):
             raise serializers.ValidationError('Invalid credentials')
 
 
-class CategorySerializer(serializers.Serializer):
+class CategorySerializer(EagerLoadingMixin, serializers.Serializer):
     uid = serializers.UUIDField(read_only=True)
     title = serializers.CharField()
     slug = serializers.SlugField(read_only=True)
@@ -75,7 +96,15 @@ class CategorySerializer(serializers.Serializer):
         return Category.objects.create(**validated_data)
 
 
-class ShopSerializer(serializers.Serializer):
+class ShopSerializer(EagerLoadingMixin, serializers.Serializer):
+    select_related_fields = ('merchant', 'category')
+    # Shop.merchant renders as Merchant.__str__ and Shop.active is a property;
+    # these are their column equivalents for merchant.compiled.
+    values_sources = {
+        'merchant': 'merchant__name',
+        'active': (('merchant__active_shop_id', 'id'), operator.eq),
+    }
+
     uid = serializers.UUIDField(read_only = True)
     name = serializers.CharField()
     slug = serializers.SlugField(read_only=True)
@@ -85,11 +114,11 @@ class ShopSerializer(serializers.Serializer):
     category_id = serializers.IntegerField(write_only=True)
     address = serializers.CharField()
     description = serializers.CharField()
-    active = serializers.BooleanField(default=False)
+    active = serializers.BooleanField(read_only=True)
     def create(self, validated_data):
         category_id = validated_data.pop('category_id')
         user=validated_data.pop('user')
-        mechant=Merchant.objects.get(email=user.email)
+        mechant=Merchant.objects.get(pk=user.pk)
         category = Category.objects.get(id=category_id)
         shop = Shop.objects.create(category=category, merchant=mechant,**validated_data)
         return shop
@@ -101,6 +130,34 @@ class ShopSerializer(serializers.Serializer):
         instance.save()
         return instance
 
+class AutocompleteQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=100)
+    limit = serializers.IntegerField(min_value=1, max_value=50, default=10)
+
+
+class AutocompleteResultSerializer(serializers.Serializer):
+    type = serializers.CharField()
+    uid = serializers.UUIDField()
+    name = serializers.CharField()
+    slug = serializers.SlugField()
+
+
+class ShopCandidateSerializer(EagerLoadingMixin, serializers.Serializer):
+    select_related_fields = ('candidate__merchant', 'candidate__category')
+
+    uid = serializers.UUIDField(source='candidate.uid', read_only=True)
+    name = serializers.CharField(source='candidate.name', read_only=True)
+    slug = serializers.SlugField(source='candidate.slug', read_only=True)
+    merchant = serializers.CharField(source='candidate.merchant.name', read_only=True)
+    category = CategorySerializer(source='candidate.category', read_only=True)
+    address = serializers.CharField(source='candidate.address', read_only=True)
+    description = serializers.CharField(source='candidate.description', read_only=True)
+    product_count = serializers.IntegerField(read_only=True)
+    mutual_connections = serializers.IntegerField(read_only=True)
+    last_active_at = serializers.DateTimeField(read_only=True)
+    score = serializers.FloatField(read_only=True)
+
+
 class MyShopSerializer(ShopSerializer):
     def create(self, validated_data):
         category_id = validated_data.pop('category_id')
@@ -117,7 +174,12 @@ class MyShopSerializer(ShopSerializer):
         instance.save()
         return instance
 
-class MyShopDetailSerializer(serializers.Serializer):
+class MyShopDetailSerializer(EagerLoadingMixin, serializers.Serializer):
+    select_related_fields = ('merchant', 'category')
+    values_sources = {
+        'active': (('merchant__active_shop_id', 'id'), operator.eq),
+    }
+
     uid = serializers.UUIDField(read_only=True)
     name = serializers.CharField()
     slug = serializers.SlugField(read_only=True)
@@ -125,10 +187,12 @@ class MyShopDetailSerializer(serializers.Serializer):
     category = CategorySerializer()
     address = serializers.CharField()
     description = serializers.CharField()
-    active = serializers.BooleanField(default=False)
+    active = serializers.BooleanField(read_only=True)
+
 
+class ConnectionRequestSerializer(EagerLoadingMixin, serializers.Serializer):
+    select_related_fields = ('receiver_shop__merchant', 'receiver_shop__category')
 
-class ConnectionRequestSerializer(serializers.Serializer):
     uid = serializers.UUIDField(read_only=True)
     receiver_shop_id = serializers.IntegerField(write_only=True)
     receiver_shop = ShopSerializer(read_only=True)
@@ -138,9 +202,8 @@ class ConnectionRequestSerializer(serializers.Serializer):
 
     def create(self, validated_data):
         receiver_shop_id = validated_data.get('receiver_shop_id')
-        sender_shop_data = Shop.objects.get(active=True)
+        sender_shop = validated_data.get('sender_shop')
         status = validated_data.get('status')
-        sender_shop = Shop.objects.get(id=sender_shop_data['id'])
         receiver_shop = Shop.objects.get(id=receiver_shop_id)
 
         return ShopConnection.objects.create(sender_shop=sender_shop, receiver_shop=receiver_shop, status=status)
@@ -152,7 +215,9 @@ class ConnectionRequestSerializer(serializers.Serializer):
         return instance
 
 
-class ConnectionResponseSerializer(serializers.Serializer):
+class ConnectionResponseSerializer(EagerLoadingMixin, serializers.Serializer):
+    select_related_fields = ('sender_shop__merchant', 'sender_shop__category')
+
     uid = serializers.UUIDField(read_only=True)
     sender_shop = ShopSerializer(read_only=True)
     created_at = serializers.DateTimeField(read_only=True)
@@ -166,25 +231,67 @@ class ConnectionResponseSerializer(serializers.Serializer):
         return instance
 
 
-class ProductSerializer(serializers.Serializer):
+class ProductSerializer(EagerLoadingMixin, serializers.Serializer):
+    select_related_fields = ('shop__merchant', 'shop__category')
+
     uid = serializers.UUIDField(read_only=True)
-    title = serializers.CharField()
+    title = serializers.CharField(max_length=250)
     price = serializers.DecimalField(max_digits=8, decimal_places=2)
-    quantity = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0)
     slug = serializers.SlugField(read_only=True)
     shop = ShopSerializer(read_only=True)
     def create(self, validated_data):
         return Product.objects.create(**validated_data)
 
 
+class ProductSearchSerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=200)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+
+class AnalyticsQuerySerializer(serializers.Serializer):
+    # Defaults to the last 30 days.
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+    def validate(self, data):
+        data.setdefault('end', timezone.localdate())
+        data.setdefault('start', data['end'] - timedelta(days=29))
+        if data['start'] > data['end']:
+            raise serializers.ValidationError('start must not be after end.')
+        if (data['end'] - data['start']).days >= 366:
+            raise serializers.ValidationError('The range can span at most 366 days.')
+        return data
+
+
 class BuyProductSerializer(serializers.Serializer):
     uid = serializers.UUIDField()
     title = serializers.CharField(read_only=True)
     price = serializers.DecimalField(max_digits=8, decimal_places=2, read_only=True)
-    quantity = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
     def create(self, validated_data):
         return CartItem.objects.create(**validated_data)
 
+class BuyProductLineSerializer(serializers.Serializer):
+    uid = serializers.UUIDField()
+    quantity = serializers.IntegerField(min_value=1)
+    status = serializers.CharField(read_only=True)
+
+
+class BuyProductBatchSerializer(serializers.Serializer):
+    items = BuyProductLineSerializer(many=True, allow_empty=False)
+
+    def validate_items(self, items):
+        if len(items) > 500:
+            raise serializers.ValidationError('A batch can contain at most 500 lines.')
+        return items
+
+
+class CartItemRemoveSerializer(serializers.Serializer):
+    uid = serializers.UUIDField()
+
+
 class CartItemSerializer(serializers.ModelSerializer):
     product = serializers.StringRelatedField()
     net_price = serializers.DecimalField(max_digits=8, decimal_places=2, read_only=True)
@@ -193,12 +300,14 @@ class CartItemSerializer(serializers.ModelSerializer):
         fields = ['product', 'quantity','net_price']
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    prefetch_related_fields = ('cartitem_set__product',)
+
     items = CartItemSerializer(many=True,read_only=True,source='cartitem_set')
     total_price = serializers.DecimalField(max_digits=8, decimal_places=2, read_only=True)
     class Meta:
         model = Cart
-        fields = ['items', 'total_price']
+        fields = ['items', 'total_price', 'item_count']
 
 
 # class OrderSerializer(serializers.Serializer):
@@ -219,13 +328,19 @@ class OrderItemSerializer(serializers.ModelSerializer):
         model = OrderItem
         fields = ['product', 'quantity','net_price']
 
-class OrderSerializer(serializers.Serializer):
+class OrderSerializer(EagerLoadingMixin, serializers.Serializer):
+    select_related_fields = ('shop',)
+    prefetch_related_fields = ('orderitem_set__product',)
+
     shop = serializers.CharField(source='shop.name', read_only=True)
     # orderitem_set = OrderItemSerializer(many=True, read_only=True)
     items = OrderItemSerializer(source = 'orderitem_set',many=True, read_only=True)
     total_price = serializers.DecimalField(max_digits=8, decimal_places=2,read_only=True)
     delivery_address = serializers.CharField(max_length=150)
     payment_method = serializers.ChoiceField(choices=PaymentOption.choices)
+    # PENDING until the order job has run, see merchant.orders.
+    status = serializers.CharField(read_only=True)
+    status_detail = serializers.CharField(read_only=True)
 
     def create(self, validated_data):
         return Order.objects.create(**validated_data)
@@ -0,0 +1,33 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .autocomplete import index
+from .models import Category, Shop
+
+# The in-process index only changes once the write has committed; a rolled
+# back save or delete leaves it alone.
+
+
+@receiver(post_save, sender=Shop)
+def index_shop(sender, instance, **kwargs):
+    values = ('shop', instance.pk, instance.uid, instance.name, instance.slug)
+    transaction.on_commit(lambda: index.put(*values))
+
+
+@receiver(post_save, sender=Category)
+def index_category(sender, instance, **kwargs):
+    values = ('category', instance.pk, instance.uid, instance.title, instance.slug)
+    transaction.on_commit(lambda: index.put(*values))
+
+
+@receiver(post_delete, sender=Shop)
+def unindex_shop(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: index.remove('shop', pk))
+
+
+@receiver(post_delete, sender=Category)
+def unindex_category(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: index.remove('category', pk))
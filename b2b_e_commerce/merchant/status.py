@@ -15,4 +15,9 @@ class ConnectionStatus(TextChoices):
 class PaymentOption(TextChoices):
     CASH_ON_DELIVERY = "CASH ON DELIVERY", "Cash on delivery"
     MOBILE_BANKING = "MOBILE BANKING","Mobile Banking"
-    ONLINE_BANKING = "ONLINE BANKING","Moble Banking"
\ No newline at end of file
+    ONLINE_BANKING = "ONLINE BANKING","Moble Banking"
+
+class OrderStatus(TextChoices):
+    PENDING = "PENDING","Pending"
+    CONFIRMED = "CONFIRMED","Confirmed"
+    FAILED = "FAILED","Failed"
@@ -0,0 +1,39 @@
+from django.http import StreamingHttpResponse
+
+from .renderers import dumps
+
+STREAM_CHUNK_SIZE = 500
+STREAM_BUFFER_SIZE = 64 * 1024
+
+
+def wants_stream(request):
+    return request.query_params.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+def iter_json_array(rows, represent):
+    # Rows are represented one by one and the output is flushed in ~64KB
+    # pieces, so memory stays flat however many rows there are.
+    buffer, size, separator = [b'['], 1, b''
+    for row in rows:
+        piece = separator + dumps(represent(row))
+        separator = b','
+        buffer.append(piece)
+        size += len(piece)
+        if size >= STREAM_BUFFER_SIZE:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    buffer.append(b']')
+    yield b''.join(buffer)
+
+
+def stream_response(queryset, serializer_class, chunk_size=STREAM_CHUNK_SIZE, **kwargs):
+    # Instances are fetched chunk_size at a time and serialized through a
+    # single serializer instance.
+    serializer = serializer_class(**kwargs)
+    return stream_rows_response(queryset.iterator(chunk_size=chunk_size), serializer.to_representation)
+
+
+def stream_rows_response(rows, represent, chunk_size=STREAM_CHUNK_SIZE):
+    if hasattr(rows, 'iterator'):
+        rows = rows.iterator(chunk_size=chunk_size)
+    return StreamingHttpResponse(iter_json_array(rows, represent), content_type='application/json')
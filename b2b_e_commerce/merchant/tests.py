@@ -1,3 +1,1263 @@
-from django.test import TestCase
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import F
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import discovery, jobs, orders, sales, seeding
+from .autocomplete import index as autocomplete_index
+from .authentication import MerchantRefreshToken, MerchantTokenUser, bump_token_version
+from .carts import get_or_create_cart, remove_cart_line, set_cart_line
+from .compiled import compile_serializer
+from .idempotency import purge_expired
+from .imports import import_products
+from .inventory import release, release_expired, reserve, set_stock_shards, sync_sharded_stock
+from .models import *
+from .renderers import ORJSONRenderer
+from .routers import PIN_COOKIE, PrimaryReplicaRouter, ReplicaRoutingMiddleware
+from .serializers import MyShopDetailSerializer, ProductSerializer, ShopSerializer
+
+
+class CompiledSerializerParityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Food')
+        for index, email in enumerate(['a@example.com', 'b@example.com']):
+            merchant = Merchant.objects.create_user(email=email, name=f'Merchant {index}', dob=date(1990, 1, 1), password='secret')
+            shop = Shop.objects.create(name=f'Shop {index}', merchant=merchant, category=category, address='-', description='-')
+            if index == 0:
+                merchant.active_shop = shop
+                merchant.save()
+            Product.objects.bulk_create(
+                [
+                    Product(title=f'Product {index}-{i}', price=Decimal('10.5') * i, quantity=i, shop=shop)
+                    for i in range(3)
+                ]
+            )
+
+    def assertParity(self, serializer_class, queryset):
+        queryset = queryset.order_by('id')
+        compiled = compile_serializer(serializer_class)
+        expected = JSONRenderer().render(serializer_class(queryset, many=True).data)
+        rendered = ORJSONRenderer().render(compiled.many(compiled.values(queryset)))
+        self.assertEqual(json.loads(rendered), json.loads(expected))
+
+    def test_product_serializer(self):
+        self.assertParity(ProductSerializer, Product.objects.all())
+
+    def test_shop_serializer(self):
+        self.assertParity(ShopSerializer, Shop.objects.all())
+
+    def test_shop_detail_serializer(self):
+        self.assertParity(MyShopDetailSerializer, Shop.objects.all())
+
+
+class KeysetPaginationTests(TestCase):
+    # A large block of rows sharing one created_at must still page exactly:
+    # every row once, in order, and then no next link.
+    rows = 1300
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Food')
+        cls.merchant = Merchant.objects.create_user(email='a@example.com', name='Owner', dob=date(1990, 1, 1), password='secret')
+        cls.shop = Shop.objects.create(name='Shop', merchant=cls.merchant, category=category, address='-', description='-')
+        Product.objects.bulk_create(
+            [Product(title=f'Product {i}', slug=f'product-{i}', price=1, quantity=1, shop=cls.shop) for i in range(cls.rows)]
+        )
+        Product.objects.update(created_at=timezone.now())
+        cls.expected = [str(uid) for uid in Product.objects.order_by('-id').values_list('uid', flat=True)]
+
+    def walk(self, client, url, **headers):
+        seen, pages = [], 0
+        while url:
+            response = client.get(url, **headers)
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.content)
+            seen += [row['uid'] for row in data['results']]
+            url, pages = data['next'], pages + 1
+        return seen, pages
+
+    def test_tied_timestamps(self):
+        client = APIClient()
+        client.force_authenticate(self.merchant)
+        seen, pages = self.walk(client, f'/b2b/{self.shop.slug}/my-products?page_size=100')
+        self.assertEqual((seen, pages), (self.expected, 13))
+
+        first = json.loads(client.get(f'/b2b/{self.shop.slug}/my-products?page_size=100').content)
+        second = json.loads(client.get(first['next']).content)
+        back = json.loads(client.get(second['previous']).content)
+        self.assertEqual([row['uid'] for row in back['results']], self.expected[:100])
+        self.assertIsNone(back['previous'])
+
+    def test_tied_timestamps_async(self):
+        token = MerchantRefreshToken.for_user(self.merchant).access_token
+        seen, pages = self.walk(Client(), f'/async/b2b/{self.shop.slug}/my-products?page_size=100',
+                                HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual((seen, pages), (self.expected, 13))
+
+    def test_invalid_cursor(self):
+        client = APIClient()
+        client.force_authenticate(self.merchant)
+        self.assertEqual(client.get(f'/b2b/{self.shop.slug}/my-products?cursor=bogus').status_code, 404)
+
+
+class QueryPlanTests(TestCase):
+    # Every query the hot views run must be answered from an index; a bare
+    # "SCAN <table>" in SQLite's plan means a full table scan.
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Food')
+        cls.merchant = Merchant.objects.create_user(email='a@example.com', name='Buyer', dob=date(1990, 1, 1), password='secret')
+        supplier = Merchant.objects.create_user(email='b@example.com', name='Supplier', dob=date(1990, 1, 1), password='secret')
+        cls.shop = Shop.objects.create(name='Buyer shop', merchant=cls.merchant, category=category, address='-', description='-')
+        cls.supplier_shop = Shop.objects.create(name='Supplier shop', merchant=supplier, category=category, address='-', description='-')
+        third = Shop.objects.create(name='Third shop', merchant=supplier, category=category, address='-', description='-')
+        cls.merchant.active_shop = cls.shop
+        cls.merchant.save()
+        ShopConnection.objects.create(sender_shop=cls.shop, receiver_shop=cls.supplier_shop, status='approved')
+        ShopConnection.objects.create(sender_shop=cls.supplier_shop, receiver_shop=cls.shop, status='approved')
+        ShopNeighbor.objects.connect(cls.shop, cls.supplier_shop)
+        cls.request = ShopConnection.objects.create(sender_shop=third, receiver_shop=cls.shop, status='pending')
+        cls.products = Product.objects.bulk_create(
+            [Product(title=f'Product {i}', price=Decimal('1.50'), quantity=10, shop=cls.supplier_shop) for i in range(5)]
+        )
+        Order.objects.create(user=cls.merchant, shop=cls.shop, delivery_address='-', total_price=1, payment_method=PaymentOption.CASH_ON_DELIVERY)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.merchant)
+
+    def table_scans(self, queries):
+        scans = []
+        with connection.cursor() as cursor:
+            for query in queries:
+                sql = query['sql']
+                if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                    continue
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                for row in cursor.fetchall():
+                    detail = row[-1]
+                    if detail.startswith('SCAN ') and ' USING ' not in detail and detail.split()[1].startswith('merchant_'):
+                        scans.append(f'{detail}: {sql}')
+        return scans
+
+    def assertIndexed(self, method, url, data=None):
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertLess(response.status_code, 400, response.content)
+        self.assertEqual(self.table_scans(ctx.captured_queries), [])
+
+    def test_list_views(self):
+        slug = self.shop.slug
+        for path in ['shops/my', f'{slug}/sent-request', f'{slug}/received-requests', f'{slug}/my-products',
+                     f'{slug}/same-category', f'{slug}/connected-shops', f'{slug}/buy-products', f'{slug}/order', f'{slug}/analytics', f'{slug}/discover']:
+            with self.subTest(path=path):
+                self.assertIndexed('get', f'/b2b/{path}')
+
+    def test_cart_and_order(self):
+        slug = self.shop.slug
+        items = [{'uid': str(product.uid), 'quantity': 2} for product in self.products]
+        self.assertIndexed('post', f'/b2b/{slug}/buy-products', {'items': items})
+        self.assertIndexed('post', f'/b2b/{slug}/buy-products', {'uid': items[0]['uid'], 'quantity': 3})
+        self.assertIndexed('get', f'/b2b/{slug}/cart')
+        self.assertIndexed('delete', f'/b2b/{slug}/cart', {'uid': items[0]['uid']})
+        self.assertIndexed('post', f'/b2b/{slug}/confirm-order', {'delivery_address': '-', 'payment_method': PaymentOption.CASH_ON_DELIVERY})
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(jobs.work(), (1, 1))
+        self.assertEqual(self.table_scans(ctx.captured_queries), [])
+
+    def test_connection_requests(self):
+        slug = self.shop.slug
+        self.assertIndexed('patch', f'/b2b/{slug}/received-requests/{self.request.uid}', {'status': 'approved'})
+
+
+class QueryCountTests(TestCase):
+    # List endpoints run a fixed number of queries however many rows (and
+    # related rows) a page holds.
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(title='Food')
+        cls.merchant = Merchant.objects.create_user(email='a@example.com', name='Buyer', dob=date(1990, 1, 1), password='secret')
+        cls.shop = Shop.objects.create(name='Buyer shop', merchant=cls.merchant, category=cls.category, address='-', description='-')
+        cls.merchant.active_shop = cls.shop
+        cls.merchant.save()
+        cls.grow(1)
+
+    @classmethod
+    def grow(cls, count):
+        # count more suppliers, each connected, with products, a pending
+        # request, an order and a cart line.
+        for _ in range(count):
+            n = Merchant.objects.count()
+            merchant = Merchant.objects.create_user(email=f'{n}@example.com', name=f'Supplier {n}', dob=date(1990, 1, 1), password='-')
+            category = Category.objects.create(title=f'Category {n}')
+            supplier = Shop.objects.create(name=f'Supplier {n}', merchant=merchant, category=cls.category, address='-', description='-')
+            requester = Shop.objects.create(name=f'Requester {n}', merchant=merchant, category=category, address='-', description='-')
+            ShopConnection.objects.create(sender_shop=cls.shop, receiver_shop=supplier, status='approved')
+            ShopConnection.objects.create(sender_shop=supplier, receiver_shop=cls.shop, status='approved')
+            ShopConnection.objects.create(sender_shop=requester, receiver_shop=cls.shop, status='pending')
+            ShopNeighbor.objects.connect(cls.shop, supplier)
+            products = Product.objects.bulk_create(
+                [Product(title=f'Product {n} {i}', price=1, quantity=10, shop=supplier) for i in range(3)]
+                + [Product(title=f'Own {n}', price=1, quantity=10, shop=cls.shop)]
+            )
+            order = Order.objects.create(user=cls.merchant, shop=cls.shop, delivery_address='-', total_price=1,
+                                         payment_method=PaymentOption.CASH_ON_DELIVERY)
+            OrderItem.objects.bulk_create(
+                [OrderItem(user=cls.merchant, shop=cls.shop, order=order, product=product, quantity=1, net_price=1) for product in products]
+            )
+            set_cart_line(get_or_create_cart(cls.shop, cls.merchant), products[0], 1)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.merchant)
+
+    def test_list_endpoints(self):
+        slug = self.shop.slug
+        paths = ['/b2b/merchants', '/b2b/categories', '/b2b/shops', '/b2b/shops/my', f'/b2b/{slug}/sent-request',
+                 f'/b2b/{slug}/received-requests', f'/b2b/{slug}/my-products', f'/b2b/{slug}/same-category',
+                 f'/b2b/{slug}/connected-shops', f'/b2b/{slug}/buy-products', f'/b2b/{slug}/cart', f'/b2b/{slug}/order']
+        counts = {}
+        for path in paths:
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(path).status_code, 200, path)
+            counts[path] = len(queries)
+
+        self.grow(4)
+        for path in paths:
+            with self.subTest(path=path), self.assertNumQueries(counts[path]):
+                self.assertEqual(self.client.get(path).status_code, 200)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def route(self, method, path, cookies=None, write=False, user_id=None, authenticated_as=None):
+        router = PrimaryReplicaRouter()
+
+        def view(request):
+            if authenticated_as is not None:
+                # What DRF does once the view has authenticated the request.
+                request.user = Merchant(pk=authenticated_as)
+            if write:
+                router.db_for_write(Product)
+            return HttpResponse(router.db_for_read(Product))
+
+        headers = {}
+        if user_id is not None:
+            token = AccessToken()
+            token['user_id'] = user_id
+            headers['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+        request = getattr(RequestFactory(), method)(path, **headers)
+        request.COOKIES.update(cookies or {})
+        response = ReplicaRoutingMiddleware(view)(request)
+        return response.content.decode(), PIN_COOKIE in response.cookies
+
+    def test_merchant_reads_use_a_replica(self):
+        self.assertEqual(self.route('get', '/b2b/shops'), ('replica', False))
+
+    def test_writes_stay_on_the_primary_and_pin_the_client(self):
+        self.assertEqual(self.route('post', '/b2b/shops/my', write=True), ('default', True))
+        self.assertEqual(self.route('get', '/b2b/shops/my', cookies={PIN_COOKIE: '1'}), ('default', False))
+
+    def test_writes_pin_token_clients_without_cookies(self):
+        self.assertEqual(self.route('post', '/b2b/shops/my', write=True, user_id=5), ('default', True))
+        self.assertEqual(self.route('get', '/b2b/shops/my', user_id=5), ('default', False))
+        self.assertEqual(self.route('get', '/b2b/shops/my', user_id=6), ('replica', False))
+        self.assertEqual(self.route('get', '/b2b/shops/my'), ('replica', False))
+
+        # The user the view authenticated is pinned, whatever token it used.
+        self.route('post', '/b2b/shops/my', write=True, authenticated_as=7)
+        self.assertEqual(self.route('get', '/b2b/shops/my', user_id=7), ('default', False))
+
+        cache.clear()
+        self.assertEqual(self.route('get', '/b2b/shops/my', user_id=5), ('replica', False))
+
+    def test_replicas_need_a_shared_cache(self):
+        env = {**os.environ, 'DATABASE_REPLICA_URLS': 'sqlite:///db.sqlite3'}
+        env.pop('CACHE_URL', None)
+        check = lambda env: subprocess.run([sys.executable, 'manage.py', 'check'], cwd=settings.BASE_DIR, env=env,
+                                           capture_output=True, text=True)
+        self.assertIn('needs a shared cache', check(env).stderr)
+        self.assertEqual(check({**env, 'CACHE_URL': 'file:///tmp/b2b-cache'}).returncode, 0)
+
+    def test_reads_after_a_write_in_the_same_request_use_the_primary(self):
+        self.assertEqual(self.route('get', '/b2b/shops', write=True), ('default', True))
+
+    def test_other_views_and_background_work_use_the_primary(self):
+        self.assertEqual(self.route('get', '/admin/login/'), ('default', False))
+        self.assertEqual(PrimaryReplicaRouter().db_for_read(Product), 'default')
+
+
+class InventoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Food')
+        cls.merchant = Merchant.objects.create_user(email='a@example.com', name='Buyer', dob=date(1990, 1, 1), password='secret')
+        cls.shop = Shop.objects.create(name='Buyer shop', merchant=cls.merchant, category=category, address='-', description='-')
+        supplier = Shop.objects.create(name='Supplier shop', merchant=cls.merchant, category=category, address='-', description='-')
+        ShopNeighbor.objects.connect(cls.shop, supplier)
+        cls.product = Product.objects.create(title='Tea', price=Decimal('2.00'), quantity=5, shop=supplier)
+
+    def stock(self):
+        return Product.objects.values_list('quantity', flat=True).get(pk=self.product.pk)
+
+    def test_cart_lines_reserve_and_release_stock(self):
+        cart = get_or_create_cart(self.shop, self.merchant)
+        self.assertEqual(set_cart_line(cart, self.product, 3), 'added')
+        self.assertEqual(self.stock(), 2)
+        self.assertEqual(set_cart_line(cart, self.product, 5), 'updated')
+        self.assertEqual(self.stock(), 0)
+        self.assertEqual(set_cart_line(cart, self.product, 6), 'out_of_stock')
+        self.assertEqual(CartItem.objects.get().quantity, 5)
+        self.assertTrue(remove_cart_line(cart, self.product))
+        self.assertEqual(self.stock(), 5)
+
+    def test_expired_reservations_reserve_again_at_checkout(self):
+        client = APIClient()
+        client.force_authenticate(self.merchant)
+        cart = get_or_create_cart(self.shop, self.merchant)
+        set_cart_line(cart, self.product, 3)
+        self.assertEqual(release_expired(now=timezone.now() + timedelta(days=1)), 1)
+        self.assertEqual(self.stock(), 5)
+
+        # Checkout itself always succeeds; the order job finds the stock
+        # missing, fails the order and gives the reserved units back.
+        Product.objects.filter(pk=self.product.pk).update(quantity=2)
+        payload = {'delivery_address': '-', 'payment_method': PaymentOption.CASH_ON_DELIVERY}
+        response = client.post(f'/b2b/{self.shop.slug}/confirm-order', payload, format='json')
+        self.assertEqual((response.status_code, response.data['status']), (201, OrderStatus.PENDING))
+        self.assertEqual(jobs.work(), (1, 1))
+        self.assertEqual(Order.objects.get().status, OrderStatus.FAILED)
+        self.assertEqual((self.stock(), CartItem.objects.count()), (2, 0))
+
+        set_cart_line(get_or_create_cart(self.shop, self.merchant), self.product, 2)
+        self.assertEqual(release_expired(now=timezone.now() + timedelta(days=1)), 1)
+        response = client.post(f'/b2b/{self.shop.slug}/confirm-order', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(jobs.work(), (1, 1))
+        self.assertEqual(Order.objects.latest('id').status, OrderStatus.CONFIRMED)
+        self.assertEqual((self.stock(), CartItem.objects.count(), OrderItem.objects.count()), (0, 0, 1))
+
+    def test_sharded_stock(self):
+        set_stock_shards(self.product.pk, 4)
+        self.assertEqual(sorted(ProductStockShard.objects.values_list('quantity', flat=True)), [1, 1, 1, 2])
+        # Callers that loaded the product before it was sharded still land
+        # on the shards, and a reservation may span several of them.
+        self.assertTrue(reserve(self.product.pk, 4, shards=0))
+        self.assertFalse(reserve(self.product.pk, 2, shards=4))
+        release(self.product.pk, 2, shards=4)
+        self.assertEqual(sync_sharded_stock(), 1)
+        self.assertEqual(self.stock(), 3)
+        self.assertEqual(set_stock_shards(self.product.pk, 0), 3)
+        self.assertFalse(ProductStockShard.objects.exists())
+        self.assertTrue(reserve(self.product.pk, 3, shards=4))
+        self.assertEqual(self.stock(), 0)
+
+
+class StockStressTests(TransactionTestCase):
+    # Many threads race for the same units; every successful reservation must
+    # be backed by stock and none may be lost or sold twice.
+    stock = 100
+    threads = 8
+    attempts = 40
+
+    def setUp(self):
+        category = Category.objects.create(title='Food')
+        merchant = Merchant.objects.create_user(email='a@example.com', name='Seller', dob=date(1990, 1, 1), password='secret')
+        shop = Shop.objects.create(name='Shop', merchant=merchant, category=category, address='-', description='-')
+        self.product = Product.objects.create(title='Hot tea', price=Decimal('2.00'), quantity=self.stock, shop=shop)
+
+    def hammer(self, quantity, shards):
+        successes = []
+
+        def worker():
+            taken = 0
+            try:
+                for _ in range(self.attempts):
+                    while True:
+                        try:
+                            taken += reserve(self.product.pk, quantity, shards)
+                            break
+                        except OperationalError:
+                            # SQLite refuses concurrent writers instead of
+                            # queueing them; try the same reservation again.
+                            time.sleep(0.001)
+            finally:
+                successes.append(taken)
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return sum(successes)
+
+    def test_no_oversell(self):
+        sold = self.hammer(1, 0)
+        self.assertEqual(sold, self.stock)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).quantity, 0)
+
+    def test_no_oversell_with_shards(self):
+        set_stock_shards(self.product.pk, 4)
+        sold = self.hammer(3, 4)
+        left = sum(ProductStockShard.objects.values_list('quantity', flat=True))
+        self.assertEqual(sold * 3 + left, self.stock)
+        self.assertLess(left, 3)
+
+    def test_expired_reservation_released_during_checkout(self):
+        # The sweeper and the order job race for the same expired line: the
+        # units are either re-reserved by the job or still held, never both
+        # returned to stock and sold.
+        merchant = self.product.shop.merchant
+        confirmed = 0
+        for _ in range(10):
+            cart = get_or_create_cart(self.product.shop, merchant)
+            set_cart_line(cart, self.product, 5)
+            CartItem.objects.filter(cart=cart).update(reserved_until=timezone.now() - timedelta(seconds=1))
+            order = Order.objects.create(user=merchant, shop=self.product.shop, delivery_address='-', total_price=10,
+                                         payment_method=PaymentOption.CASH_ON_DELIVERY)
+            Cart.objects.filter(pk=cart.pk).update(order=order)
+
+            def retrying(func, *args):
+                def run():
+                    try:
+                        while True:
+                            try:
+                                return func(*args)
+                            except OperationalError:
+                                time.sleep(0.001)
+                    finally:
+                        connection.close()
+                return run
+
+            workers = [threading.Thread(target=retrying(release_expired)),
+                       threading.Thread(target=retrying(orders.process_order, order.pk))]
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            order.refresh_from_db()
+            self.assertEqual(order.status, OrderStatus.CONFIRMED)
+            confirmed += 1
+            self.assertEqual(Product.objects.get(pk=self.product.pk).quantity, self.stock - 5 * confirmed)
+
+
+class MerchantActiveTests(TestCase):
+    def test_inactive_merchants_are_shut_out(self):
+        merchant = Merchant.objects.create_user(email='a@example.com', name='Owner', dob=date(1990, 1, 1), password='secret')
+        token = MerchantRefreshToken.for_user(merchant).access_token
+        client = APIClient()
+        login = {'email': 'a@example.com', 'password': 'secret'}
+        self.assertEqual(client.post('/b2b/login', login, format='json').status_code, 200)
+
+        Merchant.objects.filter(pk=merchant.pk).update(is_active=False)
+        self.assertEqual(client.post('/b2b/login', login, format='json').status_code, 401)
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(client.get('/b2b/shops/my').status_code, 401)
+
+
+@override_settings(MERCHANT_STATELESS_AUTH=True)
+class StatelessAuthTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.merchant = Merchant.objects.create_user(email='a@example.com', name='Owner', dob=date(1990, 1, 1), password='secret')
+        cls.category = Category.objects.create(title='Food')
+        cls.shop = Shop.objects.create(name='Mine', merchant=cls.merchant, category=cls.category, address='-', description='-')
+        cls.merchant.active_shop = cls.shop
+        cls.merchant.save()
+
+    def setUp(self):
+        cache.clear()
+        self.merchant.refresh_from_db()
+
+    def client_for(self, token):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return client
+
+    def test_stale_tokens_are_rejected(self):
+        token = MerchantRefreshToken.for_user(self.merchant).access_token
+        client = self.client_for(token)
+        response = client.get(f'/b2b/{self.shop.slug}/my-products')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.wsgi_request.user, MerchantTokenUser)
+        # The version is cached now: the Merchant row isn't loaded at all.
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(client.get(f'/b2b/{self.shop.slug}/my-products').status_code, 200)
+        self.assertFalse([query for query in queries if 'FROM "merchant_merchant"' in query['sql']])
+
+        bump_token_version(self.merchant.pk)
+        response = client.get(f'/b2b/{self.shop.slug}/my-products')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['code'], 'token_stale')
+        async_response = Client().get(f'/async/b2b/{self.shop.slug}/my-products', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(async_response.status_code, 401)
+
+    def test_bump_in_another_process(self):
+        old = self.client_for(MerchantRefreshToken.for_user(self.merchant).access_token)
+        self.assertEqual(old.get(f'/b2b/{self.shop.slug}/my-products').status_code, 200)
+        # Another process bumps the version; this process's cache still holds
+        # the old one.
+        Merchant.objects.filter(pk=self.merchant.pk).update(token_version=F('token_version') + 1)
+        self.merchant.refresh_from_db()
+        new = self.client_for(MerchantRefreshToken.for_user(self.merchant).access_token)
+        self.assertEqual(new.get(f'/b2b/{self.shop.slug}/my-products').status_code, 200)
+        self.assertEqual(old.get(f'/b2b/{self.shop.slug}/my-products').status_code, 401)
+        async_response = Client().get(f'/async/b2b/{self.shop.slug}/my-products',
+                                      HTTP_AUTHORIZATION=f'Bearer {MerchantRefreshToken.for_user(self.merchant).access_token}')
+        self.assertEqual(async_response.status_code, 200)
+
+    def test_new_shop_comes_with_fresh_tokens(self):
+        old = self.client_for(MerchantRefreshToken.for_user(self.merchant).access_token)
+        response = old.post('/b2b/shops/my', {
+            'name': 'Second', 'category_id': self.category.pk, 'address': '-', 'description': '-',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        slug = response.data['slug']
+
+        # The old token doesn't know the new shop and no longer passes the
+        # version check; the refreshed one does both.
+        self.assertEqual(old.get(f'/b2b/{slug}/my-products').status_code, 401)
+        new = self.client_for(response.data['tokens']['access_token'])
+        self.assertEqual(new.get(f'/b2b/{slug}/my-products').status_code, 200)
+        self.assertEqual(new.get(f'/b2b/{self.shop.slug}/my-products').status_code, 200)
+
+
+class ConditionalRequestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(title='Food')
+        cls.merchant = Merchant.objects.create_user(email='a@example.com', name='Owner', dob=date(1990, 1, 1), password='secret')
+        shop = lambda name: Shop.objects.create(name=name, merchant=cls.merchant, category=cls.category, address='-', description='-')
+        cls.shop, cls.supplier = shop('Mine'), shop('Supplier')
+        cls.merchant.active_shop = cls.shop
+        cls.merchant.save()
+        ShopNeighbor.objects.connect(cls.shop, cls.supplier)
+        cls.product = Product.objects.create(title='Tea', price=1, quantity=1, shop=cls.shop)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.merchant)
+        self.url = f'/b2b/{self.shop.slug}/my-products'
+
+    def later(self, model, **filters):
+        # Move updated_at clearly past the previous Last-Modified second.
+        model.objects.filter(**filters).update(updated_at=timezone.now() + timedelta(minutes=1))
+
+    def test_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Authorization', response['Vary'])
+        cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], response['ETag'])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        # Another page of the same collection has its own ETag.
+        self.assertEqual(self.client.get(self.url + '?page_size=1', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_writes_change_the_validators(self):
+        first = self.client.get(self.url)
+        self.later(Product, pk=self.product.pk)
+        second = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'], HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertNotEqual(second['Last-Modified'], first['Last-Modified'])
+
+        # A delete leaves the newest timestamp alone but changes the count.
+        Product.objects.create(title='Rice', price=1, quantity=1, shop=self.shop)
+        before = self.client.get(self.url)
+        Product.objects.filter(title='Rice').delete()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=before['ETag']).status_code, 200)
+
+    def test_related_rows_change_the_validators(self):
+        # last_modified_fields follow the chain to the rows each item renders.
+        connected = f'/b2b/{self.shop.slug}/connected-shops'
+        for url, model, filters in (
+            (self.url, Shop, {'pk': self.shop.pk}),
+            (self.url, Merchant, {'pk': self.merchant.pk}),
+            (self.url, Category, {'pk': self.category.pk}),
+            (connected, Merchant, {'pk': self.merchant.pk}),
+            (connected, Category, {'pk': self.category.pk}),
+        ):
+            etag = self.client.get(url)['ETag']
+            self.later(model, **filters)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200, (url, model))
+
+
+class AutocompleteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.food = Category.objects.create(title='Food')
+        Category.objects.create(title='Greens')
+        cls.merchant = Merchant.objects.create_user(email='a@example.com', name='Owner', dob=date(1990, 1, 1), password='secret')
+        cls.shops = {name: cls.shop(name) for name in ('Green Tea House', 'Greenfield', 'The Green Grocer', 'Evergreen', 'A', 'B', 'C')}
+        for name, neighbors in (('Greenfield', 'AB'), ('The Green Grocer', 'ABC')):
+            for neighbor in neighbors:
+                ShopNeighbor.objects.connect(cls.shops[name], cls.shops[neighbor])
+
+    @classmethod
+    def shop(cls, name):
+        return Shop.objects.create(name=name, merchant=cls.merchant, category=cls.food, address='-', description='-')
+
+    def setUp(self):
+        autocomplete_index.rebuild()
+        self.client = APIClient()
+        self.client.force_authenticate(self.merchant)
+
+    def names(self, q, limit=10):
+        response = self.client.get('/b2b/shops/autocomplete', {'q': q, 'limit': limit})
+        self.assertEqual(response.status_code, 200)
+        return [row['name'] for row in response.data['results']]
+
+    def test_ranking(self):
+        # Leading matches first, then by connections (shops) or shops
+        # (categories), then shorter names; word matches come last.
+        self.assertEqual(self.names('green'), ['Greenfield', 'Greens', 'Green Tea House', 'The Green Grocer'])
+        self.assertEqual(self.names('gre', limit=2), ['Greenfield', 'Greens'])
+        self.assertEqual(self.names('food'), ['Food'])
+
+    def test_index_changes_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            shop = self.shop('Greenhouse')
+        self.assertNotIn('Greenhouse', self.names('greenh'))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.names('greenh'), ['Greenhouse'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Shop.objects.get(pk=shop.pk).delete()
+        self.assertEqual(self.names('greenh'), [])
+
+        # A rolled back save never reaches the index.
+        try:
+            with transaction.atomic():
+                self.shop('Greenway')
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(self.names('greenw'), [])
+
+
+class CartTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Food')
+        cls.merchant = Merchant.objects.create_user(email='a@example.com', name='Buyer', dob=date(1990, 1, 1), password='secret')
+        cls.shop = Shop.objects.create(name='Buyer shop', merchant=cls.merchant, category=category, address='-', description='-')
+        supplier = Shop.objects.create(name='Supplier shop', merchant=cls.merchant, category=category, address='-', description='-')
+        cls.merchant.active_shop = cls.shop
+        cls.merchant.save()
+        ShopNeighbor.objects.connect(cls.shop, supplier)
+        cls.tea, cls.rice, cls.salt = [
+            Product.objects.create(title=title, price=Decimal(price), quantity=quantity, shop=supplier)
+            for title, price, quantity in (('Tea', '2.50', 50), ('Rice', '1.20', 50), ('Salt', '0.35', 2))
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.merchant)
+        self.url = f'/b2b/{self.shop.slug}/buy-products'
+
+    def assertTotalsMatchLines(self, count):
+        cart = Cart.objects.get(shop=self.shop, order=None)
+        lines = CartItem.objects.filter(cart=cart)
+        self.assertEqual(cart.item_count, lines.count())
+        self.assertEqual(cart.item_count, count)
+        self.assertEqual(cart.total_price, sum((line.net_price for line in lines), Decimal(0)))
+        self.assertEqual(self.client.get(f'/b2b/{self.shop.slug}/cart').data['total_price'], str(cart.total_price))
+
+    def add(self, product, quantity):
+        return self.client.post(self.url, {'uid': str(product.uid), 'quantity': quantity}, format='json')
+
+    def test_totals_follow_add_update_and_remove(self):
+        self.assertEqual(self.add(self.tea, 2).status_code, 200)
+        self.assertTotalsMatchLines(1)
+        self.add(self.rice, 3)
+        self.assertTotalsMatchLines(2)
+        self.add(self.tea, 5)
+        self.assertTotalsMatchLines(2)
+        self.add(self.tea, 1)
+        self.assertTotalsMatchLines(2)
+        # A line that can't be reserved leaves the cart as it was.
+        self.assertEqual(self.add(self.salt, 3).status_code, 400)
+        self.assertTotalsMatchLines(2)
+        response = self.client.delete(f'/b2b/{self.shop.slug}/cart', {'uid': str(self.tea.uid)}, format='json')
+        self.assertLess(response.status_code, 400)
+        self.assertTotalsMatchLines(1)
+        self.assertEqual(Cart.objects.get(shop=self.shop, order=None).total_price, Decimal('3.60'))
+
+    def test_batch_upsert(self):
+        self.add(self.tea, 2)
+        missing = '00000000-0000-0000-0000-000000000000'
+        response = self.client.post(self.url, {'items': [
+            {'uid': str(self.tea.uid), 'quantity': 4},
+            {'uid': str(self.rice.uid), 'quantity': 1},
+            {'uid': str(self.rice.uid), 'quantity': 6},
+            {'uid': str(self.salt.uid), 'quantity': 3},
+            {'uid': missing, 'quantity': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(line['uid'], line['quantity'], line['status']) for line in response.data['items']],
+            [(str(self.tea.uid), 4, 'updated'), (str(self.rice.uid), 6, 'added'),
+             (str(self.salt.uid), 3, 'out_of_stock'), (missing, 1, 'unavailable')],
+        )
+        # The same product twice is one line holding the last quantity.
+        lines = dict(CartItem.objects.filter(cart__shop=self.shop).values_list('product__title', 'quantity'))
+        self.assertEqual(lines, {'Tea': 4, 'Rice': 6})
+        self.assertEqual(Product.objects.get(pk=self.rice.pk).quantity, 44)
+        self.assertTotalsMatchLines(2)
+
+
+class ConnectionResponseTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Food')
+        cls.merchant = Merchant.objects.create_user(email='a@example.com', name='Owner', dob=date(1990, 1, 1), password='secret')
+        other = Merchant.objects.create_user(email='b@example.com', name='Other', dob=date(1990, 1, 1), password='secret')
+        cls.shop = Shop.objects.create(name='Mine', merchant=cls.merchant, category=category, address='-', description='-')
+        cls.sender = Shop.objects.create(name='Sender', merchant=other, category=category, address='-', description='-')
+        cls.merchant.active_shop = cls.shop
+        cls.merchant.save()
+        cls.request = ShopConnection.objects.create(sender_shop=cls.sender, receiver_shop=cls.shop, status='pending')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.merchant)
+        self.url = f'/b2b/{self.shop.slug}/received-requests/{self.request.uid}'
+
+    def connected(self):
+        return [row['name'] for row in self.client.get(f'/b2b/{self.shop.slug}/connected-shops').data['results']]
+
+    def test_approve_then_decline(self):
+        self.assertEqual(self.client.patch(self.url, {'status': 'approved'}, format='json').status_code, 200)
+        self.assertEqual(self.connected(), ['Sender'])
+        self.assertTrue(ShopConnection.objects.filter(sender_shop=self.shop, receiver_shop=self.sender, status='approved').exists())
+
+        self.assertEqual(self.client.patch(self.url, {'status': 'declined'}, format='json').status_code, 200)
+        self.assertEqual(self.connected(), [])
+        self.assertFalse(ShopNeighbor.objects.exists())
+        self.assertFalse(ShopConnection.objects.exists())
+
+    def test_declined_shop_can_ask_again(self):
+        response = self.client.patch(self.url, {'status': 'declined'}, format='json')
+        self.assertEqual((response.status_code, response.data['status']), (200, 'declined'))
+        self.assertFalse(ShopConnection.objects.exists())
+
+        sender = APIClient()
+        sender.force_authenticate(self.sender.merchant)
+        Merchant.objects.filter(pk=self.sender.merchant_id).update(active_shop=self.sender)
+        response = sender.post(f'/b2b/{self.sender.slug}/sent-request', {'receiver_shop_id': self.shop.pk}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(list(ShopConnection.objects.values_list('sender_shop', 'status')), [(self.sender.pk, 'pending')])
+
+    def test_decline_keeps_own_pending_request(self):
+        # Declining a request doesn't withdraw the receiver's own request.
+        ShopConnection.objects.create(sender_shop=self.shop, receiver_shop=self.sender, status='pending')
+        self.assertEqual(self.client.patch(self.url, {'status': 'declined'}, format='json').status_code, 200)
+        self.assertTrue(ShopConnection.objects.filter(sender_shop=self.shop, status='pending').exists())
+
+
+class SeedingTests(TestCase):
+    def plan(self, seed=0):
+        return seeding.SeedPlan(
+            seed=seed, merchants=3, categories=2, shops_per_category=3, connections_per_shop=1, products_per_shop=4,
+            carts=0, cart_size=0, orders_per_shop=0, order_size=0, password_hash='-', created_at=timezone.now(),
+            first_ids=seeding.first_ids(),
+        )
+
+    def test_second_run_adds_rows(self):
+        for _ in range(2):
+            plan = self.plan()
+            seeding.seed_catalog(plan)
+            seeding.seed_products(plan, 0, plan.shops)
+            seeding.finish()
+        self.assertEqual((Shop.objects.count(), Product.objects.count()), (12, 48))
+        self.assertEqual(Product.objects.values('uid').distinct().count(), 48)
+        # Primary keys carry on after the explicit ids.
+        self.assertEqual(Category.objects.create(title='Next').pk, 5)
+
+
+class StreamingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Food')
+        cls.merchant = Merchant.objects.create_user(email='a@example.com', name='Buyer', dob=date(1990, 1, 1), password='secret')
+        cls.shop = Shop.objects.create(name='Buyer shop', merchant=cls.merchant, category=category, address='-', description='-')
+        supplier = Shop.objects.create(name='Supplier shop', merchant=cls.merchant, category=category, address='-', description='-')
+        cls.merchant.active_shop = cls.shop
+        cls.merchant.save()
+        ShopNeighbor.objects.connect(cls.shop, supplier)
+        products = Product.objects.bulk_create(
+            [Product(title=f'Product {i}', price=Decimal('1.50'), quantity=10, shop=supplier) for i in range(400)]
+        )
+        orders = Order.objects.bulk_create([
+            Order(user=cls.merchant, shop=cls.shop, delivery_address='-', total_price=3, payment_method=PaymentOption.CASH_ON_DELIVERY)
+            for _ in range(600)
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(user=cls.merchant, shop=cls.shop, order=order, product=products[(i + j) % len(products)], quantity=1, net_price=1)
+            for i, order in enumerate(orders) for j in range(2)
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.merchant)
+
+    def assertStreamsPages(self, path):
+        response = self.client.get(f'{path}?stream=true')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response, StreamingHttpResponse)
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 1)
+        streamed = json.loads(b''.join(chunks))
+
+        paged, url = [], f'{path}?page_size=100'
+        while url:
+            page = json.loads(self.client.get(url).content)
+            paged += page['results']
+            url = page['next']
+        self.assertEqual(streamed, paged)
+        return streamed
+
+    def test_compiled_view(self):
+        self.assertEqual(len(self.assertStreamsPages(f'/b2b/{self.shop.slug}/buy-products')), 400)
+
+    def test_prefetching_view(self):
+        orders = self.assertStreamsPages(f'/b2b/{self.shop.slug}/order')
+        self.assertEqual(len(orders), 600)
+        self.assertTrue(all(len(order['items']) == 2 for order in orders), orders[0])
+
+
+class ProductImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.merchant = Merchant.objects.create_user(email='a@example.com', name='Owner', dob=date(1990, 1, 1), password='secret')
+        cls.shop = Shop.objects.create(name='Mine', merchant=cls.merchant, category=Category.objects.create(title='Food'),
+                                       address='-', description='-')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.merchant)
+
+    def upload(self, name, content):
+        return self.client.post(f'/b2b/{self.shop.slug}/my-products/import', {'file': SimpleUploadedFile(name, content)})
+
+    def test_valid_file(self):
+        response = self.upload('catalog.csv', b'title,price,quantity\nGreen tea,2.50,10\nBlack tea,3.00,0\n')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {'created': 2, 'failed': 0, 'errors': []})
+        self.assertEqual(
+            list(Product.objects.filter(shop=self.shop).order_by('pk').values_list('title', 'price', 'quantity', 'slug')),
+            [('Green tea', Decimal('2.50'), 10, 'green-tea'), ('Black tea', Decimal('3.00'), 0, 'black-tea')],
+        )
+
+    def test_bad_rows(self):
+        response = self.upload('catalog.jsonl', b'\n'.join([
+            b'{"title": "Tea", "price": "1.00", "quantity": 5}',
+            b'{"title": "Rice", "price": "1.00", "quantity": -1}',
+            b'not json',
+            b'{"price": "1.00", "quantity": 1}',
+        ]))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['created'], response.data['failed']), (1, 3))
+        self.assertEqual([error['row'] for error in response.data['errors']], [2, 3, 4])
+        self.assertIn('quantity', response.data['errors'][0]['errors'])
+
+        response = self.upload('catalog.csv', b'title,price,quantity\nRice,1.00,-1\n')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Product.objects.count(), 1)
+
+    def test_rejected_chunk_keeps_earlier_chunks(self):
+        bulk_create = Product.objects.bulk_create
+        calls = []
+
+        def flaky(objs, *args, **kwargs):
+            calls.append(len(objs))
+            if len(calls) == 2:
+                raise IntegrityError('rejected')
+            return bulk_create(objs, *args, **kwargs)
+
+        rows = [{'title': f'Product {i}', 'price': '1.00', 'quantity': 1} for i in range(5)]
+        with mock.patch.object(Product.objects, 'bulk_create', side_effect=flaky):
+            report = import_products(self.shop, rows, chunk_size=2)
+        self.assertEqual(calls, [2, 2, 1])
+        self.assertEqual((report['created'], report['failed']), (3, 2))
+        self.assertEqual([error['row'] for error in report['errors']], [3, 4])
+        self.assertEqual(
+            list(Product.objects.order_by('pk').values_list('title', flat=True)), ['Product 0', 'Product 1', 'Product 4'],
+        )
+
+
+class ProductSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.food = Category.objects.create(title='Groceries')
+        cls.merchant = Merchant.objects.create_user(email='a@example.com', name='Owner', dob=date(1990, 1, 1), password='secret')
+        shop = lambda name: Shop.objects.create(name=name, merchant=cls.merchant, category=cls.food, address='-', description='-')
+        cls.buyer, cls.supplier, cls.stranger = shop('Buyer'), shop('Green Valley'), shop('Stranger')
+        cls.merchant.active_shop = cls.buyer
+        cls.merchant.save()
+        ShopNeighbor.objects.connect(cls.buyer, cls.supplier)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.merchant)
+
+    def search(self, q, shop=None):
+        response = self.client.get(f'/b2b/{(shop or self.buyer).slug}/search', {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [row['title'] for row in response.data['results']]
+
+    def test_index_follows_writes(self):
+        product = Product.objects.create(title='Jasmine rice', price=1, quantity=1, shop=self.supplier)
+        Product.objects.bulk_create([Product(title='Basmati rice', price=1, quantity=1, shop=self.supplier)])
+        self.assertCountEqual(self.search('ric'), ['Jasmine rice', 'Basmati rice'])
+
+        Product.objects.filter(pk=product.pk).update(title='Sencha tea')
+        self.assertEqual(self.search('rice'), ['Basmati rice'])
+        self.assertEqual(self.search('sencha'), ['Sencha tea'])
+
+        # Shop and category renames reach the indexed products.
+        Shop.objects.filter(pk=self.supplier.pk).update(name='Blue Hills')
+        self.assertEqual(self.search('valley'), [])
+        self.assertEqual(len(self.search('blue hills')), 2)
+        Category.objects.filter(pk=self.food.pk).update(title='Pantry')
+        self.assertEqual(len(self.search('pantry')), 2)
+
+        # Title matches rank above shop and category matches.
+        Product.objects.create(title='Pantry shelf', price=1, quantity=1, shop=self.supplier)
+        self.assertEqual(self.search('pantry')[0], 'Pantry shelf')
+
+        Product.objects.filter(pk=product.pk).delete()
+        self.assertEqual(self.search('sencha'), [])
+
+    def test_search_is_scoped_to_connected_shops(self):
+        Product.objects.create(title='Oolong tea', price=1, quantity=1, shop=self.supplier)
+        Product.objects.create(title='Earl grey tea', price=1, quantity=1, shop=self.stranger)
+        self.assertEqual(self.search('tea'), ['Oolong tea'])
+        self.merchant.active_shop = self.stranger
+        self.merchant.save()
+        self.assertEqual(self.search('tea', self.stranger), [])
+
+
+class IdempotencyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Food')
+        cls.merchant = Merchant.objects.create_user(email='a@example.com', name='Buyer', dob=date(1990, 1, 1), password='secret')
+        cls.shop = Shop.objects.create(name='Buyer shop', merchant=cls.merchant, category=category, address='-', description='-')
+        supplier = Shop.objects.create(name='Supplier shop', merchant=cls.merchant, category=category, address='-', description='-')
+        ShopNeighbor.objects.connect(cls.shop, supplier)
+        cls.product = Product.objects.create(title='Tea', price=Decimal('2.00'), quantity=50, shop=supplier)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.merchant)
+        self.order_url = f'/b2b/{self.shop.slug}/confirm-order'
+        self.order = {'delivery_address': '-', 'payment_method': PaymentOption.CASH_ON_DELIVERY}
+
+    def post(self, url, data, key):
+        return self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retried_order_is_replayed(self):
+        set_cart_line(get_or_create_cart(self.shop, self.merchant), self.product, 2)
+        first = self.post(self.order_url, self.order, 'order-1')
+        self.assertEqual(first.status_code, 201)
+
+        set_cart_line(get_or_create_cart(self.shop, self.merchant), self.product, 2)
+        retry = self.post(self.order_url, self.order, 'order-1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(json.loads(retry.content), first.data)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_failed_request_can_be_retried(self):
+        self.assertEqual(self.post(self.order_url, self.order, 'order-2').status_code, 400)
+        set_cart_line(get_or_create_cart(self.shop, self.merchant), self.product, 1)
+        self.assertEqual(self.post(self.order_url, self.order, 'order-2').status_code, 201)
+
+    def test_key_reuse_and_concurrent_use_are_rejected(self):
+        url = f'/b2b/{self.shop.slug}/buy-products'
+        self.assertEqual(self.post(url, {'uid': str(self.product.uid), 'quantity': 1}, 'add').status_code, 200)
+        self.assertEqual(self.post(url, {'uid': str(self.product.uid), 'quantity': 3}, 'add').status_code, 422)
+
+        IdempotencyKey.objects.create(user=self.merchant, key='busy', fingerprint='-', locked_until=timezone.now() + timedelta(minutes=1),
+                                      expires_at=timezone.now() + timedelta(hours=1))
+        self.assertEqual(self.post(url, {'uid': str(self.product.uid), 'quantity': 1}, 'busy').status_code, 409)
+
+    def test_abandoned_key_is_taken_over(self):
+        url = f'/b2b/{self.shop.slug}/buy-products'
+        data = {'uid': str(self.product.uid), 'quantity': 1}
+        self.assertEqual(self.post(url, data, 'crashed').status_code, 200)
+        # As if the request had died after claiming the key.
+        abandon = lambda **lease: IdempotencyKey.objects.filter(key='crashed').update(status_code=None, content=None, **lease)
+        abandon(locked_until=timezone.now() + timedelta(minutes=1))
+        self.assertEqual(self.post(url, data, 'crashed').status_code, 409)
+
+        abandon(locked_until=timezone.now() - timedelta(seconds=1))
+        response = self.post(url, data, 'crashed')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Idempotent-Replayed', response)
+        record = IdempotencyKey.objects.get(key='crashed')
+        self.assertEqual((record.status_code, record.locked_until), (200, None))
+        self.assertEqual(self.post(url, data, 'crashed')['Idempotent-Replayed'], 'true')
+
+        # Taking over an abandoned key still requires the same request.
+        abandon(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.post(url, {**data, 'quantity': 3}, 'crashed').status_code, 422)
+
+    def test_expired_keys(self):
+        IdempotencyKey.objects.create(user=self.merchant, key='old', fingerprint='-', status_code=201, content=b'{}',
+                                      expires_at=timezone.now() - timedelta(seconds=1))
+        url = f'/b2b/{self.shop.slug}/buy-products'
+        response = self.post(url, {'uid': str(self.product.uid), 'quantity': 1}, 'old')
+        self.assertNotIn('Idempotent-Replayed', response)
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(purge_expired(), 1)
+
+
+def failing_job(**payload):
+    raise RuntimeError('boom')
+
+
+class JobQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Food')
+        cls.merchant = Merchant.objects.create_user(email='a@example.com', name='Buyer', dob=date(1990, 1, 1), password='secret')
+        cls.shop = Shop.objects.create(name='Buyer shop', merchant=cls.merchant, category=category, address='-', description='-')
+        cls.suppliers = [
+            Shop.objects.create(name=f'Supplier {n}', merchant=cls.merchant, category=category, address='-', description='-')
+            for n in range(2)
+        ]
+        cls.products = Product.objects.bulk_create(
+            [Product(title=f'Product {i}', price=Decimal('2.00'), quantity=50, shop=cls.suppliers[i % 2]) for i in range(10)]
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.merchant)
+
+    def checkout(self, size):
+        cart = get_or_create_cart(self.shop, self.merchant)
+        for product in self.products[:size]:
+            set_cart_line(cart, product, 1)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(f'/b2b/{self.shop.slug}/confirm-order',
+                                        {'delivery_address': '-', 'payment_method': PaymentOption.CASH_ON_DELIVERY}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return len(ctx.captured_queries)
+
+    def test_checkout_queues_the_order(self):
+        self.assertEqual(self.checkout(1), self.checkout(10))
+        self.assertEqual(Job.objects.count(), 2)
+        self.assertFalse(OrderItem.objects.exists())
+        # The next cart can be filled while the orders wait for the worker.
+        self.checkout(3)
+
+        self.assertEqual(jobs.work(batch_size=10), (3, 3))
+        self.assertEqual(list(Order.objects.values_list('status', flat=True).distinct()), [OrderStatus.CONFIRMED])
+        self.assertEqual(OrderItem.objects.count(), 14)
+        self.assertFalse(Cart.objects.exists())
+        order = Order.objects.order_by('id')[1]
+        self.assertEqual(order.total_price, Decimal('20.00'))
+        self.assertEqual(
+            sorted(order.supplier_notifications.values_list('item_count', 'total_price')),
+            [(5, Decimal('10.00')), (5, Decimal('10.00'))],
+        )
+        # A job that runs again after its order was processed is a no-op.
+        orders.process_order(order.pk)
+        self.assertEqual(OrderItem.objects.count(), 14)
+
+    @override_settings(JOBS_EAGER=True)
+    def test_eager_jobs_run_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.checkout(2)
+        self.assertEqual(Order.objects.get().status, OrderStatus.CONFIRMED)
+        self.assertFalse(Job.objects.exists())
+
+    def test_failed_jobs_back_off_and_give_up(self):
+        job = jobs.enqueue('merchant.tests.failing_job', {}, max_attempts=2)
+        self.assertEqual(jobs.work(), (1, 0))
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn('boom', job.last_error)
+        self.assertEqual(jobs.work(), (0, 0))
+
+        Job.objects.update(run_after=timezone.now())
+        self.assertEqual(jobs.work(), (1, 0))
+        job.refresh_from_db()
+        self.assertIsNotNone(job.failed_at)
+        Job.objects.update(run_after=timezone.now())
+        self.assertEqual(jobs.work(), (0, 0))
+
+    def test_visibility_timeout(self):
+        jobs.enqueue('merchant.inventory.sync_sharded_stock', {})
+        [claimed] = jobs.claim(10, visibility_timeout=60)
+        self.assertEqual(jobs.claim(10), [])
+
+        # The worker holding it died; once the timeout passes another one
+        # takes over, and the first can no longer touch the job.
+        Job.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        [retaken] = jobs.claim(10)
+        self.assertEqual(retaken.attempts, 2)
+        self.assertEqual(jobs.run_claimed([claimed]), 0)
+        self.assertTrue(Job.objects.exists())
+        self.assertEqual(jobs.run_claimed([retaken]), 1)
+        self.assertFalse(Job.objects.exists())
+
+
+class SalesAnalyticsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Food')
+        cls.supplier = Merchant.objects.create_user(email='s@example.com', name='Supplier', dob=date(1990, 1, 1), password='secret')
+        cls.supplier_shop = Shop.objects.create(name='Supplier shop', merchant=cls.supplier, category=category, address='-', description='-')
+        cls.buyers = []
+        for n in range(2):
+            merchant = Merchant.objects.create_user(email=f'b{n}@example.com', name=f'Buyer {n}', dob=date(1990, 1, 1), password='secret')
+            shop = Shop.objects.create(name=f'Buyer {n}', merchant=merchant, category=category, address='-', description='-')
+            ShopNeighbor.objects.connect(shop, cls.supplier_shop)
+            cls.buyers.append(shop)
+        cls.tea, cls.rice = Product.objects.bulk_create([
+            Product(title='Tea', price=Decimal('2.00'), quantity=100, shop=cls.supplier_shop),
+            Product(title='Rice', price=Decimal('5.00'), quantity=100, shop=cls.supplier_shop),
+        ])
+
+    def order(self, buyer, lines):
+        cart = get_or_create_cart(buyer, buyer.merchant)
+        for product, quantity in lines:
+            set_cart_line(cart, product, quantity)
+        client = APIClient()
+        client.force_authenticate(buyer.merchant)
+        response = client.post(f'/b2b/{buyer.slug}/confirm-order',
+                               {'delivery_address': '-', 'payment_method': PaymentOption.CASH_ON_DELIVERY}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def analytics(self, **params):
+        client = APIClient()
+        client.force_authenticate(self.supplier)
+        response = client.get(f'/b2b/{self.supplier_shop.slug}/analytics', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def test_rollups_follow_processed_orders(self):
+        self.order(self.buyers[0], [(self.tea, 3), (self.rice, 1)])
+        self.order(self.buyers[1], [(self.tea, 1)])
+        self.order(self.buyers[0], [(self.rice, 2)])
+        self.assertEqual(self.analytics()['orders'], 0)
+        jobs.work()
+
+        data = self.analytics()
+        self.assertEqual((data['orders'], data['quantity'], data['revenue']), (3, 7, Decimal('23.00')))
+        self.assertEqual([(row['day'], row['revenue']) for row in data['days']], [(timezone.localdate(), Decimal('23.00'))])
+        self.assertEqual([(row['title'], row['quantity']) for row in data['top_products']], [('Rice', 3), ('Tea', 4)])
+        self.assertEqual([(row['name'], row['orders']) for row in data['top_buyers']], [('Buyer 0', 2), ('Buyer 1', 1)])
+        self.assertEqual(len(self.analytics(limit=1)['top_products']), 1)
+        yesterday = timezone.localdate() - timedelta(days=1)
+        self.assertEqual(self.analytics(start=yesterday, end=yesterday)['days'], [])
+
+        # Rebuilding from the order lines gives the same rollups.
+        rows = lambda: (sorted(DailyProductSales.objects.values_list('day', 'product_id', 'quantity', 'revenue')),
+                        sorted(DailyBuyerSales.objects.values_list('day', 'buyer_id', 'orders', 'quantity', 'revenue')))
+        before = rows()
+        self.assertEqual(sales.rebuild(), (2, 2))
+        self.assertEqual(rows(), before)
+
+    def test_invalid_range(self):
+        client = APIClient()
+        client.force_authenticate(self.supplier)
+        url = f'/b2b/{self.supplier_shop.slug}/analytics'
+        self.assertEqual(client.get(url, {'start': '2024-02-01', 'end': '2024-01-01'}).status_code, 400)
+        self.assertEqual(client.get(url, {'start': '2022-01-01', 'end': '2024-01-01'}).status_code, 400)
+
+
+class DiscoveryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        food, tools = Category.objects.create(title='Food'), Category.objects.create(title='Tools')
+        cls.merchant = Merchant.objects.create_user(email='a@example.com', name='Owner', dob=date(1990, 1, 1), password='secret')
+        other = Merchant.objects.create_user(email='b@example.com', name='Other', dob=date(1990, 1, 1), password='secret')
+        shop = lambda name, category=food: Shop.objects.create(name=name, merchant=other, category=category, address='-', description='-')
+        cls.shop = Shop.objects.create(name='Mine', merchant=cls.merchant, category=food, address='-', description='-')
+        cls.merchant.active_shop = cls.shop
+        cls.merchant.save()
+        cls.friend, cls.requested, cls.mutual, cls.busy, cls.quiet = (
+            shop('Friend'), shop('Requested'), shop('Mutual'), shop('Busy'), shop('Quiet')
+        )
+        shop('Elsewhere', tools)
+        for a, b in ((cls.shop, cls.friend), (cls.friend, cls.mutual)):
+            ShopConnection.objects.create(sender_shop=a, receiver_shop=b, status='approved')
+            ShopConnection.objects.create(sender_shop=b, receiver_shop=a, status='approved')
+            ShopNeighbor.objects.connect(a, b)
+        ShopConnection.objects.create(sender_shop=cls.requested, receiver_shop=cls.shop, status='pending')
+        Product.objects.bulk_create([Product(title=f'Product {i}', price=1, quantity=1, shop=cls.busy) for i in range(20)])
+        Shop.objects.filter(pk=cls.quiet.pk).update(updated_at=timezone.now() - timedelta(days=90))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.merchant)
+        self.url = f'/b2b/{self.shop.slug}/discover'
+
+    def names(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return [row['name'] for row in response.data['results']]
+
+    def test_ranking_and_exclusions(self):
+        # Nothing ranked yet: the list is empty and reading it writes nothing.
+        self.assertEqual(self.names(), [])
+        self.assertFalse(ShopCandidate.objects.exists())
+        self.assertFalse(Job.objects.exists())
+
+        discovery.refresh_category(self.shop.category_id, [self.shop.pk])
+        self.assertEqual(self.names(), ['Busy', 'Mutual', 'Quiet'])
+        row = ShopCandidate.objects.get(shop=self.shop, candidate=self.mutual)
+        self.assertEqual((row.mutual_connections, row.product_count), (1, 0))
+        self.assertEqual(ShopCandidate.objects.get(shop=self.shop, candidate=self.busy).product_count, 20)
+
+        # A request sent after the refresh hides the shop right away.
+        ShopConnection.objects.create(sender_shop=self.shop, receiver_shop=self.busy, status='pending')
+        self.assertEqual(self.names(), ['Mutual', 'Quiet'])
+
+    def test_new_shop_is_ranked_by_a_job(self):
+        response = self.client.post('/b2b/shops/my', {
+            'name': 'Newcomer', 'category_id': self.shop.category_id, 'address': '-', 'description': '-',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        shop = Shop.objects.get(name='Newcomer')
+        self.assertFalse(ShopCandidate.objects.filter(shop=shop).exists())
+        self.assertEqual(jobs.work(), (1, 1))
+        self.assertCountEqual(
+            ShopCandidate.objects.filter(shop=shop).values_list('candidate__name', flat=True),
+            ['Busy', 'Friend', 'Mine', 'Mutual', 'Requested', 'Quiet'],
+        )
+
+    def test_refresh_keeps_the_best_candidates(self):
+        self.assertEqual(discovery.refresh(limit=1), 6)
+        self.assertEqual(list(ShopCandidate.objects.filter(shop=self.shop).values_list('candidate__name', flat=True)), ['Busy'])
+        self.assertFalse(ShopCandidate.objects.filter(candidate__category__title='Tools').exists())
@@ -1,6 +1,18 @@
 from django.shortcuts import render,get_object_or_404
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 from .models import *
 from .permissions import IsMerchantShop
+from .pagination import ListAPIView, RankedPagination
+from .resolvers import get_request_shop
+from .imports import IMPORT_TYPES, guess_import_type, import_products, iter_rows
+from .search import search_products
+from .sales import shop_analytics
+from .autocomplete import index as autocomplete_index
+from . import jobs
+from .idempotency import idempotent
+from .carts import get_or_create_cart, set_cart_line, set_cart_lines, remove_cart_line
+from .authentication import MerchantRefreshToken, bump_token_version
 from rest_framework.exceptions import ValidationError
 from .serializers import *
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
@@ -8,15 +20,14 @@ from drf_spectacular.utils import extend_schema
 from rest_framework.views import APIView
 from rest_framework import status
 from rest_framework.response import Response
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework.parsers import MultiPartParser
 
-class MerchantViews(APIView):
+class MerchantViews(ListAPIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         all_merchants = Merchant.objects.all()
-        serializer = MerchantSerializer(all_merchants, many=True)
-        return Response(serializer.data)
+        return self.list_response(all_merchants, MerchantSerializer)
 
 class Signup(APIView):
     @extend_schema(
@@ -50,7 +61,7 @@ class LoginView(APIView):
             user = authenticate( username=email, password=password)
 
             if user:
-                refresh = RefreshToken.for_user(user)
+                refresh = MerchantRefreshToken.for_user(user)
 
                 response_data = {
                     'uid': user.uid,
@@ -70,12 +81,11 @@ class LoginView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class CategoryListView(APIView):
+class CategoryListView(ListAPIView):
     permission_classes = [IsAuthenticated]
     def get(self, request):
         categories = Category.objects.all()
-        serializer = CategorySerializer(categories, many=True)
-        return Response(serializer.data)
+        return self.list_response(categories, CategorySerializer)
 class CategoryCreateView(APIView):
     permission_classes = [IsAdminUser]
     @extend_schema(
@@ -83,6 +93,7 @@ class CategoryCreateView(APIView):
         responses={201: CategorySerializer}, # Serializer used for the response body
     )
 
+    @idempotent
     def post(self, request):
         serializer = CategorySerializer(data=request.data)
         if serializer.is_valid():
@@ -90,56 +101,81 @@ class CategoryCreateView(APIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class ShopSerializerView(APIView):
+class ShopSerializerView(ListAPIView):
     permission_classes = [IsAuthenticated]
+    compiled_serializers = True
     def get(self, request):
         all_shops = Shop.objects.all()
-        serializer = ShopSerializer(all_shops, many=True)
-        return Response(serializer.data)
+        return self.list_response(all_shops, ShopSerializer)
 
 
-class MyShopSerializerView(APIView):
+class ShopAutocompleteView(APIView):
     permission_classes = [IsAuthenticated]
+
+    @extend_schema(parameters=[AutocompleteQuerySerializer], responses={200: AutocompleteResultSerializer(many=True)})
     def get(self, request):
-        merchant = request.user
-        my_shops = Shop.objects.filter(merchant=merchant)
-        serializer = ShopSerializer(my_shops, many=True)
-        return Response(serializer.data)
+        params = AutocompleteQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        matches = autocomplete_index.search(params.validated_data['q'], params.validated_data['limit'])
+        return Response({'results': AutocompleteResultSerializer(matches, many=True).data})
+
+
+class MyShopSerializerView(ListAPIView):
+    permission_classes = [IsAuthenticated]
+    compiled_serializers = True
+    def get(self, request):
+        my_shops = Shop.objects.filter(merchant_id=request.user.pk)
+        return self.list_response(my_shops, ShopSerializer)
 
     @extend_schema(
         request=ShopSerializer,
         responses={201: ShopSerializer},
     )
 
+    @idempotent
     def post(self, request):
-        merchant = request.user
-        my_shops = Shop.objects.filter(merchant=merchant)
-        my_shops.update(active=False)   # Deactivating all the merchant's shops
-
         serializer = ShopSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
             shop = serializer.save()
-            shop.active = True  # Activating the newly created shop
-            shop.save()
-
-            return Response(serializer.data, status.HTTP_201_CREATED)
+            # Activating the newly created shop; the new shop also invalidates
+            # tokens issued with the old shop list.
+            bump_token_version(shop.merchant_id, active_shop=shop, updated_at=timezone.now())
+            shop.merchant.active_shop_id = shop.pk
+            jobs.enqueue('merchant.discovery.refresh_category', {'category_id': shop.category_id, 'shop_ids': [shop.pk]})
+
+            data = serializer.data
+            if hasattr(request.user, 'shop_slugs'):
+                shop.merchant.refresh_from_db(fields=['token_version'])
+                refresh = MerchantRefreshToken.for_user(shop.merchant)
+                data = {
+                    **data,
+                    'tokens': {
+                        'access_token': str(refresh.access_token),
+                        'refresh_token': str(refresh),
+                    },
+                }
+            return Response(data, status.HTTP_201_CREATED)
         return Response(serializer.errors, status.HTTP_400_BAD_REQUEST)
 
 
 class MyActiveShopSerializerView(APIView):
     permission_classes = [IsMerchantShop]
     def get(self, request, shop_slug):
-        merchant = request.user
-        my_shops = Shop.objects.filter(merchant=merchant)
-        my_shops.update(active=False)   # Deactivating all the merchant's shops
-        shop = Shop.objects.get(slug=shop_slug)
-        shop.active=True    #activating my specific shop
+        shop = get_request_shop(request, shop_slug)
+        serializer = MyShopDetailSerializer(shop)
+        return Response(serializer.data)
+
+    @idempotent
+    def post(self, request, shop_slug):
+        shop = get_request_shop(request, shop_slug)
+        Merchant.objects.filter(pk=request.user.pk).update(active_shop=shop, updated_at=timezone.now())    #activating my specific shop
+        shop.merchant.active_shop_id = shop.pk
         serializer = MyShopDetailSerializer(shop)
         return Response(serializer.data)
 
 
 
-class ConnectionRequestCreateView(APIView):
+class ConnectionRequestCreateView(ListAPIView):
     permission_classes = [IsMerchantShop]
     @extend_schema(
         request=ShopSerializer, # Serializer used for the request body
@@ -148,27 +184,29 @@ class ConnectionRequestCreateView(APIView):
 
     def get(self, request, shop_slug):
 
-        sender_shop = get_object_or_404(Shop, slug=shop_slug)
-        sender_shop.active=True
-        sender_shop.save()
+        sender_shop = get_request_shop(request, shop_slug)
         query = ShopConnection.objects.filter(sender_shop=sender_shop) #.values_list('receiver_shop', flat=True)
 
-        serializer = ConnectionRequestSerializer(query, many=True)
-        return Response(serializer.data)
+        return self.list_response(query, ConnectionRequestSerializer)
 
+    @idempotent
     def post(self, request, shop_slug):
         serializer = ConnectionRequestSerializer(data=request.data)
         if serializer.is_valid():
             receiver_shop_id = serializer.validated_data.get('receiver_shop_id')
-            sender_shop = get_object_or_404(Shop, slug=shop_slug)
+            sender_shop = get_request_shop(request, shop_slug)
             # status = serializer.validated_data.get('status')
             receiver_shop = Shop.objects.get(id=receiver_shop_id)
             if sender_shop.category==receiver_shop.category:
-                connection = ShopConnection.objects.create(
-                    sender_shop=sender_shop,
-                    receiver_shop=receiver_shop,
-                    status='pending'
-                )
+                try:
+                    with transaction.atomic():
+                        connection = ShopConnection.objects.create(
+                            sender_shop=sender_shop,
+                            receiver_shop=receiver_shop,
+                            status='pending'
+                        )
+                except IntegrityError:
+                    raise ValidationError('You already sent a request to this shop.')
 
                 res = ConnectionRequestSerializer(connection)
                 return Response(res.data, status=status.HTTP_201_CREATED)
@@ -177,7 +215,7 @@ class ConnectionRequestCreateView(APIView):
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class ConnectionReceivedView(APIView):
+class ConnectionReceivedView(ListAPIView):
     permission_classes = [IsMerchantShop]
     @extend_schema(
         request=ConnectionResponseSerializer, # Serializer used for the request body
@@ -186,13 +224,10 @@ class ConnectionReceivedView(APIView):
 
     def get(self, request, shop_slug):
 
-        receiver_shop = get_object_or_404(Shop, slug=shop_slug)
-        receiver_shop.active=True
-        receiver_shop.save()
+        receiver_shop = get_request_shop(request, shop_slug)
         query = ShopConnection.objects.filter(receiver_shop=receiver_shop) #.values_list('receiver_shop', flat=True)
 
-        serializer = ConnectionResponseSerializer(query, many=True)
-        return Response(serializer.data)
+        return self.list_response(query, ConnectionResponseSerializer)
 
 
 class ConnectionResponseView(APIView):
@@ -204,208 +239,275 @@ class ConnectionResponseView(APIView):
 
     def get(self, request, shop_slug, shopconnection_uid):
 
-        receiver_shop = get_object_or_404(Shop, slug=shop_slug)
-        receiver_shop.active=True
-        receiver_shop.save()
+        receiver_shop = get_request_shop(request, shop_slug)
         query = ShopConnection.objects.filter(uid=shopconnection_uid) #.values_list('receiver_shop', flat=True)
+        query = ConnectionResponseSerializer.setup_eager_loading(query)
 
         serializer = ConnectionResponseSerializer(query, many=True)
         return Response(serializer.data)
 
+    @idempotent
     def patch(self, request, shop_slug, shopconnection_uid):
-        receiver_shop = get_object_or_404(Shop, slug=shop_slug)
-        receiver_shop.active = True
-        receiver_shop.save()
+        receiver_shop = get_request_shop(request, shop_slug)
 
         shop_connection = get_object_or_404(ShopConnection, uid=shopconnection_uid, receiver_shop=receiver_shop)
 
         serializer = ConnectionResponseSerializer(shop_connection, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
-        if serializer.validated_data.get('status') == 'approved':
-            sender_shop = shop_connection.sender_shop
-
-            ShopConnection.objects.create(sender_shop=receiver_shop, receiver_shop=sender_shop, status='approved')
-
-        elif serializer.validated_data.get('status') == 'declined':
-            shop_connection.delete()
-        serializer.save()
+        sender_shop = shop_connection.sender_shop
+        with transaction.atomic():
+            if serializer.validated_data.get('status') == 'approved':
+                # The reverse row may already exist as a crossed pending request.
+                ShopConnection.objects.update_or_create(
+                    sender_shop=receiver_shop, receiver_shop=sender_shop, defaults={'status': 'approved'}
+                )
+                ShopNeighbor.objects.connect(receiver_shop, sender_shop)
+
+            elif serializer.validated_data.get('status') == 'declined':
+                shop_connection.delete()
+                # Declining an approved connection ends it in both directions.
+                ShopConnection.objects.filter(
+                    sender_shop=receiver_shop, receiver_shop=sender_shop, status='approved'
+                ).delete()
+                ShopNeighbor.objects.disconnect(receiver_shop, sender_shop)
+                # Nothing is kept, so the sender may ask again later.
+                shop_connection.status = 'declined'
+                return Response(ConnectionResponseSerializer(shop_connection).data)
+            serializer.save()
 
         return Response(serializer.data)
 
 
-class MyProductView(APIView):
+class MyProductView(ListAPIView):
     permission_classes = [IsMerchantShop]
+    last_modified_fields = ('updated_at', 'shop__updated_at', 'shop__merchant__updated_at', 'shop__category__updated_at')
+    compiled_serializers = True
     def get(self, request, shop_slug):
-        active_shop = Shop.objects.get(slug=shop_slug)
-        active_shop.active = True
-        active_shop.save()
+        active_shop = get_request_shop(request, shop_slug)
 
         my_products = Product.objects.filter(shop=active_shop)
-        serializer = ProductSerializer(my_products, many=True)
-        return Response(serializer.data)
+        return self.list_response(my_products, ProductSerializer)
 
+    @idempotent
     def post(self,request, shop_slug):
-        # merchant = request.user.merchant
-
-        all_shop = Shop.objects.all().update(active=False)
-        print(all_shop)
-        active_shop = Shop.objects.get(slug=shop_slug)
-        active_shop.active = True
-        active_shop.save()
+        active_shop = get_request_shop(request, shop_slug)
         serializer = ProductSerializer(data=request.data)
         if serializer.is_valid():
-            shop = get_object_or_404(Shop, active=True)
-
-            product = serializer.save(shop=shop)
+            product = serializer.save(shop=active_shop)
             product_serializer = ProductSerializer(product)
             return Response(product_serializer.data, status=status.HTTP_201_CREATED)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class SameCategoryShop(APIView):
+class ProductImportView(APIView):
     permission_classes = [IsMerchantShop]
+    parser_classes = [MultiPartParser]
+
+    @idempotent
+    def post(self, request, shop_slug):
+        active_shop = get_request_shop(request, shop_slug)
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError('Upload the catalog as a "file" field.')
+        import_type = request.query_params.get('type') or guess_import_type(upload.name)
+        if import_type not in IMPORT_TYPES:
+            raise ValidationError(f'Unsupported import type, use one of: {", ".join(IMPORT_TYPES)}.')
+
+        report = import_products(active_shop, iter_rows(upload, import_type))
+        return Response(report, status=status.HTTP_201_CREATED if report['created'] else status.HTTP_400_BAD_REQUEST)
+
+
+class SameCategoryShop(ListAPIView):
+    permission_classes = [IsMerchantShop]
+    compiled_serializers = True
     def get(self,request,shop_slug):
-        current_shop = get_object_or_404(Shop, slug=shop_slug)
+        current_shop = get_request_shop(request, shop_slug)
         same_category_shops = Shop.objects.filter(category=current_shop.category)
 
-        res = ShopSerializer(same_category_shops, many=True)
-        return Response(res.data,status.HTTP_200_OK)
+        return self.list_response(same_category_shops, ShopSerializer)
 
-class ConnectedShops(APIView):
+class DiscoverShops(ListAPIView):
     permission_classes = [IsMerchantShop]
+    pagination_class = RankedPagination
+
+    # Ranked shops of the same category to connect to, precomputed by
+    # merchant.discovery. Shops connected or requested since the last refresh
+    # are filtered out here.
     def get(self, request, shop_slug):
-        active_shop = get_object_or_404(Shop, slug=shop_slug)
-        sender_shops = active_shop.sent_connections.filter(status='approved').values_list('receiver_shop', flat=True)
-        connected_shops = Shop.objects.filter(pk__in=sender_shops)
-        serializer = ShopSerializer(connected_shops, many=True)
-        return Response(serializer.data)
+        current_shop = get_request_shop(request, shop_slug)
+        # A new shop is ranked by a job queued when it is created; until then
+        # (or when no shop qualifies) the list is simply empty.
+        candidates = ShopCandidate.objects.filter(shop=current_shop).exclude(
+            candidate_id__in=ShopConnection.objects.filter(sender_shop=current_shop).values('receiver_shop_id')
+        ).exclude(
+            candidate_id__in=ShopConnection.objects.filter(receiver_shop=current_shop).values('sender_shop_id')
+        )
+        return self.list_response(candidates, ShopCandidateSerializer)
+
+
+class ConnectedShops(ListAPIView):
+    permission_classes = [IsMerchantShop]
+    last_modified_fields = ('updated_at', 'merchant__updated_at', 'category__updated_at')
+    compiled_serializers = True
+    def get(self, request, shop_slug):
+        active_shop = get_request_shop(request, shop_slug)
+        connected_shops = Shop.objects.filter(pk__in=ShopNeighbor.objects.neighbor_ids(active_shop))
+        return self.list_response(connected_shops, ShopSerializer)
 
 
-class BuyProducts(APIView):
+class BuyProducts(ListAPIView):
     permission_classes = [IsMerchantShop]
+    last_modified_fields = ('updated_at', 'shop__updated_at', 'shop__merchant__updated_at', 'shop__category__updated_at')
+    compiled_serializers = True
     def get(self, request, shop_slug):
         # user = request.user
-        active_shop = get_object_or_404(Shop, slug=shop_slug)
-        sender_shops = active_shop.sent_connections.filter(status='approved').values_list('receiver_shop', flat=True)
-        connected_shops = Shop.objects.filter(pk__in=sender_shops)
-        products = Product.objects.filter(shop__in=connected_shops)
-        serializer = ProductSerializer(products,many=True)
-        return Response(serializer.data)
+        active_shop = get_request_shop(request, shop_slug)
+        products = Product.objects.filter(shop_id__in=ShopNeighbor.objects.neighbor_ids(active_shop))
+        return self.list_response(products, ProductSerializer)
 
+    @idempotent
     def post(self, request, shop_slug):
-        active_shop = get_object_or_404(Shop, slug=shop_slug)
+        active_shop = get_request_shop(request, shop_slug)
         # print('---------------active shop----',active_shop.id)
+        if 'items' in request.data:
+            return self.post_batch(request, active_shop)
 
-        sender_shops = active_shop.sent_connections.filter(status='approved').values_list('receiver_shop', flat=True)
-        connected_shops = Shop.objects.filter(pk__in=sender_shops)
-        user = request.user
-        # print('----------user----------',user)
+        connected_shops = ShopNeighbor.objects.neighbor_ids(active_shop)
         product_serializer = BuyProductSerializer(data=request.data)
         if product_serializer.is_valid():
             product_uid = product_serializer.validated_data['uid']
-            product = Product.objects.get(uid=product_uid)
-            price = product.price
             quantity = product_serializer.validated_data['quantity']
-            total_price = 0
-            product = get_object_or_404(Product, uid=product_uid, shop__in=connected_shops)
-            # net_price = product.price*quantity
-            try:
-                cart = Cart.objects.get(shop=active_shop,user=request.user)
-            except:
-                cart = Cart.objects.create(shop=active_shop,user=request.user,total_price=0)
-            cart_items = cart.cartitem_set.filter(shop=active_shop)
-
-            for item in cart_items:
-                total_price+=item.net_price
-            cart.total_price = total_price
-            cart.save()
-            net_price = quantity*price
-            cart_item,_ = CartItem.objects.get_or_create(cart=cart,shop=active_shop, user=user, product=product,quantity=quantity,net_price = net_price)
-
-
-            cart_item.quantity = quantity
-            cart_item.save()
+            product = get_object_or_404(Product, uid=product_uid, shop_id__in=connected_shops)
+
+            cart = get_or_create_cart(active_shop, request.user)
+            if set_cart_line(cart, product, quantity) == 'out_of_stock':
+                raise ValidationError('Not enough stock for this product.')
 
             return Response(product_serializer.data, status=status.HTTP_200_OK)
         else:
             return Response(product_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    def post_batch(self, request, active_shop):
+        serializer = BuyProductBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # Later lines for the same product win, like repeated single adds.
+        quantities = {line['uid']: line['quantity'] for line in serializer.validated_data['items']}
+
+        products = Product.objects.filter(
+            uid__in=quantities,
+            shop_id__in=ShopNeighbor.objects.neighbor_ids(active_shop),
+        ).only('id', 'uid', 'price', 'stock_shards')
+        products_by_uid = {product.uid: product for product in products}
+
+        cart = get_or_create_cart(active_shop, request.user)
+        outcomes = set_cart_lines(
+            cart, [(product, quantities[uid]) for uid, product in products_by_uid.items()]
+        )
+
+        results = []
+        for uid, quantity in quantities.items():
+            product = products_by_uid.get(uid)
+            line_status = outcomes[product.pk] if product else 'unavailable'
+            results.append({'uid': uid, 'quantity': quantity, 'status': line_status})
+        return Response(
+            {'items': BuyProductLineSerializer(results, many=True).data},
+            status=status.HTTP_200_OK,
+        )
+
+
+class ProductSearchView(APIView):
+    permission_classes = [IsMerchantShop]
+
+    @extend_schema(parameters=[ProductSearchSerializer], responses={200: ProductSerializer(many=True)})
+    def get(self, request, shop_slug):
+        active_shop = get_request_shop(request, shop_slug)
+        params = ProductSearchSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        products = search_products(active_shop, params.validated_data['q'], params.validated_data['limit'])
+        return Response({'results': ProductSerializer(products, many=True).data})
+
+
+class ShopAnalyticsView(APIView):
+    permission_classes = [IsMerchantShop]
+
+    # Answered from the daily rollups in merchant.sales, so the cost depends
+    # on the length of the range, not on the number of orders.
+    @extend_schema(parameters=[AnalyticsQuerySerializer])
+    def get(self, request, shop_slug):
+        active_shop = get_request_shop(request, shop_slug)
+        params = AnalyticsQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return Response(shop_analytics(active_shop, params.validated_data['start'], params.validated_data['end'],
+                                       params.validated_data['limit']))
+
 
 class CartItems(APIView):
     permission_classes = [IsMerchantShop]
     def get(self, request, shop_slug):
-        active_shop = get_object_or_404(Shop, slug=shop_slug)
-        total_price = 0
+        active_shop = get_request_shop(request, shop_slug)
         try:
-            cart = Cart.objects.prefetch_related("cartitem_set").get(shop=active_shop)
-        except:
+            cart = CartSerializer.setup_eager_loading(Cart.objects).get(shop=active_shop, user_id=request.user.pk, order=None)
+        except Cart.DoesNotExist:
             raise ValidationError('No cart for you')
-        cart_items = cart.cartitem_set.filter(shop=active_shop,user=request.user)
-
-        for item in cart.cartitem_set.filter():
-            print(item)
-            total_price+=item.net_price
-        cart.total_price=total_price
-        cart.save()
         serializer = CartSerializer(cart)
 
         return Response(serializer.data)
 
+    @extend_schema(
+        request=CartItemRemoveSerializer,
+        responses={200: CartSerializer},
+    )
+    @idempotent
+    def delete(self, request, shop_slug):
+        active_shop = get_request_shop(request, shop_slug)
+        serializer = CartItemRemoveSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            cart = Cart.objects.get(shop=active_shop, user_id=request.user.pk, order=None)
+        except Cart.DoesNotExist:
+            raise ValidationError('No cart for you')
+        product = get_object_or_404(Product, uid=serializer.validated_data['uid'])
+        if not remove_cart_line(cart, product):
+            raise ValidationError('This product is not in your cart.')
+
+        cart = CartSerializer.setup_eager_loading(Cart.objects).get(pk=cart.pk)
+        return Response(CartSerializer(cart).data)
+
 
-class OrderItems(APIView):
+class OrderItems(ListAPIView):
     permission_classes = [IsMerchantShop]
     def get(self, request, shop_slug):
-        active_shop = get_object_or_404(Shop, slug=shop_slug)
-        total_price = 0
-        order = Order.objects.prefetch_related("orderitem_set").filter(shop=active_shop)
-        # order_items = order.orderitem_set.filter(shop=active_shop,user=request.user)
-        cart = Cart.objects.get(shop=active_shop)
-        total_price = cart.total_price
-
-        order.total_price=total_price
-        # order.save()
-        cart.delete()
-        serializer = OrderSerializer(order, many=True)
+        active_shop = get_request_shop(request, shop_slug)
+        order = Order.objects.filter(shop=active_shop)
 
-        return Response(serializer.data)
+        return self.list_response(order, OrderSerializer)
 
 
 
 class OrderView(APIView):
     permission_classes = [IsMerchantShop]
 
+    @idempotent
     def post(self, request, shop_slug):
-        shop = get_object_or_404(Shop, slug=shop_slug)
-        try:
-            cart = Cart.objects.get(shop=shop)
-        except:
-            raise ValidationError("You didn't add any products in your Cart")
-        total_price = cart.total_price
-        print('----------------------',total_price)
-
-        cart_items = CartItem.objects.filter(shop=shop, user=request.user)
+        shop = get_request_shop(request, shop_slug)
         serializer = OrderSerializer(data=request.data)
         if serializer.is_valid():
             delivery_address = serializer.validated_data['delivery_address']
             payment_method = serializer.validated_data['payment_method']
 
-            # Create the order
-            order = Order.objects.create(user=request.user, shop=shop, delivery_address=delivery_address, payment_method=payment_method,total_price=total_price)
-
-            for cart_item in cart_items:
-                OrderItem.objects.create(
-                    user=request.user,
-                    shop=shop,
-                    order=order,
-                    product=cart_item.product,
-                    quantity=cart_item.quantity,
-                    net_price= cart_item.net_price
-                )
-
-
-            cart_items.delete()
-
+            # Checkout does a fixed amount of work whatever the cart size: the
+            # order is recorded as PENDING, takes over the cart, and a job
+            # (merchant.orders.process_order) commits the stock and writes
+            # the order lines.
+            with transaction.atomic():
+                cart = Cart.objects.select_for_update().filter(shop=shop, user_id=request.user.pk, order=None).first()
+                if cart is None or not CartItem.objects.filter(cart=cart).exists():
+                    raise ValidationError("You didn't add any products in your Cart")
+                order = Order.objects.create(user_id=request.user.pk, shop=shop, delivery_address=delivery_address, payment_method=payment_method,total_price=cart.total_price)
+                Cart.objects.filter(pk=cart.pk).update(order=order)
+                jobs.enqueue('merchant.orders.process_order', {'order_id': order.pk})
+
+            serializer = OrderSerializer(order)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-